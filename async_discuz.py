@@ -0,0 +1,172 @@
+"""
+异步签到引擎
+与同步引擎执行同一份流程（Login/Discuz中用steps.step装饰的方法），只是由steps.arun()在事件循环中驱动：
+请求在事件循环中按论坛排队，轮到时才在线程中发出；验证码识别以及会话缓存、运行记录、站点配置的读写
+也在线程中执行。大量账号的等待时间可以在同一个事件循环里重叠，而不需要每个账号占用一个线程
+
+cloudscraper没有异步客户端，为了保留Cloudflare处理能力，单个HTTP请求通过asyncio.to_thread在线程池中执行
+
+用法:
+    python async_discuz.py accounts.yaml --concurrency 200 --per-host 20
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from batch import load_accounts, format_results
+from captcha_stats import CaptchaStats
+from discuz import Discuz
+from journal import RunJournal
+from metrics import RunMetrics, write_reports
+from ocr_service import get_ocr_service
+from session_cache import SessionCache
+from steps import arun
+
+
+class AsyncDiscuz:
+    """
+    Discuz的异步接口，内部持有一个同步Discuz对象，执行它的流程
+    """
+    def __init__(self, sync_discuz):
+        """
+        参数:
+            sync_discuz: discuz.Discuz对象
+        """
+        self.sync = sync_discuz
+
+    @classmethod
+    async def create(cls, *args, **kwargs):
+        """
+        创建对象，参数与Discuz相同；发布页解析和会话创建在线程中执行，论坛地址确定后才创建会话
+        """
+        return cls(await asyncio.to_thread(Discuz, *args, **kwargs))
+
+    @property
+    def hostname(self):
+        return self.sync.hostname
+
+    @property
+    def metrics(self):
+        return self.sync.metrics
+
+    async def login(self, force=False):
+        await arun(self.sync.login.steps(force))
+
+    async def signin(self):
+        return await arun(self.sync.signin.steps())
+
+    async def check_signed(self):
+        return await arun(self.sync.check_signed.steps())
+
+    async def signin_with_recovery(self):
+        return await arun(self.sync.signin_with_recovery.steps())
+
+    async def report_credit(self):
+        await arun(self.sync.report_credit.steps())
+
+    async def run_daily(self, journal=None, host=None, lean=False):
+        return await arun(self.sync.run_daily.steps(journal, host, lean))
+
+    async def visit_home(self):
+        return await arun(self.sync.visit_home.steps())
+
+
+async def run_account(account, host_limit, session_cache, captcha_stats=None, lean=False, journal=None):
+    """
+    执行单个账号的签到流程，返回与batch.py相同格式的结果字典
+    """
+    result = {
+        'hostname': account.get('hostname') or account.get('pub_url'),
+        'username': account['username'],
+        'login': False,
+        'signin': False,
+        'visit': False,
+        'skipped': False,
+        'seconds': 0.0,
+        'error': '',
+    }
+    start = time.time()
+    journal_host = result['hostname']
+    metrics = RunMetrics(result['hostname'], account['username'])
+    async with host_limit:
+        try:
+            discuz = await AsyncDiscuz.create(account.get('hostname', ''), account['username'], account['password'],
+                                              questionid=str(account.get('questionid', '0')),
+                                              answer=account.get('answer'), pub_url=account.get('pub_url', ''),
+                                              session_cache=session_cache, captcha_stats=captcha_stats,
+                                              metrics=metrics, scheme=account.get('scheme', 'https'))
+            result.update(await discuz.run_daily(journal, journal_host, lean))
+            result['hostname'] = discuz.hostname
+            if not result['signin']:
+                result['error'] = '签到失败'
+        except Exception as e:
+            logging.error(f"账号 {account['username']} 执行过程中发生错误: {e}")
+            result['error'] = str(e)
+    result['seconds'] = round(time.time() - start, 1)
+    result['metrics'] = metrics.report()
+    return result
+
+
+async def run_accounts(accounts, concurrency=100, per_host=20, session_cache=None, captcha_stats=None, lean=False,
+                       journal=None):
+    """
+    在一个事件循环中执行所有账号
+
+    参数:
+        accounts: 账号字典列表
+        concurrency: 同时进行中的请求线程数上限
+        per_host: 同一论坛同时执行的账号数上限
+        session_cache: SessionCache对象，为None时不使用会话缓存
+        captcha_stats: CaptchaStats对象，为None时不统计验证码
+        lean: 为True时只签到，不输出积分和金币数量
+        journal: RunJournal对象，今天已完成的步骤不再重复执行，为None时不记录
+    """
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='request'))
+
+    host_limits = {}
+    tasks = []
+    for account in accounts:
+        host = account.get('hostname') or account.get('pub_url')
+        host_limit = host_limits.setdefault(host, asyncio.Semaphore(per_host))
+        tasks.append(run_account(account, host_limit, session_cache, captcha_stats, lean, journal))
+    return await asyncio.gather(*tasks)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Discuz多账号异步签到')
+    parser.add_argument('accounts', help='账号文件路径（YAML/JSON/CSV）')
+    parser.add_argument('--concurrency', type=int, default=100, help='同时进行的请求数上限，默认100')
+    parser.add_argument('--per-host', type=int, default=20, help='同一论坛的并发账号数，默认20')
+    parser.add_argument('--no-session-cache', action='store_true', help='不使用会话缓存')
+    parser.add_argument('--lean', action='store_true', help='只签到，不输出积分和金币数量')
+    parser.add_argument('--no-journal', action='store_true', help='不使用运行记录，重新执行所有步骤')
+    parser.add_argument('--output', help='把结果以JSON格式写入该文件')
+    parser.add_argument('--metrics-dir', help='运行报告保存目录，默认取环境变量METRICS_DIR')
+    args = parser.parse_args(argv)
+
+    accounts = load_accounts(args.accounts)
+    session_cache = None if args.no_session_cache else SessionCache()
+    journal = None if args.no_journal else RunJournal()
+    results = asyncio.run(run_accounts(accounts, args.concurrency, args.per_host, session_cache, CaptchaStats(),
+                                       args.lean, journal))
+
+    print(format_results(results))
+    logging.info(f'验证码识别统计: {get_ocr_service().stats()}')
+    write_reports([r['metrics'] for r in results], args.metrics_dir)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+    failed = [r for r in results if r['error']]
+    logging.info(f'共 {len(results)} 个账号，失败 {len(failed)} 个')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
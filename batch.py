@@ -0,0 +1,194 @@
+"""
+多账号批量签到
+在一个进程内用线程池完成所有账号的 登录 -> 签到 -> 访问用户主页，
+所有账号共用进程内的验证码识别服务，并限制同一论坛的并发数
+
+用法:
+    python batch.py accounts.yaml --workers 8 --per-host 2
+
+账号文件支持YAML/JSON/CSV，每个账号包含以下字段:
+    hostname, username, password, questionid(可选), answer(可选), pub_url(可选), scheme(可选，默认https)
+"""
+
+import argparse
+import csv
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from captcha_stats import CaptchaStats
+from discuz import Discuz
+from journal import RunJournal
+from metrics import RunMetrics, write_reports
+from ocr_service import get_ocr_service
+from session_cache import SessionCache
+
+ACCOUNT_FIELDS = ('hostname', 'username', 'password', 'questionid', 'answer', 'pub_url', 'scheme')
+
+
+def load_accounts(path):
+    """
+    读取账号文件，根据扩展名选择格式
+
+    返回:
+        账号字典列表
+    """
+    ext = os.path.splitext(path)[1].lower()
+    with open(path, 'r', encoding='utf-8') as f:
+        if ext in ('.yaml', '.yml'):
+            try:
+                import yaml
+            except ImportError:
+                raise Exception('读取YAML账号文件需要安装PyYAML: pip install pyyaml')
+            data = yaml.safe_load(f)
+        elif ext == '.json':
+            data = json.load(f)
+        elif ext == '.csv':
+            data = list(csv.DictReader(f))
+        else:
+            raise Exception(f'不支持的账号文件格式: {path}')
+
+    # 兼容 {accounts: [...]} 的写法
+    if isinstance(data, dict):
+        data = data.get('accounts', [])
+
+    accounts = []
+    for i, item in enumerate(data):
+        account = {k: item[k] for k in ACCOUNT_FIELDS if item.get(k) not in (None, '')}
+        if not account.get('username') or not account.get('password') or \
+                not (account.get('hostname') or account.get('pub_url')):
+            raise Exception(f'第{i + 1}个账号缺少 hostname/pub_url, username 或 password')
+        accounts.append(account)
+    return accounts
+
+
+class BatchRunner:
+    """
+    多账号批量签到执行器
+    """
+    def __init__(self, accounts, workers=4, per_host=2, session_cache=None, captcha_stats=None, lean=False,
+                 journal=None):
+        """
+        参数:
+            accounts: 账号字典列表
+            workers: 线程池大小
+            per_host: 同一论坛同时执行的账号数上限
+            session_cache: SessionCache对象，为None时不使用会话缓存
+            captcha_stats: CaptchaStats对象，为None时不统计验证码
+            lean: 为True时只签到，不输出积分和金币数量
+            journal: RunJournal对象，今天已完成的步骤不再重复执行，为None时不记录
+        """
+        self.accounts = accounts
+        self.workers = workers
+        self.per_host = per_host
+        self.session_cache = session_cache
+        self.captcha_stats = captcha_stats
+        self.lean = lean
+        self.journal = journal
+        self.host_limits = {}
+        self.lock = threading.Lock()
+
+    def host_limit(self, host):
+        with self.lock:
+            if host not in self.host_limits:
+                self.host_limits[host] = threading.BoundedSemaphore(self.per_host)
+            return self.host_limits[host]
+
+    def run_account(self, account):
+        """
+        执行单个账号的签到流程
+
+        返回:
+            结果字典
+        """
+        result = {
+            'hostname': account.get('hostname') or account.get('pub_url'),
+            'username': account['username'],
+            'login': False,
+            'signin': False,
+            'visit': False,
+            'skipped': False,
+            'seconds': 0.0,
+            'error': '',
+        }
+        start = time.time()
+        # 运行记录使用账号文件中的地址，发布页解析出的地址变化时仍能对应
+        journal_host = result['hostname']
+        metrics = RunMetrics(result['hostname'], account['username'])
+        with self.host_limit(result['hostname']):
+            try:
+                discuz = Discuz(account.get('hostname', ''), account['username'], account['password'],
+                                questionid=str(account.get('questionid', '0')), answer=account.get('answer'),
+                                pub_url=account.get('pub_url', ''), session_cache=self.session_cache,
+                                captcha_stats=self.captcha_stats, metrics=metrics,
+                                scheme=account.get('scheme', 'https'))
+                result['hostname'] = discuz.hostname
+                result.update(discuz.run_daily(self.journal, journal_host, self.lean))
+                if not result['signin']:
+                    result['error'] = '签到失败'
+            except Exception as e:
+                logging.error(f"账号 {account['username']} 执行过程中发生错误: {e}")
+                result['error'] = str(e)
+        result['seconds'] = round(time.time() - start, 1)
+        result['metrics'] = metrics.report()
+        return result
+
+    def run(self):
+        """
+        执行所有账号，按账号文件中的顺序返回结果
+        """
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='account') as pool:
+            return list(pool.map(self.run_account, self.accounts))
+
+
+def format_results(results):
+    """
+    把结果格式化为文本表格
+    """
+    columns = ['hostname', 'username', 'login', 'signin', 'visit', 'skipped', 'seconds', 'error']
+    rows = [[str(r[c]) for c in columns] for r in results]
+    widths = [max(len(c), *(len(row[i]) for row in rows)) if rows else len(c) for i, c in enumerate(columns)]
+    lines = ['  '.join(c.ljust(w) for c, w in zip(columns, widths)).rstrip()]
+    lines.append('  '.join('-' * w for w in widths))
+    for row in rows:
+        lines.append('  '.join(v.ljust(w) for v, w in zip(row, widths)).rstrip())
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Discuz多账号批量签到')
+    parser.add_argument('accounts', help='账号文件路径（YAML/JSON/CSV）')
+    parser.add_argument('--workers', type=int, default=4, help='线程池大小，默认4')
+    parser.add_argument('--per-host', type=int, default=2, help='同一论坛的并发账号数，默认2')
+    parser.add_argument('--no-session-cache', action='store_true', help='不使用会话缓存')
+    parser.add_argument('--lean', action='store_true', help='只签到，不输出积分和金币数量')
+    parser.add_argument('--no-journal', action='store_true', help='不使用运行记录，重新执行所有步骤')
+    parser.add_argument('--output', help='把结果以JSON格式写入该文件')
+    parser.add_argument('--metrics-dir', help='运行报告保存目录，默认取环境变量METRICS_DIR')
+    args = parser.parse_args(argv)
+
+    accounts = load_accounts(args.accounts)
+    session_cache = None if args.no_session_cache else SessionCache()
+    runner = BatchRunner(accounts, workers=args.workers, per_host=args.per_host, session_cache=session_cache,
+                         captcha_stats=CaptchaStats(), lean=args.lean,
+                         journal=None if args.no_journal else RunJournal())
+    results = runner.run()
+
+    print(format_results(results))
+    logging.info(f'验证码识别统计: {get_ocr_service().stats()}')
+    write_reports([r['metrics'] for r in results], args.metrics_dir)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+    failed = [r for r in results if r['error']]
+    logging.info(f'共 {len(results)} 个账号，失败 {len(failed)} 个')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,390 @@
+"""
+离线性能测试
+在本地启动模拟Discuz服务器（mock_discuz.py），用多个账号跑完整的
+登录 -> 签到 -> 访问用户主页 流程，统计：
+    - 每秒完成的登录数
+    - 每个阶段耗时的p50/p99
+    - 验证码识别准确率（服务器端校验通过次数/校验次数）
+    - 每个账号增加的内存
+    - 每个账号建立的连接数；另外用一个会话多次读取首页，读到需要的内容就停止，检查连接是否被复用
+    - 访问用户主页时，论坛首页帖子列表中的作者是否都学习到了UID池中
+    - 冷启动（--startup）：在新进程中导入discuz并完成一次无验证码登录和签到的耗时和峰值内存，
+      以及是否误导入了验证码识别相关的模块
+结果可保存为基线，之后的修改用--compare和基线对比，超过阈值时退出码为1
+
+用法:
+    python bench.py --accounts 20 --workers 8 --latency 0.02 --output bench_baseline.json
+    python bench.py --accounts 20 --workers 8 --latency 0.02 --compare bench_baseline.json
+"""
+
+import argparse
+import contextlib
+import importlib
+import json
+import logging
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from discuz import Discuz
+from login import UID_PATTERN
+from metrics import RunMetrics
+from mock_discuz import MockConfig, MockDiscuzServer
+from page_stream import read_until
+from session_cache import SessionCache
+import store
+from store import JsonStore
+
+# 对比基线时检查的指标，值越大越好为True
+COMPARE_KEYS = {
+    'logins_per_sec': True,
+    'ocr_accuracy': True,
+    'total_p50': False,
+    'total_p99': False,
+    'rss_per_account_kb': False,
+    'startup_import_seconds': False,
+    'startup_rss_kb': False,
+}
+
+# 保存在缓存目录中的进程内共享对象，切换缓存目录时需要重新创建
+CACHE_SINGLETONS = (
+    ('cf_clearance', '_clearance_cache'),
+    ('home_visit', '_uid_pool'),
+    ('host_cache', '_host_cache'),
+    ('site_profile', '_profiles'),
+)
+
+# 无验证码登录时不应导入的模块
+OCR_MODULES = ('ddddocr', 'onnxruntime', 'numpy', 'PIL')
+
+# 在新进程中运行的冷启动测试
+STARTUP_SCRIPT = '''
+import json, resource, sys, time
+start = time.perf_counter()
+import discuz
+import_seconds = time.perf_counter() - start
+from metrics import RunMetrics
+from mock_discuz import MockConfig, MockDiscuzServer
+with MockDiscuzServer(MockConfig(captcha=False)) as server:
+    start = time.perf_counter()
+    d = discuz.Discuz(server.hostname, 'startup', server.httpd.config.password,
+                      metrics=RunMetrics(sleep_scale=0), scheme='http')
+    d.login()
+    d.signin()
+    run_seconds = time.perf_counter() - start
+print(json.dumps({
+    'import_seconds': import_seconds,
+    'run_seconds': run_seconds,
+    'rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    'ocr_modules': [m for m in %r if m in sys.modules],
+}))
+''' % (OCR_MODULES,)
+
+
+@contextlib.contextmanager
+def isolated_cache(cache_dir):
+    """
+    运行期间把缓存目录（会话、Cloudflare验证、UID池、站点配置、验证码统计等）切换到cache_dir，
+    包括冷启动测试的子进程，模拟服务器的地址不会写入真实的缓存目录，结束后恢复
+    """
+    saved_env = os.environ.get('DISCUZ_CACHE_DIR')
+    saved_dir = store.CACHE_DIR
+    saved = {}
+    for module_name, attr in CACHE_SINGLETONS:
+        module = importlib.import_module(module_name)
+        saved[module, attr] = getattr(module, attr)
+        setattr(module, attr, None)
+    os.environ['DISCUZ_CACHE_DIR'] = store.CACHE_DIR = cache_dir
+    try:
+        yield cache_dir
+    finally:
+        store.CACHE_DIR = saved_dir
+        if saved_env is None:
+            os.environ.pop('DISCUZ_CACHE_DIR', None)
+        else:
+            os.environ['DISCUZ_CACHE_DIR'] = saved_env
+        for (module, attr), value in saved.items():
+            setattr(module, attr, value)
+
+
+def percentile(values, p):
+    """
+    计算百分位数（最近秩法）
+    """
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = max(0, min(len(values) - 1, int(round(p / 100 * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+def max_rss_kb():
+    # Linux下ru_maxrss单位为KB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class Benchmark:
+    """
+    对模拟服务器运行一轮签到流程
+    """
+    def __init__(self, server, accounts=10, workers=4, sleep_scale=0.0, session_cache=None, visit=True, lean=False):
+        """
+        参数:
+            server: 已启动的MockDiscuzServer
+            accounts: 账号数量
+            workers: 并发线程数
+            sleep_scale: 主动等待时间的倍数，默认0跳过等待，只测量实际开销
+            session_cache: SessionCache对象，为None时每个账号都完整登录
+            visit: 是否访问用户主页
+            lean: 为True时只签到，不输出积分和金币数量
+        """
+        self.server = server
+        self.accounts = accounts
+        self.workers = workers
+        self.sleep_scale = sleep_scale
+        self.session_cache = session_cache
+        self.visit = visit
+        self.lean = lean
+
+    def run_account(self, index):
+        username = f'bench{index}'
+        metrics = RunMetrics(self.server.hostname, username, sleep_scale=self.sleep_scale)
+        error = ''
+        start = time.perf_counter()
+        try:
+            discuz = Discuz(self.server.hostname, username, self.server.httpd.config.password,
+                            session_cache=self.session_cache, metrics=metrics, scheme='http')
+            discuz.login()
+            discuz.signin()
+            if not self.lean:
+                discuz.report_credit()
+            if self.visit:
+                discuz.visit_home()
+        except Exception as e:
+            error = str(e)
+        return {
+            'username': username,
+            'error': error,
+            'elapsed': time.perf_counter() - start,
+            'metrics': metrics.report(),
+        }
+
+    def run(self):
+        """
+        运行并返回汇总结果
+        """
+        stats_before = self.server.stats
+        rss_before = max_rss_kb()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            results = list(executor.map(self.run_account, range(self.accounts)))
+        elapsed = time.perf_counter() - start
+        rss_after = max_rss_kb()
+        stats = {k: v - stats_before.get(k, 0) for k, v in self.server.stats.items()}
+        return summarize(results, elapsed, stats, rss_after - rss_before, rss_after)
+
+
+def check_connection_reuse(server, repeat=5):
+    """
+    用同一个会话多次流式读取论坛首页，每次读到用户ID就停止，剩余内容读完丢弃后连接应当被复用
+
+    返回:
+        建立的连接数，连接被复用时为1
+    """
+    before = server.stats['connections']
+    with requests.Session() as session:
+        for _ in range(repeat):
+            read_until(session.get(f'http://{server.hostname}/forum.php', stream=True), [UID_PATTERN])
+    return server.stats['connections'] - before
+
+
+def missing_listed_uids(server):
+    """
+    模拟论坛首页帖子列表中的作者没有保存到UID池的部分
+
+    返回:
+        缺少的UID列表，全部学习到时为空
+    """
+    entry = JsonStore('uid_pool.json').load().get(server.hostname, {})
+    return sorted(set(server.httpd.config.listed_uids()) - set(entry.get('valid', [])))
+
+
+def measure_startup(repeat=3):
+    """
+    在新进程中测量冷启动，取多次运行的中位数
+
+    返回:
+        冷启动耗时和峰值内存
+    """
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True, check=True).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+    ocr_modules = sorted({m for run in runs for m in run['ocr_modules']})
+    if ocr_modules:
+        logging.error(f'无验证码登录导入了验证码识别模块: {", ".join(ocr_modules)}')
+    return {
+        'startup_import_seconds': round(statistics.median(r['import_seconds'] for r in runs), 4),
+        'startup_run_seconds': round(statistics.median(r['run_seconds'] for r in runs), 4),
+        'startup_rss_kb': max(r['rss_kb'] for r in runs),
+        'startup_ocr_modules': ocr_modules,
+    }
+
+
+def summarize(results, elapsed, server_stats, rss_delta_kb, rss_kb):
+    """
+    汇总每个账号的运行结果
+    """
+    succeeded = [r for r in results if not r['error']]
+    stage_walls = {}
+    for r in results:
+        for stage, values in r['metrics']['stages'].items():
+            stage_walls.setdefault(stage, []).append(values['wall'])
+    totals = [r['elapsed'] for r in results]
+    checks = server_stats.get('captcha_checks', 0)
+    return {
+        'accounts': len(results),
+        'failed': len(results) - len(succeeded),
+        'errors': sorted({r['error'] for r in results if r['error']}),
+        'elapsed': round(elapsed, 3),
+        'logins_per_sec': round(len(succeeded) / elapsed, 3) if elapsed else 0.0,
+        'total_p50': round(percentile(totals, 50), 4),
+        'total_p99': round(percentile(totals, 99), 4),
+        'stages': {
+            stage: {'p50': round(percentile(walls, 50), 4), 'p99': round(percentile(walls, 99), 4)}
+            for stage, walls in sorted(stage_walls.items())
+        },
+        'ocr_accuracy': round(server_stats.get('captcha_passes', 0) / checks, 3) if checks else None,
+        'requests_per_account': round(server_stats.get('requests', 0) / len(results), 1) if results else 0,
+        'connections_per_account': round(server_stats.get('connections', 0) / len(results), 1) if results else 0,
+        'rss_kb': rss_kb,
+        'rss_per_account_kb': round(rss_delta_kb / len(results), 1) if results else 0,
+        'server': server_stats,
+    }
+
+
+def compare(summary, baseline, threshold=0.1):
+    """
+    与基线对比，返回超过阈值的退化项列表
+    """
+    regressions = []
+    for key, higher_is_better in COMPARE_KEYS.items():
+        old, new = baseline.get(key), summary.get(key)
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        worse = -change if higher_is_better else change
+        logging.info(f'{key}: 基线 {old} -> 当前 {new} ({change:+.1%})')
+        if worse > threshold:
+            regressions.append(f'{key} 退化 {worse:.1%}')
+    return regressions
+
+
+def format_summary(summary):
+    lines = [
+        f'账号数: {summary["accounts"]}，失败: {summary["failed"]}，总耗时: {summary["elapsed"]}s',
+        f'登录速度: {summary["logins_per_sec"]} 个/秒，单账号耗时 p50 {summary["total_p50"]}s / p99 {summary["total_p99"]}s',
+        f'验证码识别准确率: {summary["ocr_accuracy"]}，每个账号请求数: {summary["requests_per_account"]}，'
+        f'连接数: {summary["connections_per_account"]}',
+        f'内存: {summary["rss_kb"]} KB，每个账号增加 {summary["rss_per_account_kb"]} KB',
+        '阶段耗时:',
+    ]
+    for stage, values in summary['stages'].items():
+        lines.append(f'  {stage:<12} p50 {values["p50"]:.4f}s  p99 {values["p99"]:.4f}s')
+    if 'startup_import_seconds' in summary:
+        lines.append(f'冷启动: 导入 {summary["startup_import_seconds"]}s，无验证码登录和签到 '
+                     f'{summary["startup_run_seconds"]}s，峰值内存 {summary["startup_rss_kb"]} KB，'
+                     f'验证码识别模块: {", ".join(summary["startup_ocr_modules"]) or "未导入"}')
+    for error in summary['errors']:
+        lines.append(f'错误: {error}')
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='基于本地模拟服务器的离线性能测试')
+    parser.add_argument('--accounts', type=int, default=10, help='账号数量，默认10')
+    parser.add_argument('--workers', type=int, default=4, help='并发线程数，默认4')
+    parser.add_argument('--latency', type=float, default=0.0, help='模拟服务器每个请求的延迟（秒）')
+    parser.add_argument('--jitter', type=float, default=0.0, help='模拟服务器的随机延迟上限（秒）')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='模拟服务器返回502的概率')
+    parser.add_argument('--no-captcha', action='store_true', help='登录不需要验证码')
+    parser.add_argument('--cf-challenges', type=int, default=0, help='没有cf_clearance的会话先返回几次Cloudflare验证页')
+    parser.add_argument('--signin-plugin', default='k_misign', choices=('k_misign', 'dsu_paulsign'), help='安装的签到插件')
+    parser.add_argument('--sleep-scale', type=float, default=0.0, help='主动等待时间的倍数，默认0')
+    parser.add_argument('--session-cache', action='store_true', help='再用会话缓存跑一轮，测量缓存命中时的开销')
+    parser.add_argument('--no-visit', action='store_true', help='不访问用户主页')
+    parser.add_argument('--lean', action='store_true', help='只签到，不输出积分和金币数量')
+    parser.add_argument('--startup', action='store_true', help='同时测量新进程的冷启动耗时和峰值内存')
+    parser.add_argument('--profile', metavar='DIR', help='在性能分析模式下运行（与discuz.py --profile相同），'
+                                                        '分析结果写入该目录')
+    parser.add_argument('--output', help='把结果以JSON格式写入该文件，可作为基线')
+    parser.add_argument('--compare', help='与该基线文件对比')
+    parser.add_argument('--threshold', type=float, default=0.1, help='允许的退化比例，默认0.1')
+    args = parser.parse_args(argv)
+
+    logging.getLogger().setLevel(logging.WARNING)
+    config = MockConfig(latency=args.latency, jitter=args.jitter, failure_rate=args.failure_rate,
+                        captcha=not args.no_captcha, cf_challenges=args.cf_challenges,
+                        signin_plugin=args.signin_plugin)
+    with MockDiscuzServer(config) as server, tempfile.TemporaryDirectory() as cache_dir, isolated_cache(cache_dir):
+        session_cache = SessionCache() if args.session_cache else None
+        bench = Benchmark(server, args.accounts, args.workers, args.sleep_scale, session_cache, not args.no_visit,
+                          args.lean)
+        profiler = None
+        if args.profile:
+            from profiling import RunProfiler
+            profiler = RunProfiler(args.profile).start()
+        try:
+            summary = bench.run()
+        finally:
+            if profiler:
+                profiler.stop()
+        if args.startup:
+            summary.update(measure_startup())
+        summary['reuse_connections'] = check_connection_reuse(server)
+        summary['missing_listed_uids'] = missing_listed_uids(server) if bench.visit else []
+        print(format_summary(summary))
+        print(f'同一会话提前停止读取5次首页，建立连接 {summary["reuse_connections"]} 个')
+        if session_cache is not None:
+            summary['cached'] = bench.run()
+            print('\n会话缓存命中:')
+            print(format_summary(summary['cached']))
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        logging.getLogger().setLevel(logging.INFO)
+        regressions = compare(summary, baseline, args.threshold)
+        for regression in regressions:
+            logging.error(regression)
+        if regressions:
+            return 1
+    if summary.get('startup_ocr_modules'):
+        return 1
+    if summary['missing_listed_uids']:
+        logging.error(f'论坛首页帖子列表中的作者没有加入UID池: {summary["missing_listed_uids"]}')
+        return 1
+    if summary['reuse_connections'] != 1:
+        logging.error(f'提前停止读取后连接没有被复用，5次读取建立了 {summary["reuse_connections"]} 个连接')
+        return 1
+    if config.captcha and not summary['ocr_accuracy']:
+        # 模拟验证码应当能被识别，准确率为0说明验证码图片或识别流程有问题，其它指标没有意义
+        logging.error(f'验证码识别准确率为 {summary["ocr_accuracy"]}，检查模拟服务器的验证码和识别流程')
+        return 1
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
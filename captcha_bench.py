@@ -0,0 +1,171 @@
+"""
+验证码识别离线测试
+用带标注的验证码图片集合比较不同预处理步骤和字符集的效果，统计：
+    - 一次识别正确的比例（不区分大小写，与Discuz校验一致）
+    - 预处理和识别耗时的平均值和p99
+    - 每个预处理步骤的平均耗时
+
+图片文件名的第一段为答案，例如 k3m7.png、k3m7_12.gif；可以用--generate通过模拟服务器的验证码生成一批图片。
+--pipelines中的第一组设置作为基线，基线的准确率为0时说明图片无法识别，不再比较其它设置，退出码为1
+
+用法:
+    python captcha_bench.py captchas --generate 200 --frames 3
+    python captcha_bench.py captchas --pipelines "" frame frame,gray,binarize frame,gray,binarize,denoise --charset alnum
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import time
+
+from bench import percentile
+from captcha_pipeline import Pipeline, resolve_charset
+from ocr_service import OCRService
+
+IMAGE_EXTENSIONS = ('.png', '.gif', '.jpg', '.jpeg', '.bmp', '.webp')
+
+
+def load_corpus(corpus_dir):
+    """
+    读取图片集合
+
+    返回:
+        (文件名, 答案, 图片二进制数据) 列表
+    """
+    samples = []
+    for name in sorted(os.listdir(corpus_dir)):
+        stem, ext = os.path.splitext(name)
+        if ext.lower() not in IMAGE_EXTENSIONS:
+            continue
+        with open(os.path.join(corpus_dir, name), 'rb') as f:
+            samples.append((name, stem.split('_')[0], f.read()))
+    return samples
+
+
+def generate_corpus(corpus_dir, count, frames=1, noise=True):
+    """
+    用模拟服务器的验证码生成带标注的图片
+    """
+    from mock_discuz import CAPTCHA_CHARS, render_captcha
+
+    os.makedirs(corpus_dir, exist_ok=True)
+    ext = 'gif' if frames > 1 else 'png'
+    for index in range(count):
+        code = ''.join(random.choices(CAPTCHA_CHARS, k=4))
+        with open(os.path.join(corpus_dir, f'{code}_{index}.{ext}'), 'wb') as f:
+            f.write(render_captcha(code, noise, frames))
+    logging.info(f'已生成 {count} 张验证码图片: {corpus_dir}')
+
+
+def evaluate(samples, pipeline, charset, service):
+    """
+    用一组设置识别全部图片
+
+    返回:
+        结果字典
+    """
+    correct = 0
+    prep_times = []
+    ocr_times = []
+    stage_times = {}
+    confidences = []
+    failures = []
+    for name, label, data in samples:
+        start = time.perf_counter()
+        try:
+            processed = pipeline.process(data, stage_times)
+        except Exception as e:
+            logging.error(f'{name} 预处理失败: {str(e)}')
+            processed = data
+        prep_times.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        try:
+            code, confidence = service.classification_with_confidence(processed, charset)
+        except Exception as e:
+            logging.error(f'{name} 识别失败: {str(e)}')
+            code, confidence = '', None
+        ocr_times.append(time.perf_counter() - start)
+
+        if confidence is not None:
+            confidences.append(confidence)
+        if code.lower() == label.lower():
+            correct += 1
+        elif len(failures) < 10:
+            failures.append(f'{name}: {code}')
+
+    total = len(samples)
+    return {
+        'pipeline': pipeline.spec,
+        'accuracy': round(correct / total, 4) if total else 0.0,
+        'prep_avg_ms': round(statistics.mean(prep_times) * 1000, 2) if total else 0.0,
+        'prep_p99_ms': round(percentile(prep_times, 99) * 1000, 2),
+        'ocr_avg_ms': round(statistics.mean(ocr_times) * 1000, 2) if total else 0.0,
+        'ocr_p99_ms': round(percentile(ocr_times, 99) * 1000, 2),
+        'stage_avg_ms': {name: round(seconds / total * 1000, 3) for name, seconds in stage_times.items()},
+        'avg_confidence': round(statistics.mean(confidences), 4) if confidences else None,
+        'failures': failures,
+    }
+
+
+def format_results(results):
+    lines = [f'{"预处理":<36} {"准确率":>8} {"预处理ms":>10} {"p99":>8} {"识别ms":>8} {"p99":>8} {"置信度":>8}']
+    for result in results:
+        confidence = result['avg_confidence'] if result['avg_confidence'] is not None else '-'
+        lines.append(f'{result["pipeline"] or "(无)":<36} {result["accuracy"]:>8} {result["prep_avg_ms"]:>10} '
+                     f'{result["prep_p99_ms"]:>8} {result["ocr_avg_ms"]:>8} {result["ocr_p99_ms"]:>8} {confidence:>8}')
+        if result['stage_avg_ms']:
+            stages = '，'.join(f'{name} {ms}ms' for name, ms in result['stage_avg_ms'].items())
+            lines.append(f'    各步骤平均耗时: {stages}')
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='验证码预处理和识别的离线测试')
+    parser.add_argument('corpus', help='验证码图片目录，文件名的第一段为答案')
+    parser.add_argument('--generate', type=int, default=0, help='先用模拟服务器的验证码生成这么多张图片')
+    parser.add_argument('--frames', type=int, default=1, help='生成图片的帧数，大于1时生成GIF动图')
+    parser.add_argument('--no-noise', action='store_true', help='生成的图片不加干扰线')
+    parser.add_argument('--pipelines', nargs='+', default=['', 'frame', 'frame,gray,binarize', 'frame,gray,binarize,denoise'],
+                        help='要比较的预处理步骤，空字符串表示不做预处理')
+    parser.add_argument('--charset', default='', help='识别结果允许的字符集，例如alnum')
+    parser.add_argument('--limit', type=int, default=0, help='最多使用多少张图片')
+    parser.add_argument('--output', help='把结果以JSON格式写入该文件')
+    args = parser.parse_args(argv)
+
+    if args.generate:
+        generate_corpus(args.corpus, args.generate, args.frames, not args.no_noise)
+    samples = load_corpus(args.corpus)
+    if args.limit:
+        samples = samples[:args.limit]
+    if not samples:
+        logging.error(f'没有找到验证码图片: {args.corpus}')
+        return 1
+
+    service = OCRService()
+    service.warm_up()
+    charset = resolve_charset(args.charset)
+    logging.getLogger().setLevel(logging.WARNING)
+    # 第一组设置作为基线，先确认基线能识别出一部分图片，否则图片本身有问题（例如字体太小），比较其它设置没有意义
+    baseline = evaluate(samples, Pipeline.parse(args.pipelines[0]), charset, service)
+    if not baseline['accuracy']:
+        logging.error(f'基线设置 "{baseline["pipeline"]}" 的识别准确率为0，请检查验证码图片（动图请把frame放在第一组），'
+                      f'识别结果示例: {"，".join(baseline["failures"][:3])}')
+        return 1
+    results = [baseline] + [evaluate(samples, Pipeline.parse(spec), charset, service) for spec in args.pipelines[1:]]
+    print(f'图片数: {len(samples)}，字符集: {args.charset or "不限制"}，模型加载耗时: {service.load_seconds:.2f}s')
+    print(format_results(results))
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'samples': len(samples), 'charset': args.charset, 'results': results}, f,
+                      ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,324 @@
+"""
+验证码预处理模块
+识别前按配置对验证码图片做预处理，提高第一次识别的准确率：
+    frame       动图（GIF）中选择字符最完整的一帧，代替默认的第一帧
+    gray        转为灰度图
+    binarize    二值化，阈值默认用大津法自动确定，也可写成binarize:140
+    denoise     去掉孤立的噪点和细干扰线，denoise:3 表示周围少于3个黑点的黑点视为噪点
+    resize      按模型输入缩放到固定高度，默认64，也可写成resize:48
+
+步骤之间用逗号分隔，例如 frame,gray,binarize,denoise；另外可限制识别结果的字符集，
+例如只允许字母和数字，识别时直接在模型输出的概率上屏蔽其它字符
+
+配置可通过环境变量修改:
+    CAPTCHA_PIPELINE: 预处理步骤，默认frame，设为空字符串时不做预处理
+    CAPTCHA_CHARSET: 识别结果允许的字符集，可以是digits、lower、upper、alpha、alnum或直接列出字符，默认不限制
+    CAPTCHA_SITES: 按论坛覆盖上述设置的JSON，例如 {"www.xxx.com": {"pipeline": "frame,gray,binarize", "charset": "alnum"}}
+
+numpy和PIL只在第一次预处理时导入，不影响不需要验证码的登录
+"""
+
+import io
+import json
+import logging
+import os
+import string
+import threading
+
+CHARSETS = {
+    'digits': string.digits,
+    'lower': string.ascii_lowercase,
+    'upper': string.ascii_uppercase,
+    'alpha': string.ascii_letters,
+    'alnum': string.ascii_letters + string.digits,
+}
+# ddddocr模型的输入高度
+MODEL_HEIGHT = 64
+
+
+def resolve_charset(charset):
+    """
+    把字符集名称转换为字符集合，为空时返回None表示不限制
+    """
+    if not charset:
+        return None
+    return frozenset(CHARSETS.get(charset, charset))
+
+
+class Stage:
+    """
+    预处理步骤，输入和输出都是PIL图片
+    """
+    name = ''
+
+    def applies(self, image):
+        """
+        该步骤对这张图片是否有作用
+        """
+        return True
+
+    def __call__(self, image):
+        raise NotImplementedError
+
+    def __repr__(self):
+        return self.name
+
+
+class FrameSelect(Stage):
+    """
+    动图中选择深色像素最多的一帧，字符闪烁的GIF验证码第一帧常常不完整
+    """
+    name = 'frame'
+
+    def applies(self, image):
+        return getattr(image, 'n_frames', 1) > 1
+
+    def __call__(self, image):
+        import numpy as np
+        from PIL import Image
+
+        if not self.applies(image):
+            return image.convert('RGB')
+        frames = []
+        for index in range(image.n_frames):
+            image.seek(index)
+            frames.append(np.asarray(image.convert('RGB')))
+        stack = np.stack(frames)
+        # 按亮度统计每一帧的深色像素数
+        ink = (stack.mean(axis=3) < 128).sum(axis=(1, 2))
+        return Image.fromarray(stack[int(ink.argmax())])
+
+
+class Grayscale(Stage):
+    name = 'gray'
+
+    def __call__(self, image):
+        return image.convert('L')
+
+
+class Binarize(Stage):
+    """
+    二值化，字符为黑色、背景为白色
+    """
+    name = 'binarize'
+
+    def __init__(self, threshold=None):
+        """
+        参数:
+            threshold: 灰度阈值，为None时用大津法自动确定
+        """
+        self.threshold = int(threshold) if threshold is not None else None
+
+    @staticmethod
+    def otsu(gray):
+        import numpy as np
+
+        hist = np.bincount(gray.ravel(), minlength=256).astype(np.float64)
+        weight = np.cumsum(hist)
+        mean = np.cumsum(hist * np.arange(256))
+        total = weight[-1]
+        background = total - weight
+        with np.errstate(divide='ignore', invalid='ignore'):
+            between = (mean[-1] * weight - mean * total) ** 2 / (weight * background)
+        return int(np.nanargmax(between[:-1]))
+
+    def __call__(self, image):
+        import numpy as np
+        from PIL import Image
+
+        gray = np.asarray(image.convert('L'))
+        threshold = self.threshold if self.threshold is not None else self.otsu(gray)
+        dark = gray <= threshold
+        # 深色像素占多数时说明是深色背景浅色字符，反转
+        if dark.mean() > 0.5:
+            dark = ~dark
+        return Image.fromarray(np.where(dark, 0, 255).astype(np.uint8))
+
+
+class Denoise(Stage):
+    """
+    去掉周围深色像素太少的深色像素（孤立噪点和单像素宽的干扰线）
+    """
+    name = 'denoise'
+
+    def __init__(self, min_neighbors=2):
+        """
+        参数:
+            min_neighbors: 周围8个像素中至少有几个深色像素才保留
+        """
+        self.min_neighbors = int(min_neighbors)
+
+    def __call__(self, image):
+        import numpy as np
+        from PIL import Image
+
+        gray = np.asarray(image.convert('L'))
+        dark = gray < 128
+        padded = np.pad(dark, 1).astype(np.uint8)
+        h, w = dark.shape
+        neighbors = sum(padded[1 + dy:1 + dy + h, 1 + dx:1 + dx + w]
+                        for dy in (-1, 0, 1) for dx in (-1, 0, 1) if dy or dx)
+        return Image.fromarray(np.where(dark & (neighbors < self.min_neighbors), 255, gray).astype(np.uint8))
+
+
+class Resize(Stage):
+    """
+    按比例缩放到模型输入的高度
+    """
+    name = 'resize'
+
+    def __init__(self, height=MODEL_HEIGHT):
+        self.height = int(height)
+
+    def applies(self, image):
+        return image.height != self.height
+
+    def __call__(self, image):
+        from PIL import Image
+
+        width = max(1, round(image.width * self.height / image.height))
+        resample = Image.Resampling.LANCZOS if hasattr(Image, 'Resampling') else Image.LANCZOS
+        return image.resize((width, self.height), resample)
+
+
+STAGES = {stage.name: stage for stage in (FrameSelect, Grayscale, Binarize, Denoise, Resize)}
+
+
+class Pipeline:
+    """
+    按顺序执行的预处理步骤
+    """
+    def __init__(self, stages=()):
+        self.stages = list(stages)
+
+    @classmethod
+    def parse(cls, spec):
+        """
+        从配置字符串创建，例如 'frame,gray,binarize:140,denoise'
+        """
+        stages = []
+        for item in (spec or '').split(','):
+            item = item.strip()
+            if not item:
+                continue
+            name, _, arg = item.partition(':')
+            if name not in STAGES:
+                raise ValueError(f'未知的验证码预处理步骤: {name}')
+            stages.append(STAGES[name](arg) if arg else STAGES[name]())
+        return cls(stages)
+
+    @property
+    def spec(self):
+        return ','.join(stage.name for stage in self.stages)
+
+    def run(self, image, timings=None):
+        """
+        依次执行各步骤
+
+        参数:
+            image: PIL图片
+            timings: 字典，传入时累加每个步骤的耗时（秒）
+
+        返回:
+            处理后的PIL图片
+        """
+        import time
+
+        for stage in self.stages:
+            start = time.perf_counter()
+            image = stage(image)
+            if timings is not None:
+                timings[stage.name] = timings.get(stage.name, 0.0) + time.perf_counter() - start
+        return image
+
+    def process(self, img_bytes, timings=None):
+        """
+        预处理验证码图片
+
+        参数:
+            img_bytes: 原始图片二进制数据
+            timings: 字典，传入时累加每个步骤的耗时（秒）
+
+        返回:
+            处理后的PNG二进制数据，所有步骤都不起作用时原样返回
+        """
+        if not self.stages:
+            return img_bytes
+        from PIL import Image
+
+        with Image.open(io.BytesIO(img_bytes)) as image:
+            if not any(stage.applies(image) for stage in self.stages):
+                return img_bytes
+            image = self.run(image, timings)
+            buffer = io.BytesIO()
+            image.save(buffer, format='PNG', compress_level=1)
+        return buffer.getvalue()
+
+
+class CaptchaSettings:
+    """
+    按论坛的验证码预处理和字符集设置
+    """
+    def __init__(self, pipeline=None, charset=None, sites=None):
+        """
+        参数:
+            pipeline: 默认预处理步骤，默认取环境变量CAPTCHA_PIPELINE
+            charset: 默认字符集，默认取环境变量CAPTCHA_CHARSET
+            sites: 论坛主机地址 -> {'pipeline': ..., 'charset': ...}，默认取环境变量CAPTCHA_SITES
+        """
+        self.pipeline = pipeline if pipeline is not None else os.environ.get('CAPTCHA_PIPELINE', 'frame')
+        self.charset = charset if charset is not None else os.environ.get('CAPTCHA_CHARSET', '')
+        self.sites = sites if sites is not None else self._sites_from_env()
+        self._resolved = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _sites_from_env():
+        try:
+            return json.loads(os.environ.get('CAPTCHA_SITES') or '{}')
+        except Exception as e:
+            logging.error(f'CAPTCHA_SITES格式错误: {str(e)}')
+            return {}
+
+    def configure(self, hostname, **kwargs):
+        """
+        修改一个论坛的设置，参数为pipeline和charset
+        """
+        with self._lock:
+            self.sites[hostname] = {**self.sites.get(hostname, {}), **kwargs}
+            self._resolved.pop(hostname, None)
+
+    def for_host(self, hostname):
+        """
+        获取论坛的设置
+
+        返回:
+            (Pipeline对象, 允许的字符集合或None)
+        """
+        with self._lock:
+            if hostname not in self._resolved:
+                site = self.sites.get(hostname, {})
+                spec = site.get('pipeline', self.pipeline)
+                try:
+                    pipeline = Pipeline.parse(spec)
+                except ValueError as e:
+                    logging.error(f'{hostname} 的验证码预处理配置错误，不做预处理: {str(e)}')
+                    pipeline = Pipeline()
+                self._resolved[hostname] = (pipeline, resolve_charset(site.get('charset', self.charset)))
+            return self._resolved[hostname]
+
+
+_settings = None
+_settings_lock = threading.Lock()
+
+
+def get_captcha_settings():
+    """
+    获取进程内共享的验证码预处理设置
+    """
+    global _settings
+    if _settings is None:
+        with _settings_lock:
+            if _settings is None:
+                _settings = CaptchaSettings()
+    return _settings
@@ -0,0 +1,130 @@
+"""
+验证码识别统计模块
+按论坛记录识别置信度、每次登录用了几轮验证码以及识别失败的字符类型，
+并据此调整验证码重试次数，统计结果保存在缓存目录中，跨运行累积
+"""
+
+import logging
+import math
+import os
+
+from store import JsonStore
+
+# 统计样本不足时使用的默认重试次数
+DEFAULT_RETRY_BUDGET = 10
+# 达到该样本数后才根据统计调整
+MIN_SAMPLES = 5
+# 最多保留的置信度样本数
+MAX_CONFIDENCE_SAMPLES = 200
+
+
+def char_class(char):
+    """
+    字符类型，用于统计哪类字符容易识别错误
+    """
+    if char.isdigit():
+        return 'digit'
+    if char.isascii() and char.isupper():
+        return 'upper'
+    if char.isascii() and char.islower():
+        return 'lower'
+    return 'other'
+
+
+class CaptchaStats:
+    """
+    按论坛统计验证码识别情况
+    """
+    def __init__(self, store=None, min_confidence=None, target_success=0.99, min_budget=3, max_budget=20):
+        """
+        参数:
+            store: JsonStore对象，默认保存到缓存目录下的captcha_stats.json
+            min_confidence: 低于该置信度的识别结果不提交校验；
+                'auto'表示根据统计自动确定，默认取环境变量CAPTCHA_MIN_CONFIDENCE，未设置时不过滤
+            target_success: 计算重试次数时希望达到的登录成功率
+            min_budget: 重试次数下限
+            max_budget: 重试次数上限
+        """
+        self.store = store or JsonStore('captcha_stats.json')
+        if min_confidence is None:
+            min_confidence = os.environ.get('CAPTCHA_MIN_CONFIDENCE') or None
+        if min_confidence is not None and min_confidence != 'auto':
+            min_confidence = float(min_confidence)
+        self.min_confidence = min_confidence
+        self.target_success = target_success
+        self.min_budget = min_budget
+        self.max_budget = max_budget
+        self._cache = None
+
+    def _host_stats(self, hostname):
+        if self._cache is None:
+            self._cache = self.store.load()
+        return self._cache.get(hostname, {})
+
+    def retry_budget(self, hostname):
+        """
+        根据单次校验的成功率计算验证码重试次数，
+        使登录在该次数内成功的概率达到target_success
+        """
+        stats = self._host_stats(hostname)
+        checks = stats.get('checks', 0)
+        if checks < MIN_SAMPLES:
+            return DEFAULT_RETRY_BUDGET
+
+        rate = stats.get('check_success', 0) / checks
+        if rate <= 0:
+            return self.max_budget
+        if rate >= 1:
+            return self.min_budget
+        budget = math.ceil(math.log(1 - self.target_success) / math.log(1 - rate))
+        return max(self.min_budget, min(self.max_budget, budget))
+
+    def confidence_threshold(self, hostname):
+        """
+        识别结果的最低置信度，返回None表示不过滤
+        """
+        if self.min_confidence != 'auto':
+            return self.min_confidence
+
+        # 自动模式：取校验失败样本置信度的中位数，但不超过成功样本的下四分位数
+        stats = self._host_stats(hostname)
+        passed = sorted(stats.get('passed_confidence', []))
+        failed = sorted(stats.get('failed_confidence', []))
+        if len(passed) < MIN_SAMPLES or len(failed) < MIN_SAMPLES:
+            return None
+        return min(failed[len(failed) // 2], passed[len(passed) // 4])
+
+    def record(self, hostname, checks, solved):
+        """
+        记录一次登录中的验证码识别结果
+
+        参数:
+            hostname: 论坛地址
+            checks: [(验证码, 置信度, 是否通过校验)]列表
+            solved: 是否最终通过验证码
+        """
+        with self.store.update() as data:
+            stats = data.setdefault(hostname, {})
+            stats['logins'] = stats.get('logins', 0) + 1
+            stats['solved'] = stats.get('solved', 0) + (1 if solved else 0)
+            if solved:
+                attempts = stats.setdefault('attempts', {})
+                attempts[str(len(checks))] = attempts.get(str(len(checks)), 0) + 1
+
+            for code, confidence, passed in checks:
+                stats['checks'] = stats.get('checks', 0) + 1
+                if passed:
+                    stats['check_success'] = stats.get('check_success', 0) + 1
+                key = 'passed' if passed else 'failed'
+                if confidence is not None:
+                    samples = stats.setdefault(f'{key}_confidence', [])
+                    samples.append(round(confidence, 4))
+                    del samples[:-MAX_CONFIDENCE_SAMPLES]
+                classes = stats.setdefault(f'{key}_chars', {})
+                for char in code:
+                    cls = char_class(char)
+                    classes[cls] = classes.get(cls, 0) + 1
+            self._cache = data
+
+        logging.info(f'验证码统计: {hostname} 本次校验 {len(checks)} 次，'
+                     f'累计通过 {stats.get("check_success", 0)}/{stats.get("checks", 0)}')
@@ -0,0 +1,220 @@
+"""
+Cloudflare验证缓存模块
+按论坛保存通过Cloudflare验证后得到的cf_clearance和对应的User-Agent，同一论坛的所有账号和之后的运行共用：
+    - 缓存未过期时直接写入新会话，不再请求首页等待验证
+    - 论坛没有开启验证时也记录下来，一段时间内不再检查
+    - 同一进程内同一论坛只有一个账号在等待验证，其它账号等它完成后直接使用结果
+    - 请求再次遇到验证页面时删除该论坛的缓存
+    - cf_clearance与出口IP绑定，使用代理时按代理地址分别缓存
+
+判断是否遇到验证只看状态码和响应头（cf-mitigated），旧版本的验证页面只读取第一块内容查找标记
+
+配置可通过环境变量修改:
+    CF_CLEARANCE_TTL: cf_clearance没有过期时间时的有效期（秒），默认1800
+    CF_CHECK_TTL: 论坛没有开启验证时，多久之后再检查（秒），默认6小时
+"""
+
+import logging
+import os
+import re
+import threading
+import time
+from urllib.parse import urlsplit
+
+from store import JsonStore
+from transport import get_transport
+
+CF_CLEARANCE_TTL = int(os.environ.get('CF_CLEARANCE_TTL', 1800))
+CF_CHECK_TTL = int(os.environ.get('CF_CHECK_TTL', 6 * 3600))
+CLEARANCE_COOKIE = 'cf_clearance'
+CHALLENGE_STATUSES = (403, 429, 503)
+CHALLENGE_PATTERN = re.compile(r'cf-browser-verification|challenge-platform|cf_chl_opt')
+
+
+def is_challenge(response):
+    """
+    根据状态码和响应头判断响应是否为Cloudflare验证页面，不读取响应内容
+    """
+    if response.headers.get('cf-mitigated') == 'challenge':
+        return True
+    return (response.status_code in CHALLENGE_STATUSES
+            and response.headers.get('server', '').lower() == 'cloudflare')
+
+
+def retry_after(response, default):
+    """
+    响应头中的Retry-After（秒），没有时返回default
+    """
+    try:
+        return max(0.0, float(response.headers.get('retry-after')))
+    except (TypeError, ValueError):
+        return default
+
+
+class ClearanceCache:
+    """
+    论坛 -> Cloudflare验证结果 的缓存
+    """
+    def __init__(self, store=None, ttl=CF_CLEARANCE_TTL, check_ttl=CF_CHECK_TTL, scope=None):
+        """
+        参数:
+            store: JsonStore对象，默认保存到缓存目录下的clearance.json
+            ttl: cf_clearance没有过期时间时的有效期（秒）
+            check_ttl: 论坛没有开启验证时的记录有效期（秒）
+            scope: 出口标识，默认取传输层的代理地址，为空时直接用论坛主机名作为缓存键
+        """
+        self.store = store or JsonStore('clearance.json')
+        self.ttl = ttl
+        self.check_ttl = check_ttl
+        self.scope = scope
+        self._entries = None
+        self._lock = threading.Lock()
+        self._solve_locks = {}
+
+    def _load(self):
+        if self._entries is None:
+            try:
+                self._entries = self.store.load()
+            except Exception as e:
+                logging.error(f'读取Cloudflare验证缓存失败: {str(e)}')
+                self._entries = {}
+        return self._entries
+
+    def _key(self, host):
+        scope = self.scope if self.scope is not None else get_transport().config.proxy
+        return f'{host}|{scope}' if scope else host
+
+    def get(self, host):
+        """
+        获取未过期的缓存
+
+        返回:
+            缓存字典，没有或已过期时返回None
+        """
+        with self._lock:
+            entry = self._load().get(self._key(host))
+        if entry is None or entry['expires'] <= time.time():
+            return None
+        return entry
+
+    def apply(self, session, host):
+        """
+        把缓存的cf_clearance和User-Agent写入会话
+
+        返回:
+            布尔值，表示是否有可用的缓存（包括论坛不需要验证的记录）
+        """
+        entry = self.get(host)
+        if entry is None:
+            return False
+        cookie = entry.get('cookie')
+        if cookie:
+            session.cookies.set(CLEARANCE_COOKIE, cookie['value'], domain=cookie['domain'], path=cookie['path'],
+                                secure=cookie['secure'], expires=cookie['expires'])
+            # cf_clearance与User-Agent绑定，必须使用相同的UA
+            session.headers['User-Agent'] = entry['user_agent']
+        return True
+
+    def save(self, session, host):
+        """
+        保存会话中的cf_clearance，会话中没有时记录为论坛不需要验证
+        """
+        now = time.time()
+        entry = {'cookie': None, 'user_agent': '', 'expires': now + self.check_ttl}
+        for cookie in session.cookies:
+            if cookie.name == CLEARANCE_COOKIE:
+                entry = {
+                    'cookie': {
+                        'value': cookie.value,
+                        'domain': cookie.domain,
+                        'path': cookie.path,
+                        'secure': cookie.secure,
+                        'expires': cookie.expires,
+                    },
+                    'user_agent': session.headers.get('User-Agent', ''),
+                    'expires': cookie.expires or now + self.ttl,
+                }
+                break
+        key = self._key(host)
+        with self._lock:
+            self._load()[key] = entry
+        try:
+            with self.store.update() as data:
+                data[key] = entry
+        except Exception as e:
+            logging.error(f'保存Cloudflare验证缓存失败: {str(e)}')
+        if entry['cookie']:
+            logging.info(f'已缓存 {host} 的Cloudflare验证，有效期至 '
+                         f'{time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(entry["expires"]))}')
+
+    def invalidate(self, host):
+        """
+        删除论坛的缓存
+        """
+        key = self._key(host)
+        with self._lock:
+            if self._load().pop(key, None) is None:
+                return
+        logging.info(f'{host} 的Cloudflare验证已失效')
+        try:
+            with self.store.update() as data:
+                data.pop(key, None)
+        except Exception as e:
+            logging.error(f'删除Cloudflare验证缓存失败: {str(e)}')
+
+    def ensure(self, session, host, solver):
+        """
+        让会话通过论坛的Cloudflare验证，有缓存时直接使用，
+        同一论坛同时只有一个账号调用solver，其它账号等待后使用它的结果
+
+        参数:
+            session: 要写入验证结果的会话
+            host: 论坛主机名
+            solver: 等待验证的函数，成功返回True，通过后的cf_clearance保存在session中
+
+        返回:
+            布尔值，表示是否通过验证
+        """
+        if self.apply(session, host):
+            return True
+        with self._lock:
+            solve_lock = self._solve_locks.setdefault(host, threading.Lock())
+        with solve_lock:
+            # 等待期间其它账号可能已经完成验证
+            if self.apply(session, host):
+                return True
+            if not solver():
+                return False
+            self.save(session, host)
+            return True
+
+    def instrument(self, session):
+        """
+        请求遇到验证页面时删除该论坛的缓存，下次登录重新等待验证
+        """
+        request = session.request
+
+        def checked_request(method, url, **kwargs):
+            response = request(method, url, **kwargs)
+            if is_challenge(response):
+                self.invalidate(urlsplit(url).netloc)
+            return response
+
+        session.request = checked_request
+        return session
+
+
+_clearance_cache = None
+_clearance_cache_lock = threading.Lock()
+
+
+def get_clearance_cache():
+    """
+    获取进程内共享的Cloudflare验证缓存
+    """
+    global _clearance_cache
+    if _clearance_cache is None:
+        with _clearance_cache_lock:
+            if _clearance_cache is None:
+                _clearance_cache = ClearanceCache()
+    return _clearance_cache
@@ -0,0 +1,354 @@
+"""
+常驻调度模式
+进程常驻运行，验证码识别模型、连接池和登录会话一直保持可用，
+每个账号每天在时间窗口内的固定时刻签到（由论坛和用户名决定，重启后不变），
+大量账号的请求分散在一天中，而不是在同一时刻集中访问论坛
+
+    - 启动时今天的签到时刻已过且还没签到的账号会补签，补签时间随机分散在catchup_spread秒内
+    - 失败的账号在retry_delay秒后重试，每天最多max_attempts次
+    - 每个账号的运行状态保存在缓存目录的daemon_state.json中
+    - 本地控制端口提供以下接口:
+        GET  /health              运行状态
+        GET  /status              每个账号的下次运行时间和上次结果
+        POST /run?account=KEY     立即运行一个账号（KEY为 论坛/用户名，省略时运行全部账号）
+
+用法:
+    python daemon.py accounts.yaml --window 00:05-06:00 --port 8765
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import random
+import signal
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from batch import BatchRunner, load_accounts
+from captcha_stats import CaptchaStats
+from journal import RunJournal
+from metrics import write_reports
+from ocr_service import get_ocr_service
+from session_cache import SessionCache
+from store import JsonStore
+
+
+def parse_window(window):
+    """
+    把 HH:MM-HH:MM 格式的时间窗口转换为当天的起止秒数
+    """
+    def seconds(value):
+        hour, minute = value.split(':')
+        return int(hour) * 3600 + int(minute) * 60
+
+    start, end = window.split('-')
+    start, end = seconds(start), seconds(end)
+    if end <= start:
+        raise ValueError(f'时间窗口结束时间必须晚于开始时间: {window}')
+    return start, end
+
+
+def local_midnight(timestamp, days=0):
+    """
+    timestamp所在日期（本地时间）往后days天的0点
+    """
+    t = time.localtime(timestamp)
+    return time.mktime((t.tm_year, t.tm_mon, t.tm_mday + days, 0, 0, 0, 0, 0, -1))
+
+
+def format_time(timestamp):
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp)) if timestamp else ''
+
+
+class AccountSchedule:
+    """
+    一个账号的调度状态
+    """
+    def __init__(self, account, offset):
+        """
+        参数:
+            account: 账号字典
+            offset: 每天签到时刻距离0点的秒数
+        """
+        self.account = account
+        self.offset = offset
+        self.next_run = 0.0
+        self.running = False
+        # 运行中被触发时置为True，本次运行结束后立即再运行一次
+        self.triggered = False
+        self.last_result = None
+
+    @property
+    def key(self):
+        return account_key(self.account)
+
+
+def account_key(account):
+    return f"{account.get('hostname') or account.get('pub_url')}/{account['username']}"
+
+
+class SignDaemon:
+    """
+    常驻签到调度器
+    """
+    def __init__(self, accounts, window=(300, 6 * 3600), workers=4, per_host=2, retry_delay=1800, max_attempts=3,
+                 catchup_spread=600, session_cache=None, captcha_stats=None, lean=False, store=None, journal=None):
+        """
+        参数:
+            accounts: 账号字典列表
+            window: 每天签到的时间窗口，(开始秒数, 结束秒数)，相对本地时间0点
+            workers: 同时运行的账号数
+            per_host: 同一论坛同时运行的账号数
+            retry_delay: 失败后重试的间隔（秒）
+            max_attempts: 每天最多尝试次数
+            catchup_spread: 补签时随机分散的时长（秒）
+            session_cache: SessionCache对象
+            captcha_stats: CaptchaStats对象
+            lean: 为True时只签到，不输出积分和金币数量
+            store: JsonStore对象，默认保存到缓存目录下的daemon_state.json
+            journal: RunJournal对象，重试时跳过今天已完成的步骤
+        """
+        self.window = window
+        self.retry_delay = retry_delay
+        self.max_attempts = max_attempts
+        self.catchup_spread = catchup_spread
+        self.store = store or JsonStore('daemon_state.json')
+        self.runner = BatchRunner(accounts, workers=workers, per_host=per_host, session_cache=session_cache,
+                                  captcha_stats=captcha_stats, lean=lean, journal=journal)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='account')
+        self.entries = {}
+        for account in accounts:
+            entry = AccountSchedule(account, self.scheduled_offset(account))
+            self.entries[entry.key] = entry
+        self.state = self.store.load()
+        self.reports = {}
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.stopped = threading.Event()
+        self.started = time.time()
+
+        now = time.time()
+        for entry in self.entries.values():
+            entry.next_run = self.compute_next_run(entry, now)
+            logging.info(f'{entry.key} 下次签到时间: {format_time(entry.next_run)}')
+
+    def scheduled_offset(self, account):
+        """
+        根据论坛和用户名确定每天的签到时刻，同一账号每天相同
+        """
+        start, end = self.window
+        digest = hashlib.md5(account_key(account).encode('utf-8')).hexdigest()
+        return start + int(digest, 16) % (end - start)
+
+    def compute_next_run(self, entry, now):
+        """
+        计算账号的下次运行时间
+        """
+        today = time.strftime('%Y-%m-%d', time.localtime(now))
+        state = self.state.get(entry.key, {})
+        tomorrow = local_midnight(now, 1) + entry.offset
+        if state.get('date') == today:
+            if state.get('ok') or state.get('attempts', 0) >= self.max_attempts:
+                return tomorrow
+            return state.get('last_attempt', now) + self.retry_delay
+
+        scheduled = local_midnight(now) + entry.offset
+        if scheduled <= now:
+            # 今天的签到时刻已过，分散补签
+            logging.info(f'{entry.key} 今天尚未签到，安排补签')
+            return now + random.uniform(0, self.catchup_spread)
+        return scheduled
+
+    def run_entry(self, entry):
+        """
+        运行一个账号并更新状态
+        """
+        try:
+            result = self.runner.run_account(entry.account)
+        except Exception as e:
+            logging.error(f'{entry.key} 运行失败: {str(e)}', exc_info=True)
+            result = {'error': str(e)}
+
+        now = time.time()
+        today = time.strftime('%Y-%m-%d', time.localtime(now))
+        ok = not result.get('error')
+        try:
+            with self.store.update() as data:
+                previous = data.get(entry.key, {})
+                attempts = previous.get('attempts', 0) + 1 if previous.get('date') == today else 1
+                data[entry.key] = {'date': today, 'ok': ok, 'attempts': attempts, 'last_attempt': now,
+                                   'error': result.get('error', '')}
+                self.state = data
+        except Exception as e:
+            logging.error(f'保存调度状态失败: {str(e)}')
+
+        with self.lock:
+            entry.last_result = {k: v for k, v in result.items() if k != 'metrics'}
+            entry.running = False
+            if entry.triggered:
+                entry.triggered = False
+                entry.next_run = 0.0
+            else:
+                entry.next_run = self.compute_next_run(entry, now)
+            if 'metrics' in result:
+                self.reports[entry.key] = result['metrics']
+            reports = list(self.reports.values())
+        logging.info(f'{entry.key} {"签到完成" if ok else "签到失败"}，下次运行时间: {format_time(entry.next_run)}')
+        # 报告文件中保存每个账号最近一次的结果，不再逐个账号重复输出汇总日志
+        write_reports(reports, log=False)
+        self.wake.set()
+
+    def trigger(self, key=None):
+        """
+        立即运行指定账号，key为None时运行全部账号；正在运行的账号在本次运行结束后再运行一次
+
+        返回:
+            被触发的账号数
+        """
+        with self.lock:
+            entries = [self.entries[key]] if key in self.entries else (
+                list(self.entries.values()) if key is None else [])
+            for entry in entries:
+                if entry.running:
+                    # run_entry结束时会重新计算next_run，直接修改会被覆盖
+                    entry.triggered = True
+                else:
+                    entry.next_run = 0.0
+        self.wake.set()
+        return len(entries)
+
+    def run_forever(self):
+        """
+        调度主循环，直到stop()被调用
+        """
+        threading.Thread(target=get_ocr_service().warm_up, name='ocr-warm-up', daemon=True).start()
+        while not self.stopped.is_set():
+            now = time.time()
+            with self.lock:
+                for entry in self.entries.values():
+                    if not entry.running and entry.next_run <= now:
+                        entry.running = True
+                        self.executor.submit(self.run_entry, entry)
+                waiting = [e.next_run for e in self.entries.values() if not e.running]
+            timeout = min(waiting) - now if waiting else 60
+            self.wake.wait(min(max(timeout, 1), 60))
+            self.wake.clear()
+        self.executor.shutdown(wait=True)
+
+    def stop(self):
+        self.stopped.set()
+        self.wake.set()
+
+    def health(self):
+        with self.lock:
+            running = sum(1 for e in self.entries.values() if e.running)
+            failed = sum(1 for e in self.entries.values() if e.last_result and e.last_result.get('error'))
+        return {
+            'status': 'stopping' if self.stopped.is_set() else 'ok',
+            'uptime': round(time.time() - self.started),
+            'accounts': len(self.entries),
+            'running': running,
+            'failed': failed,
+            'ocr': get_ocr_service().stats(),
+        }
+
+    def status(self):
+        with self.lock:
+            return [{
+                'account': entry.key,
+                'scheduled': time.strftime('%H:%M:%S', time.gmtime(entry.offset)),
+                'next_run': format_time(entry.next_run),
+                'running': entry.running,
+                'triggered': entry.triggered,
+                'state': self.state.get(entry.key, {}),
+                'last_result': entry.last_result,
+            } for entry in self.entries.values()]
+
+
+class ControlHandler(BaseHTTPRequestHandler):
+    """
+    本地控制和健康检查接口
+    """
+    def log_message(self, format, *args):
+        logging.debug(f'控制接口: {format % args}')
+
+    def send_json(self, status, data):
+        body = json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == '/health':
+            self.send_json(200, self.server.sign_daemon.health())
+        elif path == '/status':
+            self.send_json(200, self.server.sign_daemon.status())
+        else:
+            self.send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != '/run':
+            self.send_json(404, {'error': 'not found'})
+            return
+        key = parse_qs(url.query).get('account', [None])[0]
+        count = self.server.sign_daemon.trigger(key)
+        self.send_json(200 if count else 404, {'triggered': count})
+
+
+def start_control_server(daemon, host='127.0.0.1', port=8765):
+    """
+    在后台线程中启动控制接口
+    """
+    server = ThreadingHTTPServer((host, port), ControlHandler)
+    server.daemon_threads = True
+    server.sign_daemon = daemon
+    threading.Thread(target=server.serve_forever, name='control', daemon=True).start()
+    logging.info(f'控制接口: http://{host}:{server.server_address[1]}/health')
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Discuz签到常驻调度')
+    parser.add_argument('accounts', help='账号文件路径（YAML/JSON/CSV）')
+    parser.add_argument('--window', default='00:05-06:00', help='每天签到的时间窗口（本地时间），默认00:05-06:00')
+    parser.add_argument('--workers', type=int, default=4, help='同时运行的账号数，默认4')
+    parser.add_argument('--per-host', type=int, default=2, help='同一论坛的并发账号数，默认2')
+    parser.add_argument('--retry-delay', type=int, default=1800, help='失败后重试的间隔（秒），默认1800')
+    parser.add_argument('--max-attempts', type=int, default=3, help='每天最多尝试次数，默认3')
+    parser.add_argument('--catchup-spread', type=int, default=600, help='补签随机分散的时长（秒），默认600')
+    parser.add_argument('--no-session-cache', action='store_true', help='不使用会话缓存')
+    parser.add_argument('--lean', action='store_true', help='只签到，不输出积分和金币数量')
+    parser.add_argument('--no-journal', action='store_true', help='不使用运行记录')
+    parser.add_argument('--host', default='127.0.0.1', help='控制接口监听地址，默认127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765, help='控制接口端口，默认8765，设为0关闭')
+    args = parser.parse_args(argv)
+
+    session_cache = None if args.no_session_cache else SessionCache()
+    daemon = SignDaemon(load_accounts(args.accounts), window=parse_window(args.window), workers=args.workers,
+                        per_host=args.per_host, retry_delay=args.retry_delay, max_attempts=args.max_attempts,
+                        catchup_spread=args.catchup_spread, session_cache=session_cache,
+                        captcha_stats=CaptchaStats(), lean=args.lean,
+                        journal=None if args.no_journal else RunJournal())
+    server = start_control_server(daemon, args.host, args.port) if args.port else None
+    signal.signal(signal.SIGTERM, lambda *_: daemon.stop())
+    try:
+        daemon.run_forever()
+    except KeyboardInterrupt:
+        daemon.stop()
+    finally:
+        if server is not None:
+            server.shutdown()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
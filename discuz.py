@@ -1,12 +1,21 @@
-import random
+import contextlib
 import login
-import time
 import logging
 import re
 import os
-from random import randint
-import requests
 import sys
+import time
+from captcha_stats import CaptchaStats
+from home_visit import HomeVisitor
+from host_cache import get_host_cache
+from journal import NullJournal, RunJournal
+from k_misign import ALREADY, NOT_LOGGED_IN, INVALID_FORMHASH, OK, UNKNOWN
+from metrics import RunMetrics, timed_stage, write_reports
+from page_stream import decode_response
+from session_cache import SessionCache
+from signin_plugins import DEFAULT_SIGNIN_PLUGIN, SIGNIN_PLUGINS
+from steps import Call, step
+from transport import get_transport
 
 logging.basicConfig(
     level=logging.INFO,
@@ -19,24 +28,75 @@ logging.basicConfig(
 
 class Discuz:
 
-    def __init__(self, hostname, username, password, questionid='0', answer=None, pub_url=''):
+    def __init__(self, hostname, username, password, questionid='0', answer=None, pub_url='', session_cache=None, ocr=None,
+                 captcha_stats=None, metrics=None, scheme='https', visitor=None):
 
+        self.scheme = scheme
+        self.metrics = metrics or RunMetrics(hostname, username)
         self.hostname = hostname
         if pub_url != '':
             self.hostname = self.get_host(pub_url)
+            self.metrics.hostname = self.hostname
+
+        self.discuz_login = login.Login(self.hostname, username, password, questionid, answer, ocr=ocr,
+                                        captcha_stats=captcha_stats, metrics=self.metrics, scheme=scheme)
+        self.session_cache = session_cache
+        self.visitor = visitor or HomeVisitor()
+        # 用户链接在首页的帖子列表中，位于用户栏之后，需要访问用户主页时完整读取首页
+        self.discuz_login.full_home_page = self.visitor.count > 0
 
-        self.discuz_login = login.Login(self.hostname, username, password, questionid, answer)
+    @property
+    def base_url(self):
+        return f'{self.scheme}://{self.hostname}'
 
-    def login(self):
+    @step
+    def login(self, force=False):
         """
         执行登录操作，并获取session和formhash
+        有会话缓存时先尝试恢复缓存的会话，失效时才执行完整登录
+
+        参数:
+            force: 为True时丢弃当前会话和缓存，重新登录
         """
-        self.discuz_login.main()
+        discuz_login = self.discuz_login
+        if force:
+            yield Call(self.discard_session)
+        if not (yield from discuz_login.ensure_clearance.steps()):
+            logging.error('Cloudflare验证未通过，继续尝试登录')
+        if force or self.session_cache is None or not (yield from discuz_login.restore_session.steps(self.session_cache)):
+            if not (yield from discuz_login.main.steps()):
+                raise Exception('登录失败')
+            if self.session_cache is not None:
+                yield Call(self.session_cache.save, discuz_login.session, self.hostname,
+                           discuz_login.username, discuz_login.post_formhash)
         self.session = self.discuz_login.session
         self.formhash = self.discuz_login.post_formhash
 
+    def discard_session(self):
+        """
+        丢弃已失效的会话
+        """
+        if self.session_cache is not None:
+            self.session_cache.invalidate(self.hostname, self.discuz_login.username)
+        self.discuz_login.session.cookies.clear()
+        self.discuz_login.login_page = None
+        self.discuz_login.home_page = None
+
+    @timed_stage('host')
     def get_host(self, pub_url):
-        res = requests.get(pub_url)
+        """
+        获取发布页上的最新论坛地址，结果会被缓存
+        """
+        url = get_host_cache().get(pub_url, self.resolve_host)
+        if url is None:
+            return self.hostname
+        return url
+
+    def resolve_host(self, pub_url):
+        """
+        请求发布页并解析论坛地址，失败时返回None
+        """
+        res = get_transport().plain_session().get(pub_url)
         res.encoding = "utf-8"
         url = re.search(r'a href="https://(.+?)/".+?>.+?入口</a>', res.text)
         if url != None:
@@ -45,85 +105,289 @@ class Discuz:
             return url
         else:
             logging.error(f'获取失败，请检查发布页是否可用{pub_url}')
-            return self.hostname
+            return None
 
     def go_home(self):
-        return self.session.get(f'https://{self.hostname}/forum.php').text
+        return self.session.get(f'{self.base_url}/forum.php').text
 
-    def generate_random_numbers(self, start, end, count):
-        random_numbers = []
-        for _ in range(count):
-            random_number = random.randint(start, end)
-            random_numbers.append(random_number)
-        return random_numbers
+    @step
+    def report_credit(self):
+        """
+        输出积分和金币数量，是签到之后的可选步骤
+        """
+        yield from self.discuz_login.report_credit.steps()
 
+    @property
+    def signin_plugin(self):
+        """
+        论坛使用的签到插件，还未识别时使用k_misign
+        """
+        return SIGNIN_PLUGINS.get(self.discuz_login.profile.signin_plugin) or SIGNIN_PLUGINS[DEFAULT_SIGNIN_PLUGIN]
+
+    def signin_request(self):
+        """
+        构建签到请求
+
+        返回:
+            (请求方法, 签到地址, requests参数字典)
+        """
+        return self.signin_plugin.request(self.base_url, self.formhash)
+
+    @step
+    @timed_stage('signin')
     def signin(self):
         """
         执行论坛签到操作
+
+        返回:
+            SigninResult对象
         """
-        # 构建完整URL
-        base_url = f"https://{self.hostname}/k_misign-sign.html"
-        
-        params = {
-            "operation": "qiandao",
-            "format": "button",
-            "formhash": self.formhash,
-            "inajax": 1,
-            "ajaxtarget": "midaben_sign"
-        }
-        
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/113.0.0.0 Safari/537.36",
-            "Referer": f"https://{self.hostname}/",
-            "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7",
-            "Accept-Language": "zh-CN,zh;q=0.9,en;q=0.8"
-        }
-        
+        method, url, kwargs = self.signin_request()
         try:
-            logging.info(f"正在访问: {base_url}")
-            response = self.session.get(base_url, params=params, headers=headers)
+            logging.info(f"正在访问: {url}")
+            response = yield self.discuz_login.request_step(method, url, **kwargs)
             
-            response.encoding = response.apparent_encoding
+            # 使用论坛已知的页面编码，不对每个响应做编码检测
+            text = decode_response(response)
             
             logging.info(f"签到状态码: {response.status_code}")
-            logging.info(f"签到响应内容: {response.text}")
-            
-            return response.text
+            logging.debug(f"签到响应内容: {text}")
         except Exception as e:
             logging.error(f"签到请求出错: {e}")
+            text = None
+        result = self.signin_plugin.parse_response(text)
+        logging.info(str(result))
+        return result
+
+    def signin_plugin_candidates(self):
+        """
+        查询签到状态时依次尝试的插件，已识别的插件在最前面，其它插件只在它的页面无法识别时才尝试
+        """
+        known = self.discuz_login.profile.signin_plugin
+        plugins = list(SIGNIN_PLUGINS.values())
+        return sorted(plugins, key=lambda plugin: plugin.name != known)
+
+    @step
+    def read_sign_page(self, plugin):
+        """
+        读取插件的签到页面，只读取到签到状态为止
+
+        返回:
+            True 已签到，False 未签到，None 不是该插件的页面或无法判断
+        """
+        try:
+            text = yield self.discuz_login.page_step(plugin.page_url(self.base_url), [plugin.state_pattern])
+            return plugin.parse_page(text)
+        except Exception as e:
+            logging.error(f"读取 {plugin.name} 签到页面失败: {e}")
             return None
 
+    @step
+    @timed_stage('signin')
+    def check_signed(self):
+        """
+        从签到页面查询今天是否已经签到，论坛使用的签到插件在第一次查询时识别并记录
+
+        返回:
+            True 已签到，False 未签到，None 无法判断
+        """
+        for plugin in self.signin_plugin_candidates():
+            state = yield from self.read_sign_page.steps(plugin)
+            if state is not None:
+                yield Call(self.discuz_login.profile.set_signin_plugin, plugin.name)
+                return state
+        logging.error('未能识别论坛的签到插件')
+        return None
+
+    @step
+    def signin_with_recovery(self):
+        """
+        签到，formhash失效时重新获取，登录状态失效时重新登录，各自最多重试一次；
+        响应无法识别时读取签到页面确认
+        """
+        result = yield from self.signin.steps()
+        if result.status == INVALID_FORMHASH:
+            logging.info('formhash已失效，重新获取后再次签到')
+            self.formhash = self.discuz_login.post_formhash = yield from self.discuz_login.get_post_hash.steps()
+            result = yield from self.signin.steps()
+        elif result.status == NOT_LOGGED_IN:
+            logging.info('登录状态已失效，重新登录后再次签到')
+            yield from self.login.steps(force=True)
+            result = yield from self.signin.steps()
+        if result.status == UNKNOWN and (yield from self.check_signed.steps()):
+            # 无法识别签到响应时以签到页面为准，页面仍显示未签到则不算完成，下次运行时重试
+            logging.info('签到页面显示今天已签到')
+            result.status = OK
+        return result
+
+    def journal_step(self, journal, host, name, steps, outcome=None):
+        """
+        执行一个步骤并写入运行记录，步骤内抛出异常时记为failed
+
+        参数:
+            steps: 步骤的流程生成器
+            outcome: 由步骤返回值得到(状态, 详情)的函数，默认记为ok
+
+        返回:
+            步骤的返回值
+        """
+        username = self.discuz_login.username
+        start = time.perf_counter()
+        try:
+            value = yield from steps
+        except Exception as e:
+            yield Call(journal.record, host, username, name, 'failed', str(e), time.perf_counter() - start)
+            raise
+        status, detail = outcome(value) if outcome else ('ok', '')
+        yield Call(journal.record, host, username, name, status, detail, time.perf_counter() - start)
+        return value
+
+    @step
+    def run_daily(self, journal=None, host=None, lean=False):
+        """
+        执行每天的 登录 -> 签到 -> 输出积分 -> 访问用户主页，运行记录中今天已完成的步骤会跳过
+
+        参数:
+            journal: RunJournal对象，为None时不记录
+            host: 运行记录中使用的论坛地址，默认为hostname
+            lean: 为True时不输出积分和金币数量
+
+        返回:
+            结果字典，包含login、signin、visit和skipped（今天已全部完成）
+        """
+        journal = journal or NullJournal()
+        host = host or self.hostname
+        username = self.discuz_login.username
+        # 运行记录的读写在异步引擎中放到线程中执行
+        done = yield Call(journal.completed, host, username)
+        result = {'login': False, 'signin': 'signin' in done, 'visit': 'visit' in done, 'skipped': False}
+        if result['signin'] and result['visit']:
+            logging.info(f'{username} 今天已完成签到和访问用户主页，跳过')
+            result.update(login=True, skipped=True)
+            return result
+        if result['visit']:
+            # 今天不再访问用户主页，首页读到用户栏即可
+            self.discuz_login.full_home_page = False
+
+        yield from self.journal_step(journal, host, 'login', self.login.steps())
+        result['login'] = True
+        if result['signin']:
+            logging.info(f'{username} 今天已签到，跳过签到')
+        elif (yield from self.check_signed.steps()):
+            # 签到页面显示今天已签到（例如在其它地方签过），不再发出签到请求
+            logging.info(f'{username} 签到页面显示今天已签到')
+            yield Call(journal.record, host, username, 'signin', ALREADY, '签到页面显示今天已签到')
+            result['signin'] = True
+        else:
+            signin_result = yield from self.journal_step(journal, host, 'signin', self.signin_with_recovery.steps(),
+                                                         lambda r: (r.status, r.message))
+            result['signin'] = signin_result.done
+            result['signin_result'] = signin_result.to_dict()
+        if not lean:
+            yield from self.report_credit.steps()
+        if not result['visit']:
+            visited = yield from self.journal_step(journal, host, 'visit', self.visit_home.steps(), self.visit_outcome)
+            result['visit'] = self.visit_outcome(visited)[0] == 'ok'
+        return result
+
+    def visit_outcome(self, visited):
+        """
+        访问用户主页步骤的运行记录状态，一个都没有访问成功时记为failed，下次运行会重试
+        """
+        if visited or not self.visitor.count:
+            return 'ok', f'成功访问 {visited}/{self.visitor.count} 个用户主页'
+        return 'failed', '没有成功访问的用户主页'
+
+    @step
+    @timed_stage('visit')
     def visit_home(self):
         """
-        随机访问用户主页，以增加活跃度
+        并发访问随机用户主页，以增加活跃度
+
+        返回:
+            成功访问的数量
         """
-        start = 611111  # 起始数字
-        end = 670000  # 结束数字
-        count = 10  # 随机数字的数量
+        # 登录时读取的论坛首页中的用户链接加入UID池
+        yield Call(self.visitor.pool.learn_from_page, self.hostname, self.discuz_login.home_page)
+        return (yield from self.visitor.visit.steps(self.session, self.base_url, self.hostname, self.metrics,
+                                                     self.discuz_login.pacer))
 
-        random_numbers = self.generate_random_numbers(start, end, count)
-        for number in random_numbers:
-            time.sleep(5)
-            signin_url = f'https://{self.hostname}/space-uid-{number}.html'
-            self.session.get(signin_url)
-            print(f'访问用户主页: {signin_url}')
 
+def run_account(account, session_cache=None, captcha_stats=None, journal=None, lean=False):
+    """
+    执行一个账号的签到流程
 
-if __name__ == '__main__':
-    hostname = os.environ.get('HOSTNAME')
-    username = os.environ.get('USERNAME')
-    password = os.environ.get('PASSWORD')
-    
-    if not hostname or not username or not password:
-        print("错误: 请设置必要的环境变量 HOSTNAME, USERNAME, PASSWORD")
-        sys.exit(1)
-        
+    参数:
+        account: 账号字典，字段与batch.py的账号文件相同
+
+    返回:
+        (是否签到成功, RunMetrics对象)
+    """
+    hostname = account.get('hostname') or account.get('pub_url')
+    metrics = RunMetrics(hostname, account['username'])
     try:
-        discuz = Discuz(hostname, username, password)
-        discuz.login()
-        logging.info(f"登录成功，formhash: {discuz.formhash}")
-        discuz.signin()
-        discuz.visit_home()
+        discuz = Discuz(account.get('hostname', ''), account['username'], account['password'],
+                        questionid=str(account.get('questionid', '0')), answer=account.get('answer'),
+                        pub_url=account.get('pub_url', ''), session_cache=session_cache, captcha_stats=captcha_stats,
+                        metrics=metrics, scheme=account.get('scheme', 'https'))
+        result = discuz.run_daily(journal, lean=lean)
+        if not result['signin']:
+            raise Exception('签到失败')
+        return True, metrics
     except Exception as e:
         logging.error(f"执行过程中发生错误: {e}")
-        sys.exit(1)
+        return False, metrics
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Discuz论坛签到')
+    parser.add_argument('--accounts', help='账号文件（YAML/JSON/CSV），在同一进程中依次执行，'
+                                           '默认取环境变量HOSTNAME、USERNAME、PASSWORD')
+    parser.add_argument('--profile', metavar='DIR', help='性能分析模式，把cProfile、火焰图采样和每个账号的内存分配位置'
+                                                        '写入该目录')
+    args = parser.parse_args(argv)
+
+    if args.accounts:
+        from batch import load_accounts
+        accounts = load_accounts(args.accounts)
+    else:
+        hostname = os.environ.get('HOSTNAME')
+        username = os.environ.get('USERNAME')
+        password = os.environ.get('PASSWORD')
+
+        if not hostname or not username or not password:
+            print("错误: 请设置必要的环境变量 HOSTNAME, USERNAME, PASSWORD")
+            return 1
+        accounts = [{'hostname': hostname, 'username': username, 'password': password}]
+
+    profiler = None
+    if args.profile:
+        from profiling import RunProfiler
+        profiler = RunProfiler(args.profile).start()
+
+    # 设置环境变量SESSION_CACHE=0可关闭会话缓存
+    session_cache = SessionCache() if os.environ.get('SESSION_CACHE', '1') != '0' else None
+    # 设置环境变量JOURNAL=0可关闭运行记录，LEAN_SIGNIN=1时只签到，不输出积分和金币数量
+    journal = RunJournal() if os.environ.get('JOURNAL', '1') != '0' else None
+    lean = os.environ.get('LEAN_SIGNIN', '0') == '1'
+    captcha_stats = CaptchaStats()
+    reports = []
+    failed = 0
+    try:
+        for account in accounts:
+            host = account.get('hostname') or account.get('pub_url')
+            with profiler.account(host, account['username']) if profiler else contextlib.nullcontext():
+                ok, metrics = run_account(account, session_cache, captcha_stats, journal, lean)
+            reports.append(metrics.report())
+            failed += not ok
+    finally:
+        if profiler:
+            profiler.stop()
+        write_reports(reports)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
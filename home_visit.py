@@ -0,0 +1,281 @@
+"""
+用户主页访问模块
+并发访问随机用户主页以增加活跃度：
+    - 每个论坛保存一个已知存在的用户UID池（从返回200的用户主页和论坛首页帖子列表中的用户链接学习），
+      保存在缓存目录中，下次优先从池中抽取，避免访问已删除的用户
+    - 同一次访问中UID不重复
+    - 只解析用户主页的第一块内容，能判断用户是否存在即停止，剩余内容读完丢弃，连接留给下一个主页复用
+    - 同一论坛同时访问用户主页的请求数有上限
+
+配置可通过环境变量修改:
+    VISIT_COUNT: 每个账号访问的用户主页数量，默认10
+    VISIT_CONCURRENCY: 同一论坛同时访问用户主页的请求数上限，默认4
+    VISIT_UID_RANGE: 池中UID不足时随机抽取的UID范围，默认611111-670000
+"""
+
+import logging
+import os
+import random
+import re
+import threading
+
+from metrics import RunMetrics
+from pacing import get_pacer
+from page_stream import CHUNK_SIZE, read_until
+from steps import Call, Gather, Request, step
+from store import JsonStore
+
+VISIT_COUNT = int(os.environ.get('VISIT_COUNT', 10))
+VISIT_CONCURRENCY = int(os.environ.get('VISIT_CONCURRENCY', 4))
+VISIT_UID_RANGE = tuple(int(x) for x in os.environ.get('VISIT_UID_RANGE', '611111-670000').split('-'))
+# 凑够访问数量最多进行的轮数，每轮只补访问上一轮中不存在或失败的数量
+MAX_ROUNDS = 3
+# 每个论坛最多保存的UID数量
+MAX_VALID_UIDS = 5000
+MAX_INVALID_UIDS = 20000
+
+# 页面中的用户链接，包括伪静态和普通两种形式
+UID_LINK_PATTERN = re.compile(r'space-uid-(\d+)\.html|home\.php\?mod=space&(?:amp;)?uid=(\d+)')
+# 用户主页的个人信息区域，或用户不存在的提示
+SPACE_STATE_PATTERN = re.compile(r'id="uhd"|您指定的用户空间不存在|用户不存在|该用户已被删除')
+SPACE_MISSING_PATTERN = re.compile(r'您指定的用户空间不存在|用户不存在|该用户已被删除')
+
+
+class UidPool:
+    """
+    每个论坛已知存在和不存在的用户UID
+    """
+    def __init__(self, store=None, uid_range=VISIT_UID_RANGE):
+        """
+        参数:
+            store: JsonStore对象，默认保存到缓存目录下的uid_pool.json
+            uid_range: 池中UID不足时随机抽取的范围 (起始, 结束)
+        """
+        self.store = store or JsonStore('uid_pool.json')
+        self.uid_range = uid_range
+        self._hosts = None
+        self._dirty = set()
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._hosts is None:
+            try:
+                data = self.store.load()
+            except Exception as e:
+                logging.error(f'读取用户UID池失败: {str(e)}')
+                data = {}
+            self._hosts = {
+                host: {'valid': set(entry.get('valid', [])), 'invalid': set(entry.get('invalid', []))}
+                for host, entry in data.items()
+            }
+        return self._hosts
+
+    def _entry(self, host):
+        return self._load().setdefault(host, {'valid': set(), 'invalid': set()})
+
+    def sample(self, host, count, exclude=()):
+        """
+        抽取不重复的UID，优先使用已知存在的UID，不足时从UID范围中随机补充
+
+        参数:
+            host: 论坛地址
+            count: 抽取数量
+            exclude: 不能抽取的UID，例如本次已经访问过的
+
+        返回:
+            UID列表
+        """
+        with self._lock:
+            entry = self._entry(host)
+            exclude = set(exclude)
+            known = list(entry['valid'] - exclude)
+            uids = random.sample(known, min(count, len(known)))
+            skip = exclude | entry['invalid'] | set(uids)
+
+        start, end = self.uid_range
+        attempts = 0
+        while len(uids) < count and attempts < count * 20:
+            attempts += 1
+            uid = random.randint(start, end)
+            if uid not in skip:
+                skip.add(uid)
+                uids.append(uid)
+        return uids
+
+    def learn(self, host, valid=(), invalid=()):
+        """
+        记录存在和不存在的UID
+        """
+        valid, invalid = set(valid), set(invalid)
+        if not valid and not invalid:
+            return
+        with self._lock:
+            entry = self._entry(host)
+            new = (valid - entry['valid']) | (invalid - entry['invalid'])
+            entry['valid'] |= valid
+            entry['valid'] -= invalid
+            entry['invalid'] |= invalid
+            entry['invalid'] -= valid
+            if new:
+                self._dirty.add(host)
+
+    def learn_from_page(self, host, text):
+        """
+        从论坛页面中的用户链接学习存在的UID
+        """
+        if text:
+            self.learn(host, valid=(int(a or b) for a, b in UID_LINK_PATTERN.findall(text)))
+
+    def known(self, host):
+        """
+        已知存在的UID数量
+        """
+        with self._lock:
+            return len(self._entry(host)['valid'])
+
+    def save(self):
+        """
+        把有变化的论坛写回缓存文件，与其它进程写入的内容合并
+        """
+        with self._lock:
+            dirty = {host: self._hosts[host] for host in self._dirty}
+            self._dirty = set()
+        if not dirty:
+            return
+        try:
+            with self.store.update() as data:
+                for host, entry in dirty.items():
+                    saved = data.get(host, {})
+                    valid = (set(saved.get('valid', [])) - entry['invalid']) | entry['valid']
+                    invalid = (set(saved.get('invalid', [])) - entry['valid']) | entry['invalid']
+                    data[host] = {
+                        'valid': sorted(valid)[-MAX_VALID_UIDS:],
+                        'invalid': sorted(invalid)[-MAX_INVALID_UIDS:],
+                    }
+        except Exception as e:
+            logging.error(f'保存用户UID池失败: {str(e)}')
+
+
+_host_limits = {}
+_host_limits_lock = threading.Lock()
+
+
+def host_limit(host):
+    """
+    获取论坛的用户主页并发访问限制，同一进程内的所有账号共用
+    """
+    with _host_limits_lock:
+        if host not in _host_limits:
+            _host_limits[host] = threading.BoundedSemaphore(VISIT_CONCURRENCY)
+        return _host_limits[host]
+
+
+class HomeVisitor:
+    """
+    用户主页访问器
+    """
+    def __init__(self, pool=None, count=VISIT_COUNT, concurrency=VISIT_CONCURRENCY):
+        """
+        参数:
+            pool: UidPool对象，默认使用进程内共享的UID池
+            count: 每次需要成功访问的用户主页数量
+            concurrency: 单个账号同时访问的请求数
+        """
+        self.pool = pool or get_uid_pool()
+        self.count = count
+        self.concurrency = concurrency
+
+    @staticmethod
+    def space_url(base_url, uid):
+        return f'{base_url}/space-uid-{uid}.html'
+
+    def fetch(self, session, base_url, host, uid, metrics=None, **kwargs):
+        """
+        访问一个用户主页，只解析到能判断用户是否存在为止，连接还给连接池
+
+        返回:
+            (uid, 结果)，结果为True 用户存在，False 用户不存在，None 请求失败
+        """
+        url = self.space_url(base_url, uid)
+        try:
+            with host_limit(host):
+                response = session.get(url, stream=True, **kwargs)
+                status = response.status_code
+                text, size = read_until(response, [SPACE_STATE_PATTERN], CHUNK_SIZE)
+            if metrics is not None:
+                metrics.add('bytes', size, 'visit')
+        except Exception as e:
+            logging.error(f'访问用户主页失败: {url}, {str(e)}')
+            return uid, None
+
+        if status == 404 or SPACE_MISSING_PATTERN.search(text):
+            logging.info(f'用户主页不存在: {url}')
+            return uid, False
+        if status != 200:
+            logging.info(f'访问用户主页状态码 {status}: {url}')
+            return uid, None
+        logging.info(f'访问用户主页: {url}')
+        # 用户主页中的访客和好友链接也是存在的用户
+        self.pool.learn_from_page(host, text)
+        return uid, True
+
+    def record(self, host, results):
+        """
+        把一轮访问结果记入UID池
+
+        返回:
+            成功访问的数量
+        """
+        valid = [uid for uid, ok in results if ok]
+        self.pool.learn(host, valid=valid, invalid=[uid for uid, ok in results if ok is False])
+        return len(valid)
+
+    @step
+    def visit(self, session, base_url, host, metrics=None, pacer=None):
+        """
+        并发访问用户主页，直到成功访问count个或达到最大轮数
+
+        参数:
+            session: 已登录的会话
+            base_url: 论坛地址，例如 https://example.com
+            host: 论坛主机名，UID池和并发限制按它区分
+            metrics: RunMetrics对象
+            pacer: Pacer对象，异步执行时用于请求排队，默认使用进程内共享的对象
+
+        返回:
+            成功访问的数量
+        """
+        metrics = metrics or RunMetrics(host)
+        pacer = pacer or get_pacer()
+        visited = 0
+        tried = set()
+        for _ in range(MAX_ROUNDS):
+            uids = yield Call(self.pool.sample, host, self.count - visited, tried)
+            if not uids:
+                break
+            tried.update(uids)
+            results = yield Gather([Request(pacer, metrics, self.space_url(base_url, uid), self.fetch,
+                                            session, base_url, host, uid, metrics) for uid in uids],
+                                   self.concurrency, 'visit')
+            visited += self.record(host, results)
+            if visited >= self.count:
+                break
+        yield Call(self.pool.save)
+        logging.info(f'成功访问 {visited}/{self.count} 个用户主页，已知用户 {self.pool.known(host)} 个')
+        return visited
+
+
+_uid_pool = None
+_uid_pool_lock = threading.Lock()
+
+
+def get_uid_pool():
+    """
+    获取进程内共享的用户UID池
+    """
+    global _uid_pool
+    if _uid_pool is None:
+        with _uid_pool_lock:
+            if _uid_pool is None:
+                _uid_pool = UidPool()
+    return _uid_pool
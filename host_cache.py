@@ -0,0 +1,135 @@
+"""
+论坛地址缓存模块
+缓存从发布页解析出的论坛地址，同时保存在内存和缓存目录中：
+    - 未过期时直接使用缓存，不请求发布页
+    - 过期但仍在可用期内时先返回旧地址，并在后台线程中刷新
+    - 发布页无法访问时使用最后一次成功解析的地址
+"""
+
+import logging
+import os
+import threading
+import time
+
+from store import JsonStore
+
+# 缓存有效期，默认6小时
+HOST_TTL = int(os.environ.get('HOST_CACHE_TTL', 6 * 3600))
+# 过期后仍可直接使用并在后台刷新的时长，默认7天
+HOST_STALE_TTL = int(os.environ.get('HOST_CACHE_STALE_TTL', 7 * 86400))
+
+
+class HostCache:
+    """
+    发布页 -> 论坛地址 的缓存
+    """
+    def __init__(self, store=None, ttl=HOST_TTL, stale_ttl=HOST_STALE_TTL):
+        """
+        参数:
+            store: JsonStore对象，默认保存到缓存目录下的hosts.json
+            ttl: 缓存有效期（秒）
+            stale_ttl: 过期后仍可使用的时长（秒）
+        """
+        self.store = store or JsonStore('hosts.json')
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._entries = None
+        self._lock = threading.Lock()
+        self._resolve_locks = {}
+        self._refreshing = set()
+
+    def _load(self):
+        if self._entries is None:
+            self._entries = self.store.load()
+        return self._entries
+
+    def _save(self, pub_url, host):
+        entry = {'host': host, 'resolved_at': time.time()}
+        with self._lock:
+            self._load()[pub_url] = entry
+        try:
+            with self.store.update() as data:
+                data[pub_url] = entry
+        except Exception as e:
+            logging.error(f'保存论坛地址缓存失败: {str(e)}')
+
+    def _resolve(self, pub_url, resolver):
+        host = resolver(pub_url)
+        if host:
+            self._save(pub_url, host)
+        return host
+
+    def _refresh_in_background(self, pub_url, resolver):
+        with self._lock:
+            if pub_url in self._refreshing:
+                return
+            self._refreshing.add(pub_url)
+
+        def refresh():
+            try:
+                self._resolve(pub_url, resolver)
+            except Exception as e:
+                logging.error(f'后台刷新论坛地址失败: {str(e)}')
+            finally:
+                with self._lock:
+                    self._refreshing.discard(pub_url)
+
+        threading.Thread(target=refresh, name='host-refresh', daemon=True).start()
+
+    def get(self, pub_url, resolver):
+        """
+        获取发布页对应的论坛地址
+
+        参数:
+            pub_url: 发布页地址
+            resolver: 解析函数，参数为发布页地址，成功返回论坛地址，失败返回None
+
+        返回:
+            论坛地址，无法解析且没有缓存时返回None
+        """
+        with self._lock:
+            entry = self._load().get(pub_url)
+            resolve_lock = self._resolve_locks.setdefault(pub_url, threading.Lock())
+
+        if entry is not None:
+            age = time.time() - entry['resolved_at']
+            if age < self.ttl:
+                return entry['host']
+            if age < self.ttl + self.stale_ttl:
+                logging.info(f'论坛地址缓存已过期，先使用 {entry["host"]} 并在后台刷新')
+                self._refresh_in_background(pub_url, resolver)
+                return entry['host']
+
+        # 没有可用缓存时同步解析，同一发布页只请求一次
+        with resolve_lock:
+            with self._lock:
+                current = self._load().get(pub_url)
+            if current is not None and current is not entry:
+                return current['host']
+            try:
+                host = self._resolve(pub_url, resolver)
+            except Exception as e:
+                logging.error(f'请求发布页失败: {str(e)}')
+                host = None
+        if host:
+            return host
+        if entry is not None:
+            logging.info(f'发布页不可用，使用最后一次解析到的地址 {entry["host"]}')
+            return entry['host']
+        return None
+
+
+_host_cache = None
+_host_cache_lock = threading.Lock()
+
+
+def get_host_cache():
+    """
+    获取进程内共享的论坛地址缓存
+    """
+    global _host_cache
+    if _host_cache is None:
+        with _host_cache_lock:
+            if _host_cache is None:
+                _host_cache = HostCache()
+    return _host_cache
@@ -0,0 +1,147 @@
+"""
+运行记录模块
+每个账号每天的每一步（登录、签到、访问用户主页等）执行结果都追加记录到缓存目录的SQLite数据库中：
+    - 运行中途退出后重新运行，今天已经完成的步骤会跳过，只重试失败的步骤
+    - 可以查询历史签到结果和耗时
+
+查询最近7天的记录:
+    python journal.py --days 7
+"""
+
+import argparse
+import contextlib
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+from store import CACHE_DIR
+
+# 步骤状态：ok 成功，already 今天已签到，failed 失败
+DONE_STATUSES = ('ok', 'already')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    day TEXT NOT NULL,
+    host TEXT NOT NULL,
+    username TEXT NOT NULL,
+    step TEXT NOT NULL,
+    status TEXT NOT NULL,
+    detail TEXT NOT NULL DEFAULT '',
+    seconds REAL NOT NULL DEFAULT 0,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_account_day ON events (host, username, day);
+"""
+
+
+def today():
+    return time.strftime('%Y-%m-%d')
+
+
+class RunJournal:
+    """
+    追加写入的运行记录
+    """
+    def __init__(self, path=None):
+        """
+        参数:
+            path: 数据库文件路径，默认为缓存目录下的journal.sqlite3
+        """
+        self.path = path or os.path.join(CACHE_DIR, 'journal.sqlite3')
+        self._lock = threading.Lock()
+        self._initialized = False
+
+    @contextlib.contextmanager
+    def connect(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            if not self._initialized:
+                with self._lock:
+                    conn.execute('PRAGMA journal_mode=WAL')
+                    conn.executescript(SCHEMA)
+                    self._initialized = True
+            yield conn
+            conn.commit()
+        finally:
+            conn.close()
+
+    def record(self, host, username, step, status, detail='', seconds=0.0):
+        """
+        追加一条记录，写入失败只记录日志，不影响签到流程
+        """
+        try:
+            with self.connect() as conn:
+                conn.execute(
+                    'INSERT INTO events (day, host, username, step, status, detail, seconds, created) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    (today(), host, str(username), step, status, str(detail)[:500], round(seconds, 3), time.time()))
+        except Exception as e:
+            logging.error(f'写入运行记录失败: {str(e)}')
+
+    def completed(self, host, username):
+        """
+        今天已经完成的步骤
+        """
+        try:
+            with self.connect() as conn:
+                rows = conn.execute(
+                    f'SELECT DISTINCT step FROM events WHERE host = ? AND username = ? AND day = ? '
+                    f'AND status IN ({",".join("?" * len(DONE_STATUSES))})',
+                    (host, str(username), today(), *DONE_STATUSES)).fetchall()
+            return {row[0] for row in rows}
+        except Exception as e:
+            logging.error(f'读取运行记录失败: {str(e)}')
+            return set()
+
+    def history(self, days=7, host=None, username=None):
+        """
+        查询最近几天的记录
+
+        返回:
+            (日期, 论坛, 用户名, 步骤, 状态, 详情, 耗时) 列表
+        """
+        since = time.strftime('%Y-%m-%d', time.localtime(time.time() - (days - 1) * 86400))
+        sql = 'SELECT day, host, username, step, status, detail, seconds FROM events WHERE day >= ?'
+        params = [since]
+        if host:
+            sql += ' AND host = ?'
+            params.append(host)
+        if username:
+            sql += ' AND username = ?'
+            params.append(str(username))
+        with self.connect() as conn:
+            return conn.execute(sql + ' ORDER BY id', params).fetchall()
+
+
+class NullJournal:
+    """
+    不使用运行记录时的空实现
+    """
+    def record(self, *args, **kwargs):
+        pass
+
+    def completed(self, host, username):
+        return set()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='查询签到运行记录')
+    parser.add_argument('--days', type=int, default=7, help='查询最近几天，默认7')
+    parser.add_argument('--host', help='只显示该论坛')
+    parser.add_argument('--username', help='只显示该用户')
+    parser.add_argument('--path', help='数据库文件路径，默认为缓存目录下的journal.sqlite3')
+    args = parser.parse_args(argv)
+
+    for day, host, username, step, status, detail, seconds in RunJournal(args.path).history(
+            args.days, args.host, args.username):
+        print(f'{day}  {host:<24} {username:<16} {step:<8} {status:<8} {seconds:>7.2f}s  {detail}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,135 @@
+"""
+k_misign签到插件
+解析签到接口的ajax响应（XML包裹的HTML片段）和签到页面中的今日签到状态
+"""
+
+import re
+
+from login_page import FORMHASH_INVALID_MARKERS
+
+CDATA_PATTERN = re.compile(r'<!\[CDATA\[(.*?)\]\]>', re.S)
+TAG_PATTERN = re.compile(r'<[^>]+>')
+SPACE_PATTERN = re.compile(r'\s+')
+REWARD_PATTERN = re.compile(r'(?:奖励|获得)\s*([^\s\d，,。:：]*)\s*[:：]?\s*(\d+)')
+STREAK_PATTERN = re.compile(r'连续签到\s*(\d+)\s*天')
+
+SUCCESS_MARKERS = ('签到成功', '恭喜', 'succeed')
+ALREADY_MARKERS = ('今日已签', '已经签到', '今天已签到', '已签')
+NOT_LOGGED_IN_MARKERS = ('请先登录', '未登录', '尚未登录', '需要先登录')
+
+# 签到页面中的签到按钮，已签到时为btnvisted样式，未签到时链接到operation=qiandao
+SIGN_STATE_PATTERN = re.compile(r'btnvisted|您今天已经签到|今日已签|operation=qiandao')
+SIGNED_PAGE_PATTERN = re.compile(r'btnvisted|您今天已经签到|今日已签')
+
+# 签到结果状态
+OK = 'ok'
+ALREADY = 'already'
+INVALID_FORMHASH = 'invalid_formhash'
+NOT_LOGGED_IN = 'not_logged_in'
+UNKNOWN = 'unknown'
+FAILED = 'failed'
+
+
+class SigninResult:
+    """
+    一次签到的结果
+    """
+    def __init__(self, status, message='', reward=None, reward_type='', streak=None):
+        """
+        参数:
+            status: 签到状态，OK/ALREADY/INVALID_FORMHASH/NOT_LOGGED_IN/UNKNOWN/FAILED
+            message: 服务器返回的提示文字
+            reward: 奖励数量
+            reward_type: 奖励类型，例如金币
+            streak: 连续签到天数
+        """
+        self.status = status
+        self.message = message
+        self.reward = reward
+        self.reward_type = reward_type
+        self.streak = streak
+
+    @property
+    def done(self):
+        """
+        今天是否已经签到
+        """
+        return self.status in (OK, ALREADY)
+
+    def to_dict(self):
+        return {
+            'status': self.status,
+            'message': self.message,
+            'reward': self.reward,
+            'reward_type': self.reward_type,
+            'streak': self.streak,
+        }
+
+    def __str__(self):
+        text = f'签到状态: {self.status}'
+        if self.reward is not None:
+            text += f'，奖励: {self.reward_type}{self.reward}'
+        if self.streak is not None:
+            text += f'，连续签到: {self.streak}天'
+        if self.message:
+            text += f'，提示: {self.message}'
+        return text
+
+
+def response_message(text):
+    """
+    取出ajax响应中的提示文字
+    """
+    match = CDATA_PATTERN.search(text)
+    if match:
+        text = match.group(1)
+    return SPACE_PATTERN.sub(' ', TAG_PATTERN.sub(' ', text)).strip()[:200]
+
+
+def parse_signin_response(text):
+    """
+    解析签到接口的响应
+
+    参数:
+        text: 响应内容，请求失败时为None
+
+    返回:
+        SigninResult对象
+    """
+    if text is None:
+        return SigninResult(FAILED, '签到请求失败')
+
+    message = response_message(text)
+    if any(marker in text for marker in FORMHASH_INVALID_MARKERS):
+        return SigninResult(INVALID_FORMHASH, message)
+    if any(marker in message for marker in NOT_LOGGED_IN_MARKERS):
+        return SigninResult(NOT_LOGGED_IN, message)
+
+    if any(marker in message for marker in SUCCESS_MARKERS):
+        status = OK
+    elif any(marker in message for marker in ALREADY_MARKERS):
+        status = ALREADY
+    else:
+        status = UNKNOWN
+
+    result = SigninResult(status, message)
+    reward = REWARD_PATTERN.search(message)
+    if reward:
+        result.reward_type = reward.group(1)
+        result.reward = int(reward.group(2))
+    streak = STREAK_PATTERN.search(message)
+    if streak:
+        result.streak = int(streak.group(1))
+    return result
+
+
+def parse_sign_page(text):
+    """
+    从签到页面判断今天是否已经签到
+
+    返回:
+        True 已签到，False 未签到，None 无法判断
+    """
+    if not SIGN_STATE_PATTERN.search(text):
+        return None
+    return SIGNED_PAGE_PATTERN.search(text) is not None
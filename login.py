@@ -7,24 +7,34 @@ Discuz论坛登录模块
 3. 自动处理Cloudflare验证
 """
 
-from time import time
+import io
 import logging
+import os
 
-import ddddocr
 import re
 import time
-import random
-import cloudscraper
 
-from PIL import Image
+from captcha_pipeline import get_captcha_settings
+from cf_clearance import CHALLENGE_PATTERN, CHALLENGE_STATUSES, get_clearance_cache, is_challenge, retry_after
+from login_page import LoginPage
+from metrics import RunMetrics, timed_stage
+from ocr_service import get_ocr_service
+from page_stream import CHUNK_SIZE, read_until, release
+from pacing import get_pacer
+from site_profile import get_site_profiles
+from steps import Call, Request, step
+from transport import get_transport
 
 
 
-
-# 修复ANTIALIAS问题
-if not hasattr(Image, 'ANTIALIAS'):
-    # PIL 9.1.0 及以上版本用 Image.Resampling.LANCZOS 替代了 Image.ANTIALIAS
-    Image.ANTIALIAS = Image.Resampling.LANCZOS if hasattr(Image, 'Resampling') else Image.LANCZOS
+# 发帖formhash的匹配模式
+POST_FORMHASH_PATTERNS = [
+    re.compile(r'formhash=(.+?)&'),
+    re.compile(r'<input type="hidden" name="formhash" value="(.+?)" />'),
+    re.compile(r'formhash" value="(.+?)"')
+]
+UID_PATTERN = re.compile(r"discuz_uid\s*=\s*'(\d+)'")
+CREDIT_PATTERN = re.compile(r' class="showmenu">(.+?)</a>')
 
 # 配置日志记录，设置日志级别为INFO，输出到终端而不是文件
 logging.basicConfig(
@@ -38,46 +48,74 @@ logging.basicConfig(
 class CustomOCR:
     """
     自定义OCR识别类，用于处理验证码识别
-    避开ddddocr内部可能存在的ANTIALIAS错误
+    模型（以及ddddocr、onnxruntime、PIL）由进程内共享的识别服务在第一次遇到验证码时加载，
+    不需要验证码的登录不会导入这些模块
     """
-    def __init__(self):
+    def __init__(self, service=None, settings=None):
         """
         初始化OCR对象
+
+        参数:
+            service: OCRService对象，默认使用进程内共享的服务
+            settings: CaptchaSettings对象，按论坛的预处理步骤和字符集，默认使用进程内共享的设置
+        """
+        self.ocr = service or get_ocr_service()
+        self.settings = settings or get_captcha_settings()
+
+    def warm_up_in_background(self):
+        """
+        在后台加载识别模型
         """
-        self.ocr = ddddocr.DdddOcr()
+        self.ocr.warm_up_in_background()
     
-    def classification(self, img_bytes):
+    def classification(self, img_bytes, hostname=None):
         """
         识别验证码图片
         
         参数:
             img_bytes: 图片二进制数据
+            hostname: 论坛主机地址，用于选择预处理步骤和字符集
             
         返回:
             识别结果字符串
         """
+        return self.classification_with_confidence(img_bytes, hostname)[0]
+
+    def classification_with_confidence(self, img_bytes, hostname=None):
+        """
+        先按论坛设置预处理图片，再识别并给出置信度
+
+        返回:
+            (识别结果字符串, 置信度)，无法计算置信度时为None
+        """
+        pipeline, charset = self.settings.for_host(hostname)
         try:
-            # 直接使用原始方法
-            return self.ocr.classification(img_bytes)
+            img_bytes = pipeline.process(img_bytes)
+        except Exception as e:
+            logging.error(f"验证码预处理失败，使用原始图片: {str(e)}")
+        try:
+            return self.ocr.classification_with_confidence(img_bytes, charset)
         except Exception as e:
             logging.error(f"验证码识别失败: {str(e)}")
-            # 尝试直接从文件读取，跳过中间步骤
+            # 在内存中转换为PNG后重试，兼容GIF等ddddocr无法直接处理的格式
             try:
-                with open('captcha.png', 'wb') as f:
-                    f.write(img_bytes)
-                
-                image_data = open('captcha.png', 'rb').read()
-                result = self.ocr.classification(image_data)
-                return result
+                from PIL import Image
+
+                with Image.open(io.BytesIO(img_bytes)) as img:
+                    buffer = io.BytesIO()
+                    img.convert('RGB').save(buffer, format='PNG')
+                return self.ocr.classification_with_confidence(buffer.getvalue(), charset)
             except Exception as e2:
-                logging.error(f"从文件读取也失败: {str(e2)}")
-                return ''
+                logging.error(f"转换为PNG后识别也失败: {str(e2)}")
+                return '', None
 
 class Login:
     """
     论坛登录类，处理论坛的登录流程，包括验证码处理和会话维护
     """
-    def __init__(self, hostname, username, password, questionid='0', answer=None):
+    def __init__(self, hostname, username, password, questionid='0', answer=None, ocr=None, debug_dir=None,
+                 captcha_stats=None, transport=None, metrics=None, scheme='https', pacer=None, clearance=None,
+                 profiles=None):
         """
         初始化登录对象
         
@@ -87,48 +125,205 @@ class Login:
             password: 密码
             questionid: 安全问题ID，默认为'0'
             answer: 安全问题答案，默认为None
+            ocr: 共享的CustomOCR对象，默认为None时新建
+            debug_dir: 调试文件保存目录，默认取环境变量DISCUZ_DEBUG_DIR，为空时不保存
+            captcha_stats: CaptchaStats对象，用于统计验证码识别情况并调整重试次数
+            transport: Transport对象，默认使用进程内共享的传输层
+            metrics: RunMetrics对象，用于按阶段统计耗时
+            scheme: 论坛协议，默认为https，连接本地测试服务器时使用http
+            pacer: Pacer对象，控制对论坛的请求速度，默认使用进程内共享的对象
+            clearance: ClearanceCache对象，同一论坛共用Cloudflare验证结果，默认使用进程内共享的对象
+            profiles: SiteProfiles对象，记录论坛使用的页面格式，默认使用进程内共享的对象
         """
-        # 使用cloudscraper替代requests，用于绕过Cloudflare验证
-        self.session = cloudscraper.create_scraper(
-            browser={
-                'browser': 'chrome',
-                'platform': 'windows',
-                'desktop': True
-            }
-        )
+        # 使用cloudscraper替代requests，用于绕过Cloudflare验证，同一论坛的账号共用连接池
+        self.session = (transport or get_transport()).create_session(hostname)
+        self.clearance = clearance or get_clearance_cache()
+        self.clearance.instrument(self.session)
+        self.metrics = metrics or RunMetrics(hostname, username)
+        self.metrics.instrument(self.session)
+        # 请求间隔由按论坛的节奏控制统一处理，各步骤不再单独等待
+        self.pacer = pacer or get_pacer()
+        self.pacer.instrument(self.session, self.metrics)
+        self.profiles = profiles or get_site_profiles()
         
         self.hostname = hostname
+        self.scheme = scheme
         self.username = str(username)
         self.password = str(password)
         self.questionid = questionid
         self.answer = answer
-        self.ocr = CustomOCR()  # 使用自定义OCR类
+        self.ocr = ocr or CustomOCR()  # 使用自定义OCR类
+        self.debug_dir = debug_dir if debug_dir is not None else os.environ.get('DISCUZ_DEBUG_DIR', '')
+        self.captcha_attempt = 0
+        self.login_page = None
+        self.home_page = None
+        # 为True时完整读取论坛首页，访问用户主页时从中学习帖子作者等用户链接
+        self.full_home_page = False
+        self.post_formhash = ''
+        self.captcha_stats = captcha_stats
+        self.last_confidence = None
+
+    @property
+    def base_url(self):
+        return f'{self.scheme}://{self.hostname}'
 
-    def wait_for_cloudflare(self, max_retries=5):
+    @property
+    def profile(self):
+        return self.profiles.get(self.hostname)
+
+    def home_page_patterns(self):
         """
-        等待Cloudflare验证完成
-        
+        流式读取论坛首页时需要找到的内容，用户ID、formhash和积分都在页面开头的用户栏中，
+        formhash使用该论坛记录的格式；需要完整首页时返回空列表，读取到页面结束或MAX_PAGE_BYTES
+        """
+        if self.full_home_page:
+            return []
+        return [UID_PATTERN, self.profile.pattern('post_formhash', POST_FORMHASH_PATTERNS), CREDIT_PATTERN]
+
+    def save_debug(self, name, data):
+        """
+        调试模式下保存页面或验证码图片，文件名带上用户名，避免多个账号互相覆盖
+
         参数:
-            max_retries: 最大重试次数，默认为5
-            
+            name: 文件名
+            data: 文件内容，str或bytes
+        """
+        if not self.debug_dir:
+            return
+        try:
+            os.makedirs(self.debug_dir, exist_ok=True)
+            prefix = re.sub(r'[^\w.-]', '_', f'{self.hostname}_{self.username}')
+            path = os.path.join(self.debug_dir, f'{prefix}_{name}')
+            if isinstance(data, str):
+                with open(path, 'w', encoding='utf-8') as f:
+                    f.write(data)
+            else:
+                with open(path, 'wb') as f:
+                    f.write(data)
+            logging.info(f'已保存调试文件: {path}')
+        except Exception as e:
+            logging.error(f'保存调试信息失败: {str(e)}')
+
+    def fetch_page(self, url, patterns=(), **kwargs):
+        """
+        流式获取页面，patterns都找到后不再读取剩余内容
+
+        参数:
+            url: 页面地址
+            patterns: 需要找到的正则表达式列表，为空时读取完整页面
+
+        返回:
+            已读取的页面内容
+        """
+        response = self.session.get(url, stream=True, **kwargs)
+        text, size = read_until(response, patterns)
+        self.metrics.add('bytes', size)
+        return text
+
+    def page_step(self, url, patterns=()):
+        """
+        流式获取页面的请求操作，参数与fetch_page相同
+        """
+        return Request(self.pacer, self.metrics, url, self.fetch_page, url, patterns)
+
+    def request_step(self, method, url, **kwargs):
+        """
+        发往论坛的普通请求操作，参数与session.request相同
+        """
+        return Request(self.pacer, self.metrics, url, self.session.request, method, url, **kwargs)
+
+    def cloudflare_poll(self):
+        """
+        请求一次首页判断是否还在Cloudflare验证中，只看状态码和响应头，页面内容不多时读完丢弃，
+        连接留给之后的请求复用
+
+        返回:
+            (是否仍在验证中, 响应对象)
+        """
+        response = self.session.get(f'{self.base_url}/', stream=True)
+        challenged = is_challenge(response)
+        if not challenged and response.status_code in CHALLENGE_STATUSES:
+            # 没有Cloudflare响应头的旧版本验证页面，只读取第一块查找标记
+            text, size = read_until(response, [CHALLENGE_PATTERN], CHUNK_SIZE)
+            self.metrics.add('bytes', size)
+            challenged = CHALLENGE_PATTERN.search(text) is not None
+        else:
+            self.metrics.add('bytes', release(response))
+        return challenged, response
+
+    @timed_stage('cloudflare')
+    def wait_for_cloudflare(self, max_retries=5, base_delay=1.0, max_delay=10.0):
+        """
+        等待Cloudflare验证完成，每次等待时间加倍，响应带Retry-After时按它等待
+
+        参数:
+            max_retries: 最大尝试次数，默认为5
+            base_delay: 第一次等待的秒数
+            max_delay: 单次等待的最长秒数
+
         返回:
             布尔值，表示是否成功通过Cloudflare验证
         """
         for i in range(max_retries):
+            delay = min(base_delay * 2 ** i, max_delay)
             try:
-                # 访问主页
-                response = self.session.get(f'https://{self.hostname}/')
-                if 'cf-browser-verification' not in response.text:
+                challenged, response = self.cloudflare_poll()
+                if not challenged:
                     logging.info('Cloudflare验证已完成')
                     return True
-                logging.info(f'等待Cloudflare验证完成... 尝试 {i+1}/{max_retries}')
-                time.sleep(3)
+                delay = min(retry_after(response, delay), max_delay)
+                logging.info(f'等待Cloudflare验证完成... 尝试 {i+1}/{max_retries}，状态码 {response.status_code}')
             except Exception as e:
                 logging.error(f'等待Cloudflare验证时发生错误: {str(e)}')
-                time.sleep(3)
+            if i + 1 < max_retries:
+                self.metrics.sleep(delay)
         return False
 
-    def form_hash(self):
+    @step
+    def ensure_clearance(self):
+        """
+        通过论坛的Cloudflare验证，同一论坛已有其它账号通过时直接使用缓存的cf_clearance，
+        需要等待时同一论坛的其它账号等它完成后使用同一个cf_clearance
+
+        返回:
+            布尔值，表示是否通过验证
+        """
+        return (yield Call(self.clearance.ensure, self.session, self.hostname, self.wait_for_cloudflare))
+
+    def login_page_url(self):
+        """
+        登录页面地址
+        """
+        return f'{self.base_url}/member.php?mod=logging&action=login'
+
+    @step
+    @timed_stage('login_page')
+    def get_login_page(self, refresh=False):
+        """
+        获取并解析登录页面，同一次登录中只请求一次，
+        只有Discuz更换了hash时才需要refresh重新获取
+
+        返回:
+            LoginPage对象
+        """
+        if self.login_page is None or refresh:
+            rst = yield self.page_step(self.login_page_url(), LoginPage.stop_patterns(self.profile))
+            self.login_page = yield Call(self.parse_login_page, rst)
+        return self.login_page
+
+    def parse_login_page(self, rst):
+        """
+        解析登录页面内容
+        """
+        # 保存页面内容用于调试
+        self.save_debug('login_page.html', rst)
+        page = LoginPage(rst, self.profile)
+        if page.has_question and self.questionid == '0':
+            logging.info('登录页面包含安全提问，如账号设置了安全提问请填写questionid和answer')
+        return page
+
+    @step
+    def form_hash(self, refresh=False):
         """
         获取论坛登录表单的formhash值
         
@@ -137,348 +332,469 @@ class Login:
             formhash: 表单hash值
         """
         try:
-            # 添加随机延迟
-            time.sleep(random.uniform(1, 2))
-            
-            rst = self.session.get(f'https://{self.hostname}/member.php?mod=logging&action=login').text
-            # 保存页面内容用于调试
-            with open('login_page.html', 'w', encoding='utf-8') as f:
-                f.write(rst)
-            
-            # 改进正则表达式匹配
-            logininfo = re.search(r'<div id="main_messaqge_(.+?)">', rst)
-            loginhash = logininfo.group(1) if logininfo else ""
-            
-            formhash_match = re.search(r'<input type="hidden" name="formhash" value="(.+?)"', rst)
-            if not formhash_match:
-                logging.error('未找到formhash，尝试备用匹配模式')
-                formhash_match = re.search(r'formhash=([^&"]+)', rst)
-            
-            if not formhash_match:
-                logging.error('无法获取formhash，登录失败')
+            page = yield from self.get_login_page.steps(refresh)
+            if not page.formhash:
                 return "", ""
-                
-            formhash = formhash_match.group(1)
-            logging.info(f'loginhash : {loginhash} , formhash : {formhash} ')
-            return loginhash, formhash
+            return page.loginhash, page.formhash
         except Exception as e:
             logging.error(f'获取formhash失败: {str(e)}')
             return "", ""
 
+    @step
     def verify_code_once(self):
         try:
-            # 添加随机延迟
-            time.sleep(random.uniform(1, 2))
-            
-            # 访问登录页面获取Cloudflare cookie
-            login_page = self.session.get(f'https://{self.hostname}/member.php?mod=logging&action=login')
-            time.sleep(random.uniform(1, 2))  
-            
-            # 改进验证码ID匹配模式
-            seccode_patterns = [
-                r'updateseccode\(\'([^\']+)\'',
-                r'seccodehash=([^&"]+)',
-                r'idhash=([^&"]+)'
-            ]
-            
-            seccode_id = None
-            for pattern in seccode_patterns:
-                seccode_match = re.search(pattern, login_page.text)
-                if seccode_match:
-                    seccode_id = seccode_match.group(1)
-                    logging.info(f'使用模式 {pattern} 找到验证码ID: {seccode_id}')
-                    break
-            
-            if not seccode_id:
-                logging.error('未找到验证码ID，尝试备用方法')
-                seccode_match = re.search(r'seccode.*?idhash=([^&"]+)', login_page.text)
-                if seccode_match:
-                    seccode_id = seccode_match.group(1)
-                    logging.info(f'使用备用方法找到验证码ID: {seccode_id}')
-            
+            # 验证码ID在同一会话中不变，直接使用已解析的登录页面
+            seccode_id = yield from self.get_seccode_id.steps()
             if not seccode_id:
                 logging.error('无法获取验证码ID')
                 return ''
+
+            # 确认需要验证码后在后台加载识别模型，与获取验证码图片的请求同时进行
+            self.ocr.warm_up_in_background()
             
-            update_url = f'https://{self.hostname}/misc.php?mod=seccode&action=update&idhash={seccode_id}&makeseed=1&modid=member::logging'
-            
-            # 添加随机延迟
-            time.sleep(random.uniform(1, 2))
+            update_url = f'{self.base_url}/misc.php?mod=seccode&action=update&idhash={seccode_id}&makeseed=1&modid=member::logging'
             
-            headers = {
-                'Accept': 'image/avif,image/webp,image/apng,image/svg+xml,image/*,*/*;q=0.8',
-                'Accept-Encoding': 'gzip, deflate, br',
-                'Accept-Language': 'zh-CN,zh;q=0.9,en;q=0.8',
-                'Connection': 'keep-alive',
-                'Host': self.hostname,
-                'Referer': f'https://{self.hostname}/member.php?mod=logging&action=login',
-                'Sec-Fetch-Dest': 'image',
-                'Sec-Fetch-Mode': 'no-cors',
-                'Sec-Fetch-Site': 'same-origin',
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36'
-            }
+            headers = self.captcha_headers()
             
             # 获取验证码更新响应
-            update_resp = self.session.get(update_url, headers=headers)
-            
-            time.sleep(random.uniform(1, 2))
+            yield self.request_step('GET', update_url, headers=headers)
 
-            img_url = f'https://{self.hostname}/misc.php?mod=seccode&idhash={seccode_id}&{int(time.time())}'
+            img_url = f'{self.base_url}/misc.php?mod=seccode&idhash={seccode_id}&{int(time.time())}'
             logging.info(f'请求验证码图片: {img_url}')
             
-            rst = self.session.get(img_url, headers=headers)
-            if rst.status_code != 200:
-                logging.error(f'验证码请求失败，状态码: {rst.status_code}')
-                return ''
+            rst = yield self.request_step('GET', img_url, headers=headers)
+            # 识别是CPU密集操作，异步执行时同样放到线程中
+            return (yield Call(self.recognize_captcha, rst))
                 
-            # 保存原始响应内容用于调试
-            try:
-                with open('captcha.png', 'wb') as f:
-                    f.write(rst.content)
-                logging.info('已保存验证码图片到captcha.png')
-            except Exception as e:
-                logging.error(f'保存调试信息失败: {str(e)}')
-            
-            # 尝试识别验证码
-            try:
-                # 检查响应内容类型
-                content_type = rst.headers.get('content-type', '')
-                logging.info(f'验证码响应内容类型: {content_type}')
-                
-                # 如果响应是图片，直接识别
-                if 'image' in content_type.lower():
-                    # 直接从文件读取验证码图片进行识别
-                    try:
-                        # 先保存后读取
-                        code = ""
-                        with open('captcha.png', 'rb') as f:
-                            image_bytes = f.read()
-                            code = self.ocr.classification(image_bytes)
-                        if code:
-                            logging.info(f'成功识别验证码: {code}')
-                            return code
-                        else:
-                            logging.error('验证码识别结果为空')
-                            return ''
-                    except Exception as e:
-                        logging.error(f'验证码识别失败: {str(e)}')
+        except Exception as e:
+            logging.error(f'验证码获取过程发生错误: {str(e)}')
+            return ''
+
+    @step
+    def get_seccode_id(self):
+        """
+        获取验证码ID，缓存的登录页面中没有时重新获取一次页面
+        """
+        page = yield from self.get_login_page.steps()
+        if not page.seccode_id:
+            logging.error('未找到验证码ID，重新获取登录页面')
+            page = yield from self.get_login_page.steps(refresh=True)
+        return page.seccode_id
+
+    def captcha_headers(self):
+        """
+        请求验证码图片使用的请求头
+        """
+        return {
+            'Accept': 'image/avif,image/webp,image/apng,image/svg+xml,image/*,*/*;q=0.8',
+            'Accept-Encoding': 'gzip, deflate, br',
+            'Accept-Language': 'zh-CN,zh;q=0.9,en;q=0.8',
+            'Connection': 'keep-alive',
+            'Host': self.hostname,
+            'Referer': self.login_page_url(),
+            'Sec-Fetch-Dest': 'image',
+            'Sec-Fetch-Mode': 'no-cors',
+            'Sec-Fetch-Site': 'same-origin',
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36'
+        }
+
+    def recognize_captcha(self, rst):
+        """
+        识别验证码图片响应
+
+        参数:
+            rst: 验证码图片的响应对象
+
+        返回:
+            识别结果，失败时返回空字符串
+        """
+        if rst.status_code != 200:
+            logging.error(f'验证码请求失败，状态码: {rst.status_code}')
+            return ''
+
+        self.captcha_attempt += 1
+        # 尝试识别验证码
+        try:
+            # 检查响应内容类型
+            content_type = rst.headers.get('content-type', '')
+            logging.info(f'验证码响应内容类型: {content_type}')
+
+            # 如果响应是图片，直接识别
+            if 'image' in content_type.lower():
+                # 图片数据直接从响应传给识别模型，不经过磁盘
+                try:
+                    image_bytes = rst.content
+                    ext = content_type.split('/')[-1].split(';')[0].strip() or 'png'
+                    self.save_debug(f'captcha_{self.captcha_attempt}.{ext}', image_bytes)
+                    start = time.perf_counter()
+                    code, self.last_confidence = self.ocr.classification_with_confidence(image_bytes, self.hostname)
+                    self.metrics.add('ocr', time.perf_counter() - start)
+                    if code and self.is_low_confidence():
                         return ''
-                else:
-                    # 如果不是图片，记录日志
-                    logging.info('响应不是图片格式')
+                    if code:
+                        logging.info(f'成功识别验证码: {code}, 置信度: {self.last_confidence}')
+                        return code
+                    else:
+                        logging.error('验证码识别结果为空')
+                        return ''
+                except Exception as e:
+                    logging.error(f'验证码识别失败: {str(e)}')
                     return ''
-                        
-            except Exception as e:
-                logging.error(f'验证码处理过程发生错误: {str(e)}')
+            else:
+                # 如果不是图片，记录日志
+                logging.info('响应不是图片格式')
                 return ''
-                
+
         except Exception as e:
-            logging.error(f'验证码获取过程发生错误: {str(e)}')
+            logging.error(f'验证码处理过程发生错误: {str(e)}')
             return ''
 
-    def verify_code(self,num = 10):
+    def is_low_confidence(self):
+        """
+        识别置信度低于阈值时不提交校验，省去一次校验请求
+        """
+        if self.captcha_stats is None or self.last_confidence is None:
+            return False
+        threshold = self.captcha_stats.confidence_threshold(self.hostname)
+        if threshold is not None and self.last_confidence < threshold:
+            logging.info(f'验证码识别置信度 {self.last_confidence:.3f} 低于 {threshold:.3f}，重新获取验证码')
+            return True
+        return False
+
+    def retry_budget(self, num=None):
+        """
+        验证码重试次数，未指定时根据该论坛的历史统计确定
+        """
+        if num is not None:
+            return num
+        if self.captcha_stats is None:
+            return 10
+        num = self.captcha_stats.retry_budget(self.hostname)
+        logging.info(f'根据历史统计，本次最多尝试 {num} 次验证码')
+        return num
+
+    def record_captcha_stats(self, checks, solved):
+        """
+        保存本次登录的验证码统计
+        """
+        if self.captcha_stats is None:
+            return
+        try:
+            self.captcha_stats.record(self.hostname, checks, solved)
+        except Exception as e:
+            logging.error(f'保存验证码统计失败: {str(e)}')
+
+    @step
+    @timed_stage('captcha')
+    def verify_code(self, num=None):
         """
         获取并验证验证码，可多次重试
+
+        参数:
+            num: 最多尝试次数，默认根据历史统计确定
         """
+        num = yield Call(self.retry_budget, num)
+        checks = []
         while num > 0:
             num -= 1
-            code = self.verify_code_once()
+            code = yield from self.verify_code_once.steps()
             
             if not code:
-                logging.info('验证码获取失败，等待1秒后重试...')
-                time.sleep(1)
+                logging.info('验证码获取失败，重试中...')
                 continue
                 
-            # 先重新获取验证码ID
             try:
-                login_page = self.session.get(f'https://{self.hostname}/member.php?mod=logging&action=login')
-                seccode_pattern = r'updateseccode\(\'([^\']+)\''
-                seccode_match = re.search(seccode_pattern, login_page.text)
-                
-                if not seccode_match:
-                    logging.error('未找到验证码ID，无法验证')
-                    time.sleep(1)
-                    continue
-                    
-                seccode_id = seccode_match.group(1)
+                # 验证码ID与获取图片时使用的相同，无需重新请求登录页面
+                seccode_id = self.login_page.seccode_id
                 logging.info(f'验证使用验证码ID: {seccode_id}')
                 
                 # 验证验证码，使用动态获取的ID
-                verify_url = f'https://{self.hostname}/misc.php?mod=seccode&action=check&inajax=1&modid=member::logging&idhash={seccode_id}&secverify={code}'
+                verify_url = self.seccode_check_url(seccode_id, code)
                 
-                res = self.session.get(verify_url).text
+                res = (yield self.request_step('GET', verify_url)).text
+                checks.append((code, self.last_confidence, 'succeed' in res))
                 if 'succeed' in res:
                     logging.info(f'验证码识别成功，验证码:{code}, ID:{seccode_id}')
+                    yield Call(self.record_captcha_stats, checks, True)
                     return code, seccode_id
                 else:
                     logging.info('验证码识别失败，重新识别中...')
-                    time.sleep(1)
             except Exception as e:
                 logging.error(f'验证码验证请求失败: {str(e)}')
-                time.sleep(1)
 
         logging.error('验证码获取失败，请增加验证次数或检查当前验证码识别功能是否正常')
+        yield Call(self.record_captcha_stats, checks, False)
         return '', ''
 
+    def seccode_check_url(self, seccode_id, code):
+        """
+        校验验证码的地址
+        """
+        return f'{self.base_url}/misc.php?mod=seccode&action=check&inajax=1&modid=member::logging&idhash={seccode_id}&secverify={code}'
+
+    def login_url(self, loginhash):
+        """
+        提交登录表单的地址
+        """
+        return f'{self.base_url}/member.php?mod=logging&action=login&loginsubmit=yes&loginhash={loginhash}&inajax=1'
+
+    @step
+    @timed_stage('login')
     def account_login_without_verify(self):
         """
         尝试无需验证码直接登录
         """
         try:
-            loginhash, formhash = self.form_hash()
-            login_url = f'https://{self.hostname}/member.php?mod=logging&action=login&loginsubmit=yes&loginhash={loginhash}&inajax=1'
-            formData = {
-                'formhash': formhash,
-                'referer': f'https://{self.hostname}/',
-                'username': self.username,
-                'password': self.password,
-                'handlekey':'ls',
-            }
-            
-            # 添加登录请求头
-            login_headers = {
-                'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,image/apng,*/*;q=0.8',
-                'Accept-Encoding': 'gzip, deflate, br',
-                'Accept-Language': 'zh-CN,zh;q=0.9,en;q=0.8',
-                'Connection': 'keep-alive',
-                'Host': f'{self.hostname}',
-                'Referer': f'https://{self.hostname}/member.php?mod=logging&action=login',
-                'Sec-Fetch-Mode': 'navigate',
-                'Sec-Fetch-Site': 'same-origin',
-                'Sec-Fetch-User': '?1',
-                'Upgrade-Insecure-Requests': '1',
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/96.0.4664.45 Safari/537.36',
-                'Cookie': '; '.join([f'{k}={v}' for k, v in self.session.cookies.items()])
-            }
+            loginhash, formhash = yield from self.form_hash.steps()
+            login_url = self.login_url(loginhash)
+            formData, login_headers = self.login_form_without_verify(formhash)
             
-            login_rst = self.session.post(login_url, data=formData, headers=login_headers).text
-            
-            if 'succeed' in login_rst:
-                logging.info('无验证码登录成功')
-                return True
-            elif 'seccodeverify' in login_rst:
-                logging.info('论坛需要验证码登录，这是正常的安全措施')
-                return False
-            else:
-                # 保存响应内容用于调试
-                with open('login_response.txt', 'w', encoding='utf-8') as f:
-                    f.write(login_rst)
-                logging.info('无验证码登录失败，将尝试使用验证码登录')
-                return False
+            login_rst = (yield self.request_step('POST', login_url, data=formData, headers=login_headers)).text
+            return self.check_login_without_verify(login_rst)
                 
         except Exception as e:
             logging.error(f'登录过程发生错误: {str(e)}')
             return False
 
+    def login_form_without_verify(self, formhash):
+        """
+        无验证码登录提交的表单和请求头
+        """
+        formData = {
+            'formhash': formhash,
+            'referer': f'{self.base_url}/',
+            'username': self.username,
+            'password': self.password,
+            'handlekey':'ls',
+        }
+
+        # 添加登录请求头
+        login_headers = {
+            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,image/apng,*/*;q=0.8',
+            'Accept-Encoding': 'gzip, deflate, br',
+            'Accept-Language': 'zh-CN,zh;q=0.9,en;q=0.8',
+            'Connection': 'keep-alive',
+            'Host': f'{self.hostname}',
+            'Referer': self.login_page_url(),
+            'Sec-Fetch-Mode': 'navigate',
+            'Sec-Fetch-Site': 'same-origin',
+            'Sec-Fetch-User': '?1',
+            'Upgrade-Insecure-Requests': '1',
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/96.0.4664.45 Safari/537.36',
+            'Cookie': '; '.join([f'{k}={v}' for k, v in self.session.cookies.items()])
+        }
+        return formData, login_headers
+
+    def check_login_without_verify(self, login_rst):
+        """
+        判断无验证码登录的响应是否成功
+        """
+        if 'succeed' in login_rst:
+            logging.info('无验证码登录成功')
+            return True
+        elif 'seccodeverify' in login_rst:
+            logging.info('论坛需要验证码登录，这是正常的安全措施')
+            return False
+        else:
+            # 保存响应内容用于调试
+            self.save_debug('login_response.txt', login_rst)
+            logging.info('无验证码登录失败，将尝试使用验证码登录')
+            return False
+
+    @step
+    @timed_stage('login')
     def account_login(self):
         """
         登录账号，先尝试无验证码登录，失败则使用验证码
         """
         # 首先尝试不使用验证码直接登录
-        if self.account_login_without_verify():
-            self.post_formhash = self.get_post_hash()
+        if (yield from self.account_login_without_verify.steps()):
+            self.post_formhash = yield from self.get_post_hash.steps()
             return True
 
         # 需要验证码的情况
-        code, seccode_id = self.verify_code()
+        code, seccode_id = yield from self.verify_code.steps()
         if code == '':
             return False
 
-        loginhash, formhash = self.form_hash()
-        login_url = f'https://{self.hostname}/member.php?mod=logging&action=login&loginsubmit=yes&loginhash={loginhash}&inajax=1'
-        formData = {
-            'formhash': formhash,
-            'referer': f'https://{self.hostname}/',
-            'loginfield': 'username',
-            'username': self.username,
-            'password': self.password,
-            'questionid': self.questionid,
-            'answer': self.answer,
-            'cookietime': 2592000,
-            'seccodehash': seccode_id,
-            'seccodemodid': 'member::logging',
-            'seccodeverify': code,  # verify code
-        }
+        loginhash, formhash = yield from self.form_hash.steps()
+        login_url = self.login_url(loginhash)
+        formData = self.login_form(formhash, code, seccode_id)
         
         # 增加尝试次数
         for _ in range(3):
-            login_rst = self.session.post(login_url, data=formData).text
+            login_rst = (yield self.request_step('POST', login_url, data=formData)).text
             if 'succeed' in login_rst:
                 logging.info('登陆成功')
-                self.post_formhash = self.get_post_hash()
+                self.post_formhash = yield from self.get_post_hash.steps()
                 return True
+            elif LoginPage.formhash_invalid(login_rst):
+                # formhash已失效，重新获取登录页面
+                logging.info('formhash已失效，重新获取登录页面')
+                loginhash, formhash = yield from self.form_hash.steps(refresh=True)
+                login_url = self.login_url(loginhash)
+                formData = self.login_form(formhash, code, seccode_id)
             else:
                 logging.info('登陆失败，重试中...')
-                time.sleep(1)
                 
         logging.error('登陆失败，请检查账号或密码是否正确')
         return False
 
+    def login_form(self, formhash, code, seccode_id):
+        """
+        带验证码登录提交的表单
+        """
+        return {
+            'formhash': formhash,
+            'referer': f'{self.base_url}/',
+            'loginfield': 'username',
+            'username': self.username,
+            'password': self.password,
+            'questionid': self.questionid,
+            'answer': self.answer,
+            'cookietime': 2592000,
+            'seccodehash': seccode_id,
+            'seccodemodid': 'member::logging',
+            'seccodeverify': code,  # verify code
+        }
+
+    @step
+    @timed_stage('formhash')
     def get_post_hash(self):
         """
         获取发帖需要的formhash
         """
         try:
-            res = self.session.get(f'https://{self.hostname}/forum.php').text
-            patterns = [
-                r'formhash=(.+?)&',
-                r'<input type="hidden" name="formhash" value="(.+?)" />',
-                r'formhash" value="(.+?)"'
-            ]
-            
-            for pattern in patterns:
-                match = re.search(pattern, res)
-                if match:
-                    formhash = match.group(1)
-                    logging.info(f'成功获取formhash: {formhash}')
-                    return formhash
-                    
-            logging.error('所有formhash匹配模式均失败')
-            return ''
+            res = yield self.page_step(f'{self.base_url}/forum.php', self.home_page_patterns())
+            # 保留首页内容，输出积分时不再重复请求
+            self.home_page = res
+            # 匹配到新的formhash格式时会写入站点配置
+            return (yield Call(self.match_post_hash, res))
         except Exception as e:
             logging.error(f'获取发帖formhash失败: {str(e)}')
             return ''
 
+    def match_post_hash(self, res):
+        """
+        从页面内容中匹配发帖需要的formhash
+        """
+        formhash = self.profile.match('post_formhash', POST_FORMHASH_PATTERNS, res)
+        if formhash:
+            logging.info(f'成功获取formhash: {formhash}')
+            return formhash
+
+        logging.error('所有formhash匹配模式均失败')
+        return ''
+
+    @step
+    @timed_stage('session')
+    def check_session(self):
+        """
+        检查当前会话是否仍处于登录状态，只请求一次论坛首页
+
+        返回:
+            登录有效时返回发帖formhash，否则返回空字符串
+        """
+        try:
+            res = yield self.page_step(f'{self.base_url}/forum.php', self.home_page_patterns())
+            uid = UID_PATTERN.search(res)
+            if not uid or uid.group(1) == '0':
+                logging.info('缓存的会话已失效')
+                return ''
+            self.home_page = res
+            return (yield Call(self.match_post_hash, res))
+        except Exception as e:
+            logging.error(f'检查会话状态失败: {str(e)}')
+            return ''
+
+    @step
+    def restore_session(self, session_cache):
+        """
+        从会话缓存恢复登录状态
+
+        返回:
+            布尔值，表示恢复的会话是否可用
+        """
+        if (yield Call(session_cache.load, self.session, self.hostname, self.username)) is None:
+            return False
+        # 账号会话中保存的cf_clearance可能已过期，使用论坛共用的最新验证结果
+        yield Call(self.clearance.apply, self.session, self.hostname)
+
+        post_formhash = yield from self.check_session.steps()
+        if not post_formhash:
+            yield Call(session_cache.invalidate, self.hostname, self.username)
+            self.session.cookies.clear()
+            return False
+
+        logging.info('使用缓存的会话，跳过登录')
+        self.post_formhash = post_formhash
+        return True
+
+    @step
+    @timed_stage('home')
     def go_home(self):
         """
         访问论坛首页
         """
-        return self.session.get(f'https://{self.hostname}/forum.php').text
+        return (yield self.page_step(f'{self.base_url}/forum.php', self.home_page_patterns()))
 
+    def parse_home(self, res):
+        """
+        从论坛首页解析发帖formhash和积分信息
+        """
+        self.post_formhash = self.match_post_hash(res) or self.post_formhash
+        credit = CREDIT_PATTERN.search(res).group(1)
+        logging.info(f'{credit},提交文章formhash:{self.post_formhash}')
+
+    def conis_url(self):
+        """
+        查询金币数量的地址
+        """
+        return f'{self.base_url}/home.php?mod=spacecp&ac=credit&showcredit=1&inajax=1&ajaxtarget=extcreditmenu_menu'
+
+    @step
+    @timed_stage('home')
     def get_conis(self):
         """
         获取用户当前金币数量
         """
         try:
-            res = self.session.get(f'https://{self.hostname}/home.php?mod=spacecp&ac=credit&showcredit=1&inajax=1&ajaxtarget=extcreditmenu_menu').text
-            coins = re.search(r'<span id="hcredit_2">(.+?)</span>', res).group(1)
-            logging.info(f'当前金币数量：{coins}')
+            res = (yield self.request_step('GET', self.conis_url())).text
+            self.parse_conis(res)
         except Exception:
             logging.error('获取金币数量失败！', exc_info=True)
 
+    def parse_conis(self, res):
+        """
+        解析金币数量
+        """
+        coins = re.search(r'<span id="hcredit_2">(.+?)</span>', res).group(1)
+        logging.info(f'当前金币数量：{coins}')
+
+    @step
+    @timed_stage('report')
+    def report_credit(self):
+        """
+        输出积分和金币数量，登录时已获取过首页则直接使用，不再重复请求
+        """
+        try:
+            home_page = self.home_page or (yield from self.go_home.steps())
+            yield Call(self.parse_home, home_page)
+            yield from self.get_conis.steps()
+        except Exception as e:
+            logging.error(f'获取网站信息失败: {str(e)}')
+
+    @step
     def main(self):
         """
-        执行主要登录流
+        执行主要登录流，登录成功后post_formhash即可用于签到，
+        积分和金币数量需要时再调用report_credit输出
         """
         try:
-            if not self.account_login():
+            if not (yield from self.account_login.steps()):
                 logging.error('登录失败，请检查账号密码或网络连接')
                 return False
-                
-            # 尝试获取formhash和其他信息
-            try:
-                res = self.go_home()
-                self.post_formhash = re.search(r'<input type="hidden" name="formhash" value="(.+?)" />', res).group(1)
-                credit = re.search(r' class="showmenu">(.+?)</a>', res).group(1)
-                logging.info(f'{credit},提交文章formhash:{self.post_formhash}')
-                
-                self.get_conis()
-                return True
-            except Exception as e:
-                logging.error(f'获取网站信息失败: {str(e)}')
-                # 虽然登录成功但无法获取信息，仍然返回True
-                return True
-                
+            return True
         except Exception as e:
             logging.error(f'登录过程中发生错误: {str(e)}', exc_info=True)
             return False
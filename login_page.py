@@ -0,0 +1,77 @@
+"""
+登录页面解析模块
+一次解析登录页面中登录需要的全部字段：loginhash、formhash、验证码idhash和安全提问，
+正则表达式在模块加载时预编译，有站点配置时先用该论坛记录的格式匹配
+"""
+
+import logging
+import re
+
+LOGINHASH_PATTERN = re.compile(r'<div id="main_messaqge_(.+?)">')
+FORMHASH_PATTERNS = [
+    re.compile(r'<input type="hidden" name="formhash" value="(.+?)"'),
+    re.compile(r'formhash=([^&"]+)'),
+]
+SECCODE_PATTERNS = [
+    re.compile(r'updateseccode\(\'([^\']+)\''),
+    re.compile(r'seccodehash=([^&"]+)'),
+    re.compile(r'idhash=([^&"]+)'),
+    re.compile(r'seccode.*?idhash=([^&"]+)'),
+]
+QUESTION_PATTERN = re.compile(r'name="questionid"')
+# 流式读取登录页面时，这些内容都找到后即可停止，验证码在登录表单的最后
+STOP_PATTERNS = [LOGINHASH_PATTERN, FORMHASH_PATTERNS[0], SECCODE_PATTERNS[0]]
+
+# 表单hash失效时Discuz返回的提示
+FORMHASH_INVALID_MARKERS = ('submit_invalid', '请求来路不明')
+
+
+class LoginPage:
+    """
+    解析后的登录页面
+    """
+    def __init__(self, text, profile=None):
+        """
+        参数:
+            text: 登录页面内容
+            profile: SiteProfile对象，为None时按顺序尝试各种格式
+        """
+        self.text = text
+        match = LOGINHASH_PATTERN.search(text)
+        self.loginhash = match.group(1) if match else ''
+        if profile is not None:
+            self.formhash = profile.match('formhash', FORMHASH_PATTERNS, text)
+            self.seccode_id = profile.match('seccode', SECCODE_PATTERNS, text)
+        else:
+            self.formhash = self._first_match(FORMHASH_PATTERNS, text)
+            self.seccode_id = self._first_match(SECCODE_PATTERNS, text)
+        self.has_question = QUESTION_PATTERN.search(text) is not None
+
+        if not self.formhash:
+            logging.error('无法获取formhash，登录失败')
+        logging.info(f'loginhash : {self.loginhash} , formhash : {self.formhash} , 验证码ID : {self.seccode_id}')
+
+    @staticmethod
+    def _first_match(patterns, text):
+        for pattern in patterns:
+            match = pattern.search(text)
+            if match:
+                return match.group(1)
+        return ''
+
+    @staticmethod
+    def stop_patterns(profile=None):
+        """
+        流式读取登录页面时需要找到的内容，有站点配置时使用该论坛记录的格式
+        """
+        if profile is None:
+            return STOP_PATTERNS
+        return [LOGINHASH_PATTERN, profile.pattern('formhash', FORMHASH_PATTERNS),
+                profile.pattern('seccode', SECCODE_PATTERNS)]
+
+    @staticmethod
+    def formhash_invalid(response_text):
+        """
+        判断提交表单的响应是否表示formhash已经失效
+        """
+        return any(marker in response_text for marker in FORMHASH_INVALID_MARKERS)
@@ -0,0 +1,237 @@
+"""
+运行计时模块
+按阶段（Cloudflare、登录页面、验证码、签到、访问主页等）统计每个账号的耗时：
+    wall: 阶段总耗时（不含嵌套子阶段，不属于任何阶段的时间记为other）
+    network: HTTP请求耗时
+    sleep: 主动等待的时间
+    ocr: 验证码识别耗时
+    requests/bytes: 请求数和下载字节数
+运行结束后可输出JSON报告和Prometheus textfile格式的指标
+"""
+
+import asyncio
+import functools
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+
+METRIC_FIELDS = ('wall', 'network', 'sleep', 'ocr', 'requests', 'bytes')
+
+# 接收阶段切换通知的对象（性能分析模式下为profiling.RunProfiler），为None时不通知
+_stage_observer = None
+
+
+def set_stage_observer(observer):
+    """
+    设置接收阶段切换通知的对象，observer.stage_changed(阶段名)在进入和退出阶段的线程中调用
+    """
+    global _stage_observer
+    _stage_observer = observer
+
+
+class RunMetrics:
+    """
+    一个账号的阶段计时
+    """
+    def __init__(self, hostname='', username='', sleep_scale=1.0):
+        """
+        参数:
+            hostname: 论坛主机地址
+            username: 用户名
+            sleep_scale: 主动等待时间的倍数，压测时设为0可跳过等待
+        """
+        self.hostname = hostname
+        self.username = username
+        self.sleep_scale = sleep_scale
+        self.stages = {}
+        # 访问用户主页等步骤会在多个线程中同时累加同一个账号的计数
+        self._lock = threading.Lock()
+        self._stack = []
+        self._mark = time.perf_counter()
+        self.started = time.time()
+
+    def _stage(self, name):
+        if name not in self.stages:
+            self.stages[name] = dict.fromkeys(METRIC_FIELDS, 0)
+        return self.stages[name]
+
+    @property
+    def current(self):
+        return self._stack[-1] if self._stack else 'other'
+
+    def _flush_wall(self):
+        # 把上次切换以来的时间记到当前阶段
+        with self._lock:
+            now = time.perf_counter()
+            self._stage(self.current)['wall'] += now - self._mark
+            self._mark = now
+
+    def _notify(self):
+        observer = _stage_observer
+        if observer is not None:
+            observer.stage_changed(self.current)
+
+    def enter(self, name):
+        self._flush_wall()
+        self._stack.append(name)
+        self._notify()
+
+    def exit(self):
+        self._flush_wall()
+        if self._stack:
+            self._stack.pop()
+        self._notify()
+
+    def add(self, field, value, stage=None):
+        with self._lock:
+            self._stage(stage or self.current)[field] += value
+
+    def sleep(self, seconds):
+        """
+        替代time.sleep，记录等待时间
+        """
+        seconds *= self.sleep_scale
+        self.add('sleep', seconds)
+        time.sleep(seconds)
+
+    async def async_sleep(self, seconds):
+        """
+        替代asyncio.sleep，记录等待时间
+        """
+        seconds *= self.sleep_scale
+        self.add('sleep', seconds)
+        await asyncio.sleep(seconds)
+
+    def instrument(self, session):
+        """
+        记录session发出的每个请求的耗时和下载字节数
+        """
+        request = session.request
+
+        def timed_request(method, url, **kwargs):
+            stage = self.current
+            start = time.perf_counter()
+            try:
+                response = request(method, url, **kwargs)
+            finally:
+                self.add('network', time.perf_counter() - start, stage)
+                self.add('requests', 1, stage)
+            if kwargs.get('stream'):
+                # 流式读取可能提前停止，实际读取的字节数由读取方记录
+                size = 0
+            else:
+                size = len(response.content)
+            self.add('bytes', size, stage)
+            return response
+
+        session.request = timed_request
+        return session
+
+    def report(self):
+        """
+        返回结构化的计时结果
+        """
+        self._flush_wall()
+        with self._lock:
+            stages = {
+                name: {k: round(v, 3) if isinstance(v, float) else v for k, v in values.items()}
+                for name, values in self.stages.items()
+            }
+            totals = {field: sum(values[field] for values in self.stages.values()) for field in METRIC_FIELDS}
+        return {
+            'hostname': self.hostname,
+            'username': self.username,
+            'started': self.started,
+            'total': {k: round(v, 3) if isinstance(v, float) else v for k, v in totals.items()},
+            'stages': stages,
+        }
+
+
+def timed_stage(name):
+    """
+    方法装饰器，把方法内的耗时记到指定阶段，要求对象有metrics属性
+    """
+    def decorator(func):
+        if inspect.isgeneratorfunction(func):
+            # steps.py中的流程生成器，从开始执行到执行完毕都计入该阶段
+            @functools.wraps(func)
+            def steps_wrapper(self, *args, **kwargs):
+                metrics = self.metrics
+                metrics.enter(name)
+                try:
+                    return (yield from func(self, *args, **kwargs))
+                finally:
+                    metrics.exit()
+            return steps_wrapper
+
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            metrics = self.metrics
+            metrics.enter(name)
+            try:
+                return func(self, *args, **kwargs)
+            finally:
+                metrics.exit()
+        return wrapper
+    return decorator
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_prometheus(reports):
+    """
+    把多个账号的计时结果格式化为Prometheus textfile
+    """
+    lines = [
+        '# HELP discuz_stage_seconds Time spent per pipeline stage.',
+        '# TYPE discuz_stage_seconds gauge',
+    ]
+    for report in reports:
+        for stage, values in report['stages'].items():
+            for kind in ('wall', 'network', 'sleep', 'ocr'):
+                labels = (f'host="{_escape_label(report["hostname"])}",user="{_escape_label(report["username"])}",'
+                          f'stage="{stage}",kind="{kind}"')
+                lines.append(f'discuz_stage_seconds{{{labels}}} {values[kind]}')
+    for metric, field, help_text in (('discuz_stage_requests', 'requests', 'HTTP requests per pipeline stage.'),
+                                     ('discuz_stage_bytes', 'bytes', 'Bytes downloaded per pipeline stage.')):
+        lines.append(f'# HELP {metric} {help_text}')
+        lines.append(f'# TYPE {metric} gauge')
+        for report in reports:
+            for stage, values in report['stages'].items():
+                labels = (f'host="{_escape_label(report["hostname"])}",user="{_escape_label(report["username"])}",'
+                          f'stage="{stage}"')
+                lines.append(f'{metric}{{{labels}}} {values[field]}')
+    return '\n'.join(lines) + '\n'
+
+
+def write_reports(reports, metrics_dir=None, log=True):
+    """
+    输出运行报告，每个账号记录一行汇总日志；
+    设置了metrics_dir（默认取环境变量METRICS_DIR）时写入JSON和Prometheus textfile
+
+    参数:
+        reports: RunMetrics.report()结果列表
+        metrics_dir: 报告保存目录
+        log: 是否为每个账号输出汇总日志
+    """
+    for report in reports if log else ():
+        logging.info(f'运行计时 {report["username"]}@{report["hostname"]}: '
+                     f'{json.dumps(report["total"], ensure_ascii=False)}')
+
+    metrics_dir = metrics_dir or os.environ.get('METRICS_DIR', '')
+    if not metrics_dir:
+        return
+    os.makedirs(metrics_dir, exist_ok=True)
+    with open(os.path.join(metrics_dir, 'discuz_metrics.json'), 'w', encoding='utf-8') as f:
+        json.dump(reports, f, ensure_ascii=False, indent=2)
+    # 先写临时文件再替换，避免node_exporter读到不完整的文件
+    prom_path = os.path.join(metrics_dir, 'discuz_metrics.prom')
+    with open(prom_path + '.tmp', 'w', encoding='utf-8') as f:
+        f.write(format_prometheus(reports))
+    os.replace(prom_path + '.tmp', prom_path)
+    logging.info(f'运行报告已写入 {metrics_dir}')
@@ -0,0 +1,510 @@
+"""
+本地模拟Discuz服务器
+实现签到流程用到的全部接口，用于在不访问真实论坛的情况下测试和压测：
+    /                                   首页；开启Cloudflare模拟时所有页面都先返回验证页，直到下发cf_clearance
+    member.php?mod=logging              登录页面和登录提交
+    misc.php?mod=seccode                验证码更新、图片（答案已知）和校验
+    forum.php                           论坛首页（formhash、积分、discuz_uid）
+    home.php?mod=spacecp&ac=credit      金币数量
+    k_misign-sign.html                  k_misign签到页面（今日签到状态）和签到接口
+    plugin.php?id=dsu_paulsign:sign     dsu_paulsign签到页面和签到接口（signin_plugin='dsu_paulsign'时）
+    space-uid-*.html                    用户主页，部分用户不存在
+    /__stats                            服务器统计（验证码校验次数、通过次数等）
+
+可注入延迟和随机失败，用法:
+    python mock_discuz.py --port 8080 --latency 0.05 --failure-rate 0.01
+"""
+
+import argparse
+import hashlib
+import io
+import json
+import random
+import re
+import secrets
+import string
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+CAPTCHA_CHARS = 'abcdefghjkmnpqrstuvwxy3456789'
+
+
+class MockConfig:
+    """
+    模拟服务器配置
+    """
+    def __init__(self, latency=0.0, jitter=0.0, failure_rate=0.0, captcha=True, captcha_noise=True,
+                 cf_challenges=0, password='password', deleted_ratio=0.3, signin_plugin='k_misign'):
+        """
+        参数:
+            latency: 每个请求的固定延迟（秒）
+            jitter: 在固定延迟上增加的随机延迟上限（秒）
+            failure_rate: 返回502的概率
+            captcha: 登录是否需要验证码
+            captcha_noise: 验证码图片是否带干扰线
+            cf_challenges: 没有cf_clearance的会话先收到几次Cloudflare验证页（503），之后下发cf_clearance
+            password: 所有账号的密码
+            deleted_ratio: 不存在的用户主页比例
+            signin_plugin: 安装的签到插件，k_misign或dsu_paulsign
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.captcha = captcha
+        self.captcha_noise = captcha_noise
+        self.cf_challenges = cf_challenges
+        self.password = password
+        self.deleted_ratio = deleted_ratio
+        self.signin_plugin = signin_plugin
+
+    def space_exists(self, uid):
+        # 用uid哈希决定用户是否存在，保证同一uid每次结果相同
+        return int(hashlib.md5(str(uid).encode()).hexdigest(), 16) % 100 >= self.deleted_ratio * 100
+
+    def listed_uids(self, start=611111, count=20):
+        """
+        论坛首页帖子列表中的作者UID，都是存在的用户
+        """
+        candidates = range(start, start + count * 97 * 10, 97)
+        return [uid for uid in candidates if self.space_exists(uid)][:count]
+
+
+class MockState:
+    """
+    模拟服务器的会话和统计数据
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sessions = {}
+        self.auth_tokens = {}
+        self.users = {}
+        self.signed = set()
+        self.clearances = set()
+        self.stats = dict.fromkeys(('requests', 'failures', 'logins', 'login_failures', 'captcha_images',
+                                    'captcha_checks', 'captcha_passes', 'signins', 'space_visits', 'cf_challenges',
+                                    'cf_clearances', 'connections'), 0)
+
+    def count(self, key, n=1):
+        with self.lock:
+            self.stats[key] += n
+
+    def user_uid(self, username):
+        with self.lock:
+            if username not in self.users:
+                self.users[username] = 1000 + len(self.users)
+            return self.users[username]
+
+
+# 验证码字体，依次尝试，都找不到时使用PIL自带的字体
+CAPTCHA_FONTS = ('DejaVuSans.ttf', 'LiberationSans-Regular.ttf', 'Arial.ttf', 'arial.ttf')
+CAPTCHA_FONT_SIZE = 28
+_captcha_font = None
+
+
+def captcha_font():
+    """
+    验证码使用的字体，PIL默认的点阵字体在100x40的图片上太小，识别模型几乎无法识别
+    """
+    global _captcha_font
+    if _captcha_font is None:
+        from PIL import ImageFont
+
+        for name in CAPTCHA_FONTS:
+            try:
+                _captcha_font = ImageFont.truetype(name, CAPTCHA_FONT_SIZE)
+                break
+            except OSError:
+                continue
+        else:
+            try:
+                _captcha_font = ImageFont.load_default(CAPTCHA_FONT_SIZE)
+            except TypeError:
+                # Pillow 10.1之前的版本不能指定默认字体的大小
+                _captcha_font = ImageFont.load_default()
+    return _captcha_font
+
+
+def render_captcha(code, noise=True, frames=1):
+    """
+    生成验证码图片
+
+    参数:
+        code: 验证码字符
+        noise: 是否加干扰线
+        frames: 帧数，大于1时生成字符逐个出现的GIF动图，只有最后一帧是完整的
+    """
+    from PIL import Image, ImageDraw
+
+    background = (random.randint(200, 255), random.randint(200, 255), random.randint(200, 255))
+    font = captcha_font()
+    offsets = [random.randint(-3, 3) for _ in code]
+    lines = [[(random.randint(0, 100), random.randint(0, 40)), (random.randint(0, 100), random.randint(0, 40))]
+             for _ in range(3 if noise else 0)]
+    images = []
+    for frame in range(frames):
+        shown = len(code) if frame == frames - 1 else len(code) * (frame + 1) // frames
+        image = Image.new('RGB', (100, 40), background)
+        draw = ImageDraw.Draw(image)
+        for i, char in enumerate(code[:shown]):
+            draw.text((10 + i * 21, 4 + offsets[i]), char, fill=(random.randint(0, 100),) * 3, font=font)
+        for line in lines:
+            draw.line(line, fill=(random.randint(100, 200),) * 3)
+        images.append(image)
+    buffer = io.BytesIO()
+    if frames > 1:
+        images[0].save(buffer, format='GIF', save_all=True, append_images=images[1:], duration=200, loop=0)
+    else:
+        images[0].save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def xml_response(message):
+    return f'<?xml version="1.0" encoding="utf-8"?>\n<root><![CDATA[{message}]]></root>'
+
+
+class MockDiscuzHandler(BaseHTTPRequestHandler):
+    """
+    模拟Discuz的请求处理
+    """
+    protocol_version = 'HTTP/1.1'
+
+    @property
+    def config(self):
+        return self.server.config
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def log_message(self, format, *args):
+        # 压测时请求很多，不输出访问日志
+        pass
+
+    def handle(self):
+        # 每个连接调用一次，统计客户端是否复用了连接
+        self.state.count('connections')
+        try:
+            super().handle()
+        except (ConnectionResetError, BrokenPipeError):
+            # 客户端流式读取时读到需要的内容就关闭连接
+            pass
+
+    def do_GET(self):
+        self.handle_request({})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode('utf-8', 'replace')
+        self.handle_request({k: v[0] for k, v in parse_qs(body, keep_blank_values=True).items()})
+
+    def send(self, status, body, content_type='text/html; charset=utf-8', cookies=(), headers=()):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        for cookie in cookies:
+            self.send_header('Set-Cookie', cookie)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def cookie_jar(self):
+        jar = {}
+        for part in (self.headers.get('Cookie') or '').split(';'):
+            if '=' in part:
+                k, v = part.strip().split('=', 1)
+                jar[k] = v
+        return jar
+
+    def cf_cleared(self, session, cookies):
+        """
+        带有效cf_clearance的请求直接通过，否则按会话计数，达到次数后下发cf_clearance
+        """
+        token = self.cookie_jar().get('cf_clearance')
+        with self.state.lock:
+            if token in self.state.clearances:
+                return True
+            session['cf_hits'] += 1
+            if session['cf_hits'] <= self.config.cf_challenges:
+                return False
+            token = secrets.token_hex(8)
+            self.state.clearances.add(token)
+        self.state.count('cf_clearances')
+        cookies.append(f'cf_clearance={token}; Path=/; Max-Age=1800')
+        return True
+
+    def get_session(self, cookies):
+        """
+        返回(会话ID, 会话数据, 需要设置的cookie)
+        """
+        jar = self.cookie_jar()
+        sid = jar.get('mock_sid')
+        with self.state.lock:
+            if sid not in self.state.sessions:
+                sid = secrets.token_hex(4)
+                self.state.sessions[sid] = {'uid': 0, 'codes': {}, 'cf_hits': 0}
+                cookies.append(f'mock_sid={sid}; Path=/')
+            session = self.state.sessions[sid]
+            uid = self.state.auth_tokens.get(jar.get('mock_auth'))
+            if uid:
+                session['uid'] = uid
+        return sid, session
+
+    @staticmethod
+    def formhash(sid, session):
+        return hashlib.md5(f'{sid}|{session["uid"]}'.encode()).hexdigest()[:8]
+
+    def handle_request(self, form):
+        config = self.config
+        self.state.count('requests')
+        if config.latency or config.jitter:
+            time.sleep(config.latency + random.uniform(0, config.jitter))
+        if config.failure_rate and random.random() < config.failure_rate:
+            self.state.count('failures')
+            self.send(502, 'Bad Gateway')
+            return
+
+        url = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query, keep_blank_values=True).items()}
+        cookies = []
+        sid, session = self.get_session(cookies)
+        path = url.path
+
+        if config.cf_challenges and path != '/__stats' and not self.cf_cleared(session, cookies):
+            self.state.count('cf_challenges')
+            self.send(503, '<html><body><div id="cf-browser-verification">Checking your browser...</div></body></html>',
+                      cookies=cookies, headers=[('cf-mitigated', 'challenge'), ('Retry-After', '1')])
+        elif path == '/__stats':
+            with self.state.lock:
+                body = json.dumps(self.state.stats)
+            self.send(200, body, 'application/json', cookies)
+        elif path == '/':
+            self.index(session, cookies)
+        elif path == '/forum.php':
+            self.forum(sid, session, cookies)
+        elif path == '/member.php' and query.get('mod') == 'logging':
+            if query.get('loginsubmit') == 'yes':
+                self.login_submit(sid, session, form, cookies)
+            else:
+                self.login_page(sid, session, cookies)
+        elif path == '/misc.php' and query.get('mod') == 'seccode':
+            self.seccode(session, query, cookies)
+        elif path == '/home.php' and query.get('ac') == 'credit':
+            self.credit(session, cookies)
+        elif path == '/k_misign-sign.html' and config.signin_plugin == 'k_misign':
+            self.sign(sid, session, query, cookies)
+        elif path == '/plugin.php' and query.get('id') == 'dsu_paulsign:sign' and config.signin_plugin == 'dsu_paulsign':
+            self.paulsign(sid, session, query, form, cookies)
+        elif re.fullmatch(r'/space-uid-(\d+)\.html', path):
+            self.space(int(re.fullmatch(r'/space-uid-(\d+)\.html', path).group(1)), session, cookies)
+        else:
+            self.send(404, 'Not Found', cookies=cookies)
+
+    def page(self, sid, session, content):
+        formhash = self.formhash(sid, session)
+        return (f'<html><head><script>var discuz_uid = \'{session["uid"]}\';</script></head><body>'
+                f'<a href="member.php?mod=logging&action=logout&formhash={formhash}&mobile=no">退出</a>'
+                f'{content}</body></html>')
+
+    def index(self, session, cookies):
+        self.send(200, '<html><body>Discuz! Board</body></html>', cookies=cookies)
+
+    def forum(self, sid, session, cookies):
+        formhash = self.formhash(sid, session)
+        credit = '积分: 100' if session['uid'] else '游客'
+        # 帖子列表中的作者链接
+        authors = ''.join(f'<a href="space-uid-{uid}.html">user{uid}</a>' for uid in self.config.listed_uids())
+        content = (f'<form><input type="hidden" name="formhash" value="{formhash}" /></form>'
+                   f'<a id="extcredits" class="showmenu">{credit}</a>'
+                   f'<div>{"x" * 20000}</div><div id="threadlist">{authors}</div>')
+        self.send(200, self.page(sid, session, content), cookies=cookies)
+
+    def login_page(self, sid, session, cookies):
+        loginhash = 'L' + ''.join(random.choices(string.ascii_letters, k=4))
+        seccode = ''
+        if self.config.captcha:
+            seccode = (f'<span id="seccode_cSA{sid}"></span>'
+                       f'<script>updateseccode(\'cSA{sid}\', \'<sec> <sec>\', \'member::logging\');</script>')
+        content = (f'<div id="main_messaqge_{loginhash}"><form method="post">'
+                   f'<input type="hidden" name="formhash" value="{self.formhash(sid, session)}" />'
+                   f'<select name="questionid"><option value="0">安全提问</option></select>'
+                   f'{seccode}</form></div>')
+        self.send(200, self.page(sid, session, content), cookies=cookies)
+
+    def login_submit(self, sid, session, form, cookies):
+        if form.get('formhash') != self.formhash(sid, session):
+            self.send(200, xml_response('您当前的访问请求当中含有非法字符，submit_invalid'), cookies=cookies)
+            return
+        if self.config.captcha:
+            expected = session['codes'].get(form.get('seccodehash', ''))
+            if not form.get('seccodeverify') or expected is None or \
+                    form['seccodeverify'].lower() != expected.lower():
+                self.send(200, xml_response('<script>errorhandle_ls(\'请输入验证码 seccodeverify\');</script>'),
+                          cookies=cookies)
+                return
+        if form.get('password') != self.config.password:
+            self.state.count('login_failures')
+            self.send(200, xml_response('<script>errorhandle_ls(\'登录失败，您还可以尝试 4 次\');</script>'),
+                      cookies=cookies)
+            return
+
+        uid = self.state.user_uid(form.get('username', ''))
+        token = secrets.token_hex(8)
+        with self.state.lock:
+            self.state.auth_tokens[token] = uid
+            session['uid'] = uid
+        self.state.count('logins')
+        cookies.append(f'mock_auth={token}; Path=/; Max-Age=2592000')
+        self.send(200, xml_response('<script>succeedhandle_ls(\'forum.php\', \'欢迎您回来\', {});</script>'),
+                  cookies=cookies)
+
+    def seccode(self, session, query, cookies):
+        idhash = query.get('idhash', '')
+        action = query.get('action')
+        if action == 'update':
+            with self.state.lock:
+                session['codes'][idhash] = ''.join(random.choices(CAPTCHA_CHARS, k=4))
+            self.send(200, 'if($(\'seccode_' + idhash + '\')) {}', 'application/javascript', cookies)
+        elif action == 'check':
+            self.state.count('captcha_checks')
+            expected = session['codes'].get(idhash)
+            if expected is not None and query.get('secverify', '').lower() == expected.lower():
+                self.state.count('captcha_passes')
+                self.send(200, xml_response('succeed'), 'text/xml', cookies)
+            else:
+                self.send(200, xml_response('invalid'), 'text/xml', cookies)
+        else:
+            with self.state.lock:
+                code = session['codes'].setdefault(idhash, ''.join(random.choices(CAPTCHA_CHARS, k=4)))
+            self.state.count('captcha_images')
+            self.send(200, render_captcha(code, self.config.captcha_noise), 'image/png', cookies)
+
+    def credit(self, session, cookies):
+        coins = 10 if session['uid'] else 0
+        self.send(200, xml_response(f'<span id="hcredit_1">100</span><span id="hcredit_2">{coins}</span>'),
+                  'text/xml', cookies)
+
+    def sign(self, sid, session, query, cookies):
+        if query.get('operation') != 'qiandao':
+            self.sign_page(sid, session, cookies)
+            return
+        self.sign_submit(sid, session, query.get('formhash'), cookies, '今日已签',
+                         '<div class="signbtn">签到成功，获得随机奖励 金币 5，已连续签到 1 天</div>')
+
+    def sign_submit(self, sid, session, formhash, cookies, already_message, success_message):
+        if not session['uid']:
+            self.send(200, xml_response('请先登录后再签到'), 'text/xml', cookies)
+            return
+        if formhash != self.formhash(sid, session):
+            self.send(200, xml_response('submit_invalid'), 'text/xml', cookies)
+            return
+        key = (session['uid'], time.strftime('%Y-%m-%d'))
+        with self.state.lock:
+            already = key in self.state.signed
+            self.state.signed.add(key)
+        if already:
+            self.send(200, xml_response(already_message), 'text/xml', cookies)
+        else:
+            self.state.count('signins')
+            self.send(200, xml_response(success_message), 'text/xml', cookies)
+
+    def paulsign(self, sid, session, query, form, cookies):
+        if query.get('operation') == 'qiandao':
+            self.sign_submit(sid, session, form.get('formhash'), cookies, '您今日已经签到，请明天再来！',
+                             '<div class="c">恭喜你签到成功!获得随机奖励 金币 5.</div>')
+            return
+        if not session['uid']:
+            content = '<div id="messagetext"><p>您需要先登录才能继续本操作</p></div>'
+        elif (session['uid'], time.strftime('%Y-%m-%d')) in self.state.signed:
+            content = '<h1 class="mt">您今天已经签到过了或者签到时间还未开始</h1>'
+        else:
+            content = (f'<form id="qiandao" method="post" action="plugin.php?id=dsu_paulsign:sign&operation=qiandao'
+                       f'&infloat=1&inajax=1"><input type="hidden" name="formhash" value="{self.formhash(sid, session)}">'
+                       f'<input type="hidden" name="qdxq" value=""></form>')
+        self.send(200, self.page(sid, session, f'{content}{"z" * 20000}'), cookies=cookies)
+
+    def sign_page(self, sid, session, cookies):
+        if not session['uid']:
+            button = '<a href="member.php?mod=logging&action=login">登录后签到</a>'
+        elif (session['uid'], time.strftime('%Y-%m-%d')) in self.state.signed:
+            button = '<a id="JD_sign" class="btnvisted">今日已签</a>'
+        else:
+            button = (f'<a id="JD_sign" href="plugin.php?id=k_misign:sign&operation=qiandao'
+                      f'&formhash={self.formhash(sid, session)}&format=empty">签到</a>')
+        self.send(200, self.page(sid, session, f'<div class="qdleft">{button}</div>{"z" * 20000}'), cookies=cookies)
+
+    def space(self, uid, session, cookies):
+        self.state.count('space_visits')
+        if not self.config.space_exists(uid):
+            self.send(404, self.page('', session, '抱歉，您指定的用户空间不存在'), cookies=cookies)
+        else:
+            self.send(200, self.page('', session, f'<div id="uhd">用户 {uid} 的个人空间{"y" * 30000}</div>'),
+                      cookies=cookies)
+
+
+class MockDiscuzServer:
+    """
+    在后台线程中运行的模拟服务器
+    """
+    def __init__(self, config=None, host='127.0.0.1', port=0):
+        self.httpd = ThreadingHTTPServer((host, port), MockDiscuzHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.config = config or MockConfig()
+        self.httpd.state = MockState()
+        self.thread = None
+
+    @property
+    def hostname(self):
+        host, port = self.httpd.server_address[:2]
+        return f'{host}:{port}'
+
+    @property
+    def stats(self):
+        with self.httpd.state.lock:
+            return dict(self.httpd.state.stats)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='mock-discuz', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='本地模拟Discuz服务器')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0.0, help='每个请求的固定延迟（秒）')
+    parser.add_argument('--jitter', type=float, default=0.0, help='随机延迟上限（秒）')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='返回502的概率')
+    parser.add_argument('--no-captcha', action='store_true', help='登录不需要验证码')
+    parser.add_argument('--cf-challenges', type=int, default=0, help='没有cf_clearance的会话先返回几次Cloudflare验证页')
+    parser.add_argument('--signin-plugin', default='k_misign', choices=('k_misign', 'dsu_paulsign'), help='安装的签到插件')
+    args = parser.parse_args(argv)
+
+    config = MockConfig(latency=args.latency, jitter=args.jitter, failure_rate=args.failure_rate,
+                        captcha=not args.no_captcha, cf_challenges=args.cf_challenges,
+                        signin_plugin=args.signin_plugin)
+    server = MockDiscuzServer(config, args.host, args.port)
+    print(f'模拟论坛运行在 http://{server.hostname}/ ，任意用户名，密码为 {config.password}')
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+"""
+共享验证码识别服务
+整个进程只加载一个ddddocr模型，并且只在第一次需要识别验证码时才加载。
+onnxruntime的推理可以在多个线程中同时进行，多个账号同时识别验证码时不互相等待；
+ddddocr的模型批次大小固定为1，无法把多张验证码合并成一次推理
+"""
+
+import logging
+import threading
+import time
+
+
+def patch_pil():
+    """
+    修复ANTIALIAS问题，PIL 9.1.0 及以上版本用 Image.Resampling.LANCZOS 替代了 Image.ANTIALIAS，
+    ddddocr内部仍在使用，加载模型前调用
+    """
+    from PIL import Image
+
+    if not hasattr(Image, 'ANTIALIAS'):
+        Image.ANTIALIAS = Image.Resampling.LANCZOS if hasattr(Image, 'Resampling') else Image.LANCZOS
+
+
+class OCRService:
+    """
+    验证码识别服务
+    """
+    def __init__(self):
+        self._ocr = None
+        self._load_lock = threading.Lock()
+        self._warm_lock = threading.Lock()
+        self._warming = False
+        self._charset_masks = {}
+        self._stats_lock = threading.Lock()
+        self.calls = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.load_seconds = 0.0
+
+    @property
+    def loaded(self):
+        return self._ocr is not None
+
+    def _get_ocr(self):
+        if self._ocr is None:
+            with self._load_lock:
+                if self._ocr is None:
+                    start = time.perf_counter()
+                    patch_pil()
+                    import ddddocr
+                    self._ocr = ddddocr.DdddOcr()
+                    self.load_seconds = time.perf_counter() - start
+                    logging.info(f'验证码识别模型加载完成，耗时 {self.load_seconds:.2f} 秒')
+        return self._ocr
+
+    def warm_up(self):
+        """
+        提前加载模型，常驻运行时避免第一个验证码等待加载
+        """
+        try:
+            self._get_ocr()
+        except Exception as e:
+            logging.error(f'验证码识别模型加载失败: {str(e)}')
+
+    def warm_up_in_background(self):
+        """
+        在后台线程中加载模型，已加载或正在加载时直接返回
+        """
+        with self._warm_lock:
+            if self.loaded or self._warming:
+                return
+            self._warming = True
+        threading.Thread(target=self.warm_up, name='ocr-warm-up', daemon=True).start()
+
+    def classification(self, img_bytes, charset=None):
+        """
+        识别验证码图片，可以在多个线程中同时调用
+
+        参数:
+            img_bytes: 图片二进制数据
+            charset: 允许的字符集合，为None时不限制
+
+        返回:
+            识别结果字符串
+        """
+        if charset:
+            return self.classification_with_confidence(img_bytes, charset)[0]
+        ocr = self._get_ocr()
+        start = time.perf_counter()
+        try:
+            return ocr.classification(img_bytes)
+        finally:
+            self._record(time.perf_counter() - start)
+
+    def classification_with_confidence(self, img_bytes, charset=None):
+        """
+        识别验证码图片并给出置信度
+
+        返回:
+            (识别结果, 置信度)，置信度为各字符最大概率中的最小值，
+            ddddocr版本不支持概率输出时置信度为None
+        """
+        ocr = self._get_ocr()
+        start = time.perf_counter()
+        try:
+            return self._classify_with_confidence(ocr, img_bytes, charset)
+        finally:
+            self._record(time.perf_counter() - start)
+
+    def _charset_mask(self, charsets, charset):
+        """
+        模型字符表中允许输出的位置，空白符始终允许
+        """
+        import numpy as np
+
+        key = (len(charsets), charset)
+        mask = self._charset_masks.get(key)
+        if mask is None:
+            mask = np.array([c == '' or c in charset for c in charsets])
+            self._charset_masks[key] = mask
+        return mask
+
+    def _classify_with_confidence(self, ocr, img_bytes, charset=None):
+        try:
+            result = ocr.classification(img_bytes, probability=True)
+        except TypeError:
+            # 旧版本ddddocr没有probability参数，只能在识别结果中去掉不允许的字符
+            text = ocr.classification(img_bytes)
+            if charset:
+                text = ''.join(c for c in text if c in charset)
+            return text, None
+
+        import numpy as np
+        # ddddocr 1.6起字段名改为charset和probabilities，概率多一个批次维度
+        charsets = result['charsets'] if 'charsets' in result else result['charset']
+        probability = np.asarray(result['probability'] if 'probability' in result else result['probabilities'])
+        probability = probability.reshape(-1, len(charsets))
+        if charset:
+            # 屏蔽不允许的字符后按剩余字符重新归一化
+            probability = probability * self._charset_mask(charsets, charset)
+            probability = probability / np.maximum(probability.sum(axis=1, keepdims=True), 1e-12)
+        indexes = probability.argmax(axis=1)
+        max_probs = probability.max(axis=1)
+
+        # 与ddddocr相同的CTC贪心解码：合并连续重复字符并去掉空白符
+        text = []
+        confidence = 1.0
+        last = None
+        for index, prob in zip(indexes, max_probs):
+            if index != last and charsets[index] != '':
+                text.append(charsets[index])
+                confidence = min(confidence, float(prob))
+            last = index
+        return ''.join(text), (confidence if text else 0.0)
+
+    def _record(self, seconds):
+        with self._stats_lock:
+            self.calls += 1
+            self.total_seconds += seconds
+            self.max_seconds = max(self.max_seconds, seconds)
+
+    def stats(self):
+        """
+        识别耗时统计
+        """
+        with self._stats_lock:
+            return {
+                'loaded': self.loaded,
+                'load_seconds': round(self.load_seconds, 3),
+                'calls': self.calls,
+                'avg_ms': round(self.total_seconds / self.calls * 1000, 1) if self.calls else 0.0,
+                'max_ms': round(self.max_seconds * 1000, 1),
+            }
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_ocr_service():
+    """
+    获取进程内共享的验证码识别服务
+    """
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = OCRService()
+    return _service
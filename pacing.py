@@ -0,0 +1,169 @@
+"""
+请求节奏控制
+按论坛限制请求速度，代替分散在各处的固定等待：
+    - 每个论坛一个令牌桶，限制平均请求速度和突发请求数
+    - 同一论坛相邻两个请求之间至少间隔min_interval，再加上随机抖动
+    - 等待只占用发出请求的账号，其它账号（以及其它论坛）的请求照常发出
+
+配置可通过环境变量修改:
+    PACING_RATE: 每个论坛每秒最多请求数，默认1，设为0不限制
+    PACING_BURST: 令牌桶容量，默认3
+    PACING_MIN_INTERVAL: 同一论坛相邻请求的最小间隔（秒），默认0.5
+    PACING_JITTER: 在最小间隔上增加的随机间隔上限（秒），默认0.5
+    PACING_HOSTS: 按论坛覆盖上述设置的JSON，例如 {"www.xxx.com": {"rate": 2, "burst": 5}}
+"""
+
+import json
+import logging
+import os
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+
+class PacingConfig:
+    """
+    一个论坛的请求节奏设置
+    """
+    def __init__(self, rate=1.0, burst=3, min_interval=0.5, jitter=0.5):
+        """
+        参数:
+            rate: 每秒最多请求数，为0时不限制
+            burst: 令牌桶容量，空闲后最多可以连续发出的请求数
+            min_interval: 相邻请求的最小间隔（秒）
+            jitter: 随机增加的间隔上限（秒）
+        """
+        self.rate = rate
+        self.burst = burst
+        self.min_interval = min_interval
+        self.jitter = jitter
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            rate=float(os.environ.get('PACING_RATE', 1)),
+            burst=float(os.environ.get('PACING_BURST', 3)),
+            min_interval=float(os.environ.get('PACING_MIN_INTERVAL', 0.5)),
+            jitter=float(os.environ.get('PACING_JITTER', 0.5)),
+        )
+
+
+class HostBucket:
+    """
+    一个论坛的令牌桶
+    请求先预约发出时间再在锁外等待，多个账号同时请求时按预约顺序排队
+    """
+    def __init__(self, config):
+        self.config = config
+        self.tokens = config.burst
+        self.updated = time.monotonic()
+        self.next_allowed = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """
+        预约一次请求
+
+        返回:
+            需要等待的秒数
+        """
+        config = self.config
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self.next_allowed)
+            if config.rate > 0:
+                self.tokens = min(config.burst, self.tokens + (now - self.updated) * config.rate)
+                self.updated = now
+                if self.tokens < 1:
+                    start = max(start, now + (1 - self.tokens) / config.rate)
+                # 令牌可以为负数，表示已被后面排队的请求预约
+                self.tokens -= 1
+            self.next_allowed = start + config.min_interval + random.uniform(0, config.jitter)
+            return start - now
+
+
+class Pacer:
+    """
+    所有论坛的请求节奏控制
+    """
+    def __init__(self, default=None, overrides=None):
+        """
+        参数:
+            default: 默认的PacingConfig
+            overrides: 论坛主机地址 -> PacingConfig
+        """
+        self.default = default or PacingConfig.from_env()
+        self.overrides = overrides if overrides is not None else self._overrides_from_env()
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _overrides_from_env(self):
+        overrides = {}
+        try:
+            hosts = json.loads(os.environ.get('PACING_HOSTS') or '{}')
+        except Exception as e:
+            logging.error(f'PACING_HOSTS格式错误: {str(e)}')
+            return overrides
+        for host, values in hosts.items():
+            overrides[host] = PacingConfig(**{**vars(self.default), **values})
+        return overrides
+
+    def configure(self, hostname, **kwargs):
+        """
+        修改一个论坛的请求节奏，参数与PacingConfig相同
+        """
+        with self._lock:
+            config = PacingConfig(**{**vars(self.overrides.get(hostname, self.default)), **kwargs})
+            self.overrides[hostname] = config
+            self._buckets.pop(hostname, None)
+
+    def bucket(self, hostname):
+        with self._lock:
+            if hostname not in self._buckets:
+                self._buckets[hostname] = HostBucket(self.overrides.get(hostname, self.default))
+            return self._buckets[hostname]
+
+    def reserve(self, url):
+        """
+        为发往该地址的请求预约发出时间，返回需要等待的秒数
+        """
+        return self.bucket(urlsplit(url).netloc).reserve()
+
+    def instrument(self, session, metrics):
+        """
+        让session发出的每个请求都先按论坛排队，等待时间记入metrics
+
+        已经在外部等待过的请求（异步引擎）传入paced=True跳过等待
+        """
+        request = session.request
+
+        def paced_request(method, url, **kwargs):
+            if not kwargs.pop('paced', False):
+                metrics.sleep(self.reserve(url))
+            return request(method, url, **kwargs)
+
+        session.request = paced_request
+        return session
+
+    async def async_wait(self, url, metrics):
+        """
+        异步引擎使用的等待，等待期间不占用线程
+        """
+        await metrics.async_sleep(self.reserve(url))
+
+
+_pacer = None
+_pacer_lock = threading.Lock()
+
+
+def get_pacer():
+    """
+    获取进程内共享的请求节奏控制
+    """
+    global _pacer
+    if _pacer is None:
+        with _pacer_lock:
+            if _pacer is None:
+                _pacer = Pacer()
+    return _pacer
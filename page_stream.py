@@ -0,0 +1,153 @@
+"""
+流式页面读取
+逐块读取响应并解码，需要的内容（formhash、验证码ID等）都找到后立即停止，
+剩余部分不再解码和查找；剩余部分不多时读完丢弃，把连接还给连接池供下一个请求复用，
+只有剩余部分很大时才关闭连接。页面编码按论坛记录，从正常响应的响应头或meta标签确定后
+不再对每个响应做编码检测
+
+配置可通过环境变量修改:
+    STREAM_PAGES: 设为0时读取完整页面，默认1
+    MAX_PAGE_BYTES: 单个页面最多读取的字节数，默认2MB
+    DRAIN_BYTES: 停止读取后剩余部分不超过该字节数时读完并复用连接，否则关闭连接，默认256KB
+"""
+
+import codecs
+import logging
+import os
+import re
+import threading
+from urllib.parse import urlsplit
+
+STREAM_PAGES = os.environ.get('STREAM_PAGES', '1') != '0'
+MAX_PAGE_BYTES = int(os.environ.get('MAX_PAGE_BYTES', 2 * 1024 * 1024))
+DRAIN_BYTES = int(os.environ.get('DRAIN_BYTES', 256 * 1024))
+CHUNK_SIZE = 16 * 1024
+# 跨块匹配时保留的上一块末尾字符数，需要大于任何一个要匹配内容的长度
+OVERLAP = 1024
+
+HEADER_CHARSET_PATTERN = re.compile(r'charset=["\']?([\w-]+)', re.I)
+META_CHARSET_PATTERN = re.compile(rb'<meta[^>]+charset=["\']?([\w-]+)', re.I)
+
+_charsets = {}
+_charsets_lock = threading.Lock()
+
+
+def site_charset(response, head=b''):
+    """
+    获取响应所属论坛的页面编码，同一论坛只从一个明确声明了编码的正常响应中确定一次；
+    错误页、维护页可能由网关或CDN生成，编码与论坛页面不同，只用于解码自身，不记录
+
+    参数:
+        response: 响应对象
+        head: 已读取的页面开头，用于查找meta标签
+    """
+    host = urlsplit(response.url).netloc
+    with _charsets_lock:
+        charset = _charsets.get(host)
+    if charset:
+        return charset
+
+    match = HEADER_CHARSET_PATTERN.search(response.headers.get('content-type', ''))
+    if not match:
+        match = META_CHARSET_PATTERN.search(head)
+        if match is None:
+            # 页面开头没有声明编码时不记录，下次再确定
+            return 'utf-8'
+        charset = match.group(1).decode('ascii')
+    else:
+        charset = match.group(1)
+    try:
+        charset = codecs.lookup(charset).name
+    except LookupError:
+        charset = 'utf-8'
+    # GBK页面中常有GB2312之外的字符，统一按超集解码
+    if charset in ('gb2312', 'gbk'):
+        charset = 'gb18030'
+    if response.status_code == 200:
+        with _charsets_lock:
+            _charsets[host] = charset
+        logging.info(f'{host} 页面编码: {charset}')
+    return charset
+
+
+def decode_response(response):
+    """
+    用论坛的页面编码解码一个完整读取的响应，代替apparent_encoding检测
+    """
+    response.encoding = site_charset(response, response.content[:CHUNK_SIZE])
+    return response.text
+
+
+def release(response, limit=None):
+    """
+    结束以stream=True发出的请求，尽量把连接还给连接池
+    剩余内容不超过limit字节时读完丢弃，连接留给下一个请求复用；剩余内容更多时下载它比重新建立连接更慢，
+    直接关闭连接
+
+    参数:
+        response: 响应对象
+        limit: 最多读完丢弃的字节数，默认取DRAIN_BYTES
+
+    返回:
+        读完丢弃的字节数
+    """
+    limit = DRAIN_BYTES if limit is None else limit
+    raw = response.raw
+    drained = 0
+    try:
+        length = response.headers.get('content-length', '')
+        if not length.isdigit() or int(length) - raw.tell() <= limit:
+            # 没有Content-Length时边读边计数，超过limit仍未读完就放弃
+            while drained <= limit:
+                data = raw.read(CHUNK_SIZE, decode_content=True)
+                if not data:
+                    raw.release_conn()
+                    return drained
+                drained += len(data)
+    except Exception as e:
+        logging.info(f'读取剩余内容失败，关闭连接: {e}')
+    response.close()
+    return drained
+
+
+def read_until(response, patterns=(), max_bytes=None):
+    """
+    逐块读取响应，所有patterns都找到后停止读取
+
+    参数:
+        response: 以stream=True发出的请求的响应
+        patterns: 需要找到的正则表达式列表，为空时读取完整页面
+        max_bytes: 最多读取的字节数，默认取MAX_PAGE_BYTES
+
+    返回:
+        (已读取的页面内容, 下载的字节数，包括为复用连接读完丢弃的部分)
+    """
+    max_bytes = max_bytes or MAX_PAGE_BYTES
+    pending = list(patterns) if STREAM_PAGES else []
+    stop_early = bool(pending)
+    parts = []
+    tail = ''
+    size = 0
+    decoder = None
+    try:
+        for chunk in response.iter_content(CHUNK_SIZE):
+            if decoder is None:
+                decoder = codecs.getincrementaldecoder(site_charset(response, chunk))(errors='replace')
+            size += len(chunk)
+            text = decoder.decode(chunk)
+            parts.append(text)
+            if pending:
+                # 只在新内容和上一块末尾中查找，避免重复扫描整个页面
+                window = tail + text
+                pending = [p for p in pending if not p.search(window)]
+                tail = window[-OVERLAP:]
+            if stop_early and not pending:
+                break
+            if size >= max_bytes:
+                logging.info(f'页面超过 {max_bytes} 字节，停止读取: {response.url}')
+                break
+        if decoder is not None:
+            parts.append(decoder.decode(b'', final=True))
+    finally:
+        size += release(response)
+    return ''.join(parts), size
@@ -0,0 +1,219 @@
+"""
+性能分析模块
+在一个进程内运行签到流程，分析CPU和内存实际消耗在哪里（cloudscraper的验证脚本解释、验证码识别、
+大页面的正则匹配、日志格式化等），与metrics.py的请求计时互补：
+    - cProfile: Python 3.12之前每个线程分别记录，结束时合并为一个pstats文件，可用snakeviz等工具查看；
+      3.12起cProfile基于sys.monitoring，一个分析器就覆盖所有线程
+    - 采样: 按墙钟时间定时采样所有线程的调用栈（包括网络和主动等待，跳过空闲的线程），按当前阶段
+      （timed_stage标记的cloudflare、login_page、captcha等）作为根节点写成collapsed stack文件，
+      可直接用flamegraph.pl或speedscope生成火焰图
+    - tracemalloc: 每个账号执行前后各取一次快照，记录该账号新增内存最多的代码位置和峰值内存
+
+输出文件:
+    profile.pstats      合并后的cProfile结果
+    profile.txt         按累计耗时排序的前若干个函数
+    profile.collapsed   按阶段分组的采样调用栈
+    allocations.txt     每个账号新增内存最多的代码位置
+    profile.json        每个账号的峰值内存、分配位置和各阶段采样数
+"""
+
+import contextlib
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+
+from metrics import set_stage_observer
+
+# 采样间隔（秒）
+SAMPLE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL', 0.005))
+# 每个账号记录的内存分配位置数
+TOP_ALLOCATIONS = int(os.environ.get('PROFILE_TOP', 20))
+# Python 3.12起cProfile基于sys.monitoring，进程内同时只能启用一个，在主线程启用后已覆盖所有线程；
+# 再为新线程启用会抛出ValueError，线程随之退出，线程池中的任务永远不会完成
+PER_THREAD_PROFILE = sys.version_info < (3, 12)
+# 空闲等待的线程停在这些函数中，采样时跳过
+IDLE_FRAMES = {('threading.py', 'wait'), ('thread.py', '_worker')}
+
+
+def frame_label(frame):
+    code = frame.f_code
+    return f'{os.path.basename(code.co_filename)}:{code.co_name}'
+
+
+class RunProfiler:
+    """
+    整个运行期间的CPU和内存分析
+    """
+    def __init__(self, output_dir, interval=SAMPLE_INTERVAL, top=TOP_ALLOCATIONS, trace_frames=10):
+        """
+        参数:
+            output_dir: 结果保存目录
+            interval: 调用栈采样间隔（秒）
+            top: 每个账号记录的内存分配位置数
+            trace_frames: tracemalloc为每次分配保存的调用栈层数
+        """
+        self.output_dir = output_dir
+        self.interval = interval
+        self.top = top
+        self.trace_frames = trace_frames
+        self.profiles = []
+        self.stacks = {}
+        self.stage_samples = {}
+        self.samples = 0
+        self.accounts = []
+        self._stages = {}
+        self._stage = 'other'
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._paused = False
+        self._sampler = None
+
+    def stage_changed(self, stage):
+        """
+        阶段切换通知，由RunMetrics在进入和退出timed_stage时调用
+        """
+        self._stages[threading.get_ident()] = stage
+        self._stage = stage
+
+    def _thread_profile(self, frame, event, arg):
+        # 新线程第一次触发时为它创建单独的cProfile，enable后取代本函数
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # 其它分析工具已在运行，该线程只通过采样记录
+            sys.setprofile(None)
+            return
+        with self._lock:
+            self.profiles.append(profile)
+
+    def _sample(self):
+        own = threading.get_ident()
+        while not self._stopped.wait(self.interval):
+            if self._paused:
+                continue
+            for ident, frame in sys._current_frames().items():
+                if ident == own or (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name) in IDLE_FRAMES:
+                    continue
+                # 没有标记过阶段的线程（例如访问用户主页的线程池）记到最近一次切换的阶段
+                stage = self._stages.get(ident, self._stage)
+                labels = []
+                while frame is not None:
+                    labels.append(frame_label(frame))
+                    frame = frame.f_back
+                stack = ';'.join([f'stage:{stage}', *reversed(labels)])
+                self.stacks[stack] = self.stacks.get(stack, 0) + 1
+                self.stage_samples[stage] = self.stage_samples.get(stage, 0) + 1
+                self.samples += 1
+
+    def start(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        tracemalloc.start(self.trace_frames)
+        set_stage_observer(self)
+        # 采样线程在设置线程profile之前启动，不计入cProfile结果
+        self._sampler = threading.Thread(target=self._sample, name='profile-sampler', daemon=True)
+        self._sampler.start()
+        if PER_THREAD_PROFILE:
+            threading.setprofile(self._thread_profile)
+        profile = cProfile.Profile()
+        self.profiles.append(profile)
+        profile.enable()
+        logging.info(f'性能分析已开启，结果保存到 {self.output_dir}')
+        return self
+
+    @contextlib.contextmanager
+    def account(self, hostname, username):
+        """
+        记录一个账号执行期间新增内存最多的代码位置
+        """
+        tracemalloc.reset_peak()
+        before = tracemalloc.take_snapshot()
+        samples_before = self.samples
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            current, peak = tracemalloc.get_traced_memory()
+            # 比较快照的耗时不计入分析结果
+            self._paused = True
+            self.profiles[0].disable()
+            diff = [stat for stat in tracemalloc.take_snapshot().compare_to(before, 'lineno')
+                    if stat.traceback[0].filename not in (tracemalloc.__file__, __file__)]
+            self.profiles[0].enable()
+            self._paused = False
+            self.accounts.append({
+                'hostname': hostname,
+                'username': username,
+                'seconds': round(seconds, 3),
+                'samples': self.samples - samples_before,
+                'traced_kb': round(current / 1024, 1),
+                'peak_kb': round(peak / 1024, 1),
+                'allocations': [
+                    {
+                        'site': f'{stat.traceback[0].filename}:{stat.traceback[0].lineno}',
+                        'size_kb': round(stat.size_diff / 1024, 1),
+                        'count': stat.count_diff,
+                    }
+                    for stat in diff[:self.top] if stat.size_diff > 0
+                ],
+            })
+
+    def stop(self):
+        """
+        停止分析并写入结果文件
+
+        返回:
+            文件名 -> 路径
+        """
+        self.profiles[0].disable()
+        if PER_THREAD_PROFILE:
+            threading.setprofile(None)
+        set_stage_observer(None)
+        self._stopped.set()
+        self._sampler.join()
+        tracemalloc.stop()
+
+        paths = {name: os.path.join(self.output_dir, name) for name in (
+            'profile.pstats', 'profile.txt', 'profile.collapsed', 'allocations.txt', 'profile.json')}
+        with self._lock:
+            profiles = list(self.profiles)
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            try:
+                stats.add(profile)
+            except TypeError:
+                # 线程没有执行任何函数时没有统计结果
+                continue
+        stats.dump_stats(paths['profile.pstats'])
+        buffer = io.StringIO()
+        pstats.Stats(paths['profile.pstats'], stream=buffer).sort_stats('cumulative').print_stats(40)
+        with open(paths['profile.txt'], 'w', encoding='utf-8') as f:
+            f.write(buffer.getvalue())
+
+        with open(paths['profile.collapsed'], 'w', encoding='utf-8') as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write(f'{stack} {count}\n')
+
+        with open(paths['allocations.txt'], 'w', encoding='utf-8') as f:
+            for account in self.accounts:
+                f.write(f'{account["username"]}@{account["hostname"]}: 耗时 {account["seconds"]}s，'
+                        f'峰值 {account["peak_kb"]} KB\n')
+                for allocation in account['allocations']:
+                    f.write(f'    {allocation["size_kb"]:>10} KB  {allocation["count"]:>7}  {allocation["site"]}\n')
+
+        with open(paths['profile.json'], 'w', encoding='utf-8') as f:
+            json.dump({'interval': self.interval, 'stage_samples': self.stage_samples, 'accounts': self.accounts},
+                      f, ensure_ascii=False, indent=2)
+
+        busiest = sorted(self.stage_samples.items(), key=lambda item: -item[1])[:5]
+        logging.info(f'性能分析结果已保存到 {self.output_dir}，采样最多的阶段: '
+                     + '，'.join(f'{stage} {count}' for stage, count in busiest))
+        return paths
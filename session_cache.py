@@ -0,0 +1,108 @@
+"""
+登录会话缓存模块
+保存登录后的cookie（包含Cloudflare的cf_clearance）、User-Agent和发帖formhash，
+下次运行时先恢复会话，只有会话失效时才走完整登录流程
+"""
+
+import logging
+import time
+
+from store import JsonStore
+
+# 与登录时提交的cookietime保持一致，即30天
+SESSION_TTL = 2592000
+
+
+class SessionCache:
+    """
+    按 论坛地址+用户名 保存登录会话
+    """
+    def __init__(self, store=None, ttl=SESSION_TTL):
+        """
+        参数:
+            store: JsonStore对象，默认保存到缓存目录下的sessions.json
+            ttl: 会话最长有效期（秒）
+        """
+        self.store = store or JsonStore('sessions.json')
+        self.ttl = ttl
+
+    @staticmethod
+    def _key(hostname, username):
+        return f'{hostname}|{username}'
+
+    @staticmethod
+    def _expired(data, now):
+        return [key for key, entry in data.items() if entry.get('expires', 0) <= now]
+
+    @classmethod
+    def _evict_expired(cls, data, now):
+        expired = cls._expired(data, now)
+        for key in expired:
+            del data[key]
+        if expired:
+            logging.info(f'清理过期会话 {len(expired)} 个')
+
+    def load(self, session, hostname, username):
+        """
+        将缓存的会话恢复到session中
+
+        返回:
+            缓存的发帖formhash，没有可用缓存时返回None
+        """
+        now = time.time()
+        # 只读取，不持有写锁也不重写文件；确实有过期会话时才加锁清理并写回
+        data = self.store.load()
+        if self._expired(data, now):
+            with self.store.update() as data:
+                self._evict_expired(data, now)
+        entry = data.get(self._key(hostname, username))
+        if entry is None:
+            return None
+
+        for cookie in entry['cookies']:
+            session.cookies.set(
+                cookie['name'], cookie['value'],
+                domain=cookie['domain'], path=cookie['path'],
+                secure=cookie['secure'], expires=cookie['expires']
+            )
+        # cf_clearance与User-Agent绑定，必须使用相同的UA
+        if entry.get('user_agent'):
+            session.headers['User-Agent'] = entry['user_agent']
+        return entry['post_formhash']
+
+    def save(self, session, hostname, username, post_formhash):
+        """
+        保存当前会话
+        """
+        now = time.time()
+        cookies = []
+        expires = now + self.ttl
+        for cookie in session.cookies:
+            cookies.append({
+                'name': cookie.name,
+                'value': cookie.value,
+                'domain': cookie.domain,
+                'path': cookie.path,
+                'secure': cookie.secure,
+                'expires': cookie.expires,
+            })
+            # Discuz的登录态保存在xxx_auth中，以它的过期时间为准
+            if cookie.name.endswith('_auth') and cookie.expires:
+                expires = min(expires, cookie.expires)
+
+        with self.store.update() as data:
+            self._evict_expired(data, now)
+            data[self._key(hostname, username)] = {
+                'cookies': cookies,
+                'user_agent': session.headers.get('User-Agent', ''),
+                'post_formhash': post_formhash,
+                'expires': expires,
+            }
+        logging.info(f'已缓存登录会话，有效期至 {time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(expires))}')
+
+    def invalidate(self, hostname, username):
+        """
+        删除失效的会话
+        """
+        with self.store.update() as data:
+            data.pop(self._key(hostname, username), None)
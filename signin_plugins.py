@@ -0,0 +1,119 @@
+"""
+签到插件
+不同论坛使用不同的签到插件，每个插件提供签到页面地址、今日签到状态的识别、签到请求的构建和响应解析；
+论坛使用哪个插件由站点配置（site_profile.py）自动识别后记录
+"""
+
+import re
+
+from k_misign import SIGN_STATE_PATTERN, parse_sign_page, parse_signin_response
+
+USER_AGENT = ('Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) '
+              'Chrome/113.0.0.0 Safari/537.36')
+
+
+class SigninPlugin:
+    """
+    签到插件
+    """
+    name = ''
+    page_path = ''
+
+    def page_url(self, base_url):
+        """
+        签到页面地址
+        """
+        return f'{base_url}/{self.page_path}'
+
+    def headers(self, base_url):
+        return {
+            "User-Agent": USER_AGENT,
+            "Referer": f"{base_url}/",
+            "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7",
+            "Accept-Language": "zh-CN,zh;q=0.9,en;q=0.8"
+        }
+
+    @property
+    def state_pattern(self):
+        """
+        签到页面中表示签到状态的内容，流式读取签到页面时找到即可停止
+        """
+        raise NotImplementedError
+
+    def parse_page(self, text):
+        """
+        从签到页面判断今天是否已经签到
+
+        返回:
+            True 已签到，False 未签到，None 不是该插件的页面或无法判断
+        """
+        raise NotImplementedError
+
+    def request(self, base_url, formhash):
+        """
+        构建签到请求
+
+        返回:
+            (请求方法, 地址, requests参数字典)
+        """
+        raise NotImplementedError
+
+    def parse_response(self, text):
+        """
+        解析签到响应，返回SigninResult对象
+        """
+        return parse_signin_response(text)
+
+
+class KMisign(SigninPlugin):
+    """
+    k_misign（每日签到）插件
+    """
+    name = 'k_misign'
+    page_path = 'k_misign-sign.html'
+    state_pattern = SIGN_STATE_PATTERN
+
+    def parse_page(self, text):
+        return parse_sign_page(text)
+
+    def request(self, base_url, formhash):
+        params = {
+            "operation": "qiandao",
+            "format": "button",
+            "formhash": formhash,
+            "inajax": 1,
+            "ajaxtarget": "midaben_sign"
+        }
+        return 'GET', self.page_url(base_url), {'params': params, 'headers': self.headers(base_url)}
+
+
+class DsuPaulsign(SigninPlugin):
+    """
+    dsu_paulsign（每日签到，选择心情）插件
+    """
+    name = 'dsu_paulsign'
+    page_path = 'plugin.php?id=dsu_paulsign:sign'
+    # 未签到时页面中有选择心情的qdxq表单，已签到时显示提示文字
+    state_pattern = re.compile(r'您今天已经签到过了|今日已签|name="qdxq"|id="qiandao"')
+    signed_pattern = re.compile(r'您今天已经签到过了|今日已签')
+
+    def parse_page(self, text):
+        if not self.state_pattern.search(text):
+            return None
+        return self.signed_pattern.search(text) is not None
+
+    def request(self, base_url, formhash):
+        data = {
+            'formhash': formhash,
+            'qdxq': 'kx',
+            'qdmode': '3',
+            'todaysay': '',
+            'fastreply': '0',
+        }
+        url = f'{base_url}/plugin.php?id=dsu_paulsign:sign&operation=qiandao&infloat=1&inajax=1'
+        return 'POST', url, {'data': data, 'headers': self.headers(base_url)}
+
+
+# 自动识别时按此顺序尝试
+SIGNIN_PLUGINS = {plugin.name: plugin for plugin in (KMisign(), DsuPaulsign())}
+DEFAULT_SIGNIN_PLUGIN = KMisign.name
@@ -0,0 +1,165 @@
+"""
+站点配置模块
+记录每个论坛实际使用的页面格式和签到插件，保存在缓存目录中：
+    - 登录页面、论坛首页中formhash、验证码ID等字段各有几种格式，记录每个论坛上匹配成功的那一种，
+      之后先用它匹配，流式读取页面时也用它判断何时停止
+    - 签到插件在第一次查询签到状态时自动识别，之后直接访问该插件的页面
+
+可以用环境变量SITE_PROFILES指定论坛的签到插件，例如 {"www.xxx.com": {"signin_plugin": "dsu_paulsign"}}
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+from store import JsonStore
+
+
+class SiteProfile:
+    """
+    一个论坛的站点配置
+    """
+    def __init__(self, host, signin_plugin=None, patterns=None, detected=None, on_change=None):
+        """
+        参数:
+            host: 论坛主机地址
+            signin_plugin: 签到插件名称，为None时还未识别
+            patterns: 字段类型 -> 匹配成功的格式序号
+            detected: 识别出签到插件的时间
+            on_change: 配置变化时的回调，参数为本对象
+        """
+        self.host = host
+        self.signin_plugin = signin_plugin
+        self.patterns = dict(patterns or {})
+        self.detected = detected
+        self.on_change = on_change
+
+    def to_dict(self):
+        return {'signin_plugin': self.signin_plugin, 'patterns': self.patterns, 'detected': self.detected}
+
+    def _changed(self):
+        if self.on_change is not None:
+            self.on_change(self)
+
+    def pattern(self, kind, patterns):
+        """
+        该论坛上这类字段使用的格式，没有记录时为第一种
+        """
+        return patterns[min(self.patterns.get(kind, 0), len(patterns) - 1)]
+
+    def match(self, kind, patterns, text):
+        """
+        匹配一类字段，先用记录的格式，失败时再依次尝试其它格式并记录匹配成功的那一种
+
+        参数:
+            kind: 字段类型，例如formhash
+            patterns: 该类字段的预编译正则表达式列表，第一个分组为字段值
+            text: 页面内容
+
+        返回:
+            字段值，都不匹配时返回空字符串
+        """
+        index = min(self.patterns.get(kind, 0), len(patterns) - 1)
+        match = patterns[index].search(text)
+        if match:
+            return match.group(1)
+        for other, pattern in enumerate(patterns):
+            if other == index:
+                continue
+            match = pattern.search(text)
+            if match:
+                logging.info(f'{self.host} 的{kind}使用第 {other + 1} 种格式')
+                self.patterns[kind] = other
+                self._changed()
+                return match.group(1)
+        return ''
+
+    def set_signin_plugin(self, name):
+        """
+        记录识别出的签到插件
+        """
+        if name == self.signin_plugin:
+            return
+        logging.info(f'{self.host} 使用签到插件 {name}')
+        self.signin_plugin = name
+        self.detected = time.time()
+        self._changed()
+
+
+class SiteProfiles:
+    """
+    所有论坛的站点配置
+    """
+    def __init__(self, store=None, overrides=None):
+        """
+        参数:
+            store: JsonStore对象，默认保存到缓存目录下的profiles.json
+            overrides: 论坛主机地址 -> 固定的配置字典，默认取环境变量SITE_PROFILES
+        """
+        self.store = store or JsonStore('profiles.json')
+        self.overrides = overrides if overrides is not None else self._overrides_from_env()
+        self._profiles = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _overrides_from_env():
+        try:
+            return json.loads(os.environ.get('SITE_PROFILES') or '{}')
+        except Exception as e:
+            logging.error(f'SITE_PROFILES格式错误: {str(e)}')
+            return {}
+
+    def _load(self):
+        if self._profiles is None:
+            try:
+                data = self.store.load()
+            except Exception as e:
+                logging.error(f'读取站点配置失败: {str(e)}')
+                data = {}
+            self._profiles = {}
+            for host, entry in data.items():
+                self._profiles[host] = SiteProfile(host, entry.get('signin_plugin'), entry.get('patterns'),
+                                                   entry.get('detected'), self.save)
+        return self._profiles
+
+    def get(self, host):
+        """
+        获取论坛的站点配置，没有时新建
+        """
+        with self._lock:
+            profiles = self._load()
+            if host not in profiles:
+                profiles[host] = SiteProfile(host, on_change=self.save)
+            profile = profiles[host]
+        override = self.overrides.get(host)
+        if override and override.get('signin_plugin'):
+            profile.signin_plugin = override['signin_plugin']
+        return profile
+
+    def save(self, profile):
+        """
+        保存一个论坛的站点配置
+        """
+        try:
+            with self.store.update() as data:
+                data[profile.host] = profile.to_dict()
+        except Exception as e:
+            logging.error(f'保存站点配置失败: {str(e)}')
+
+
+_profiles = None
+_profiles_lock = threading.Lock()
+
+
+def get_site_profiles():
+    """
+    获取进程内共享的站点配置
+    """
+    global _profiles
+    if _profiles is None:
+        with _profiles_lock:
+            if _profiles is None:
+                _profiles = SiteProfiles()
+    return _profiles
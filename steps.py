@@ -0,0 +1,151 @@
+"""
+同步和异步引擎共用的流程步骤
+登录、签到、访问用户主页等流程只写一次，写成生成器，需要等待的操作不直接执行，而是yield给驱动方：
+    Request: 发往论坛的请求，同步执行时由session按论坛排队；异步执行时在事件循环中排队，
+             轮到时才在线程中发出
+    Call: 其它阻塞操作（验证码识别、读写会话缓存和运行记录等），异步执行时放到线程中，不阻塞事件循环
+    Gather: 同时执行多个操作，同步时使用线程池，异步时使用asyncio.gather
+
+run()按同步方式驱动生成器，arun()在事件循环中驱动。用step装饰的方法直接调用时同步执行，
+method.steps(...)返回生成器，供其它流程yield from组合或交给arun()执行
+"""
+
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Call:
+    """
+    阻塞操作
+    """
+    def __init__(self, func, *args, **kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+
+    def run(self):
+        return self.func(*self.args, **self.kwargs)
+
+    async def arun(self):
+        return await asyncio.to_thread(self.func, *self.args, **self.kwargs)
+
+
+class Request(Call):
+    """
+    发往论坛的请求，func最终通过按论坛排队的session发出请求，并接受paced参数
+    """
+    def __init__(self, pacer, metrics, url, func, *args, **kwargs):
+        """
+        参数:
+            pacer: Pacer对象
+            metrics: RunMetrics对象，排队等待的时间记入其中
+            url: 请求地址，用于确定排队的论坛
+            func: 发出请求的函数，其余参数原样传给它
+        """
+        super().__init__(func, *args, **kwargs)
+        self.pacer = pacer
+        self.metrics = metrics
+        self.url = url
+
+    async def arun(self):
+        # 在事件循环中排队等待，轮到时才占用线程发出请求
+        await self.pacer.async_wait(self.url, self.metrics)
+        return await asyncio.to_thread(self.func, *self.args, paced=True, **self.kwargs)
+
+
+class Gather:
+    """
+    同时执行多个操作，按顺序返回结果列表
+    """
+    def __init__(self, operations, limit, name='step'):
+        """
+        参数:
+            operations: Call或Request对象列表
+            limit: 同时执行的数量
+            name: 同步执行时线程池的线程名前缀
+        """
+        self.operations = list(operations)
+        self.limit = limit
+        self.name = name
+
+    def run(self):
+        if not self.operations:
+            return []
+        with ThreadPoolExecutor(min(self.limit, len(self.operations)), thread_name_prefix=self.name) as executor:
+            return list(executor.map(lambda operation: operation.run(), self.operations))
+
+    async def arun(self):
+        limit = asyncio.Semaphore(self.limit)
+
+        async def run_one(operation):
+            async with limit:
+                return await operation.arun()
+
+        return await asyncio.gather(*(run_one(operation) for operation in self.operations))
+
+
+def run(steps):
+    """
+    同步执行流程生成器，返回流程的返回值
+    """
+    send, value = steps.send, None
+    while True:
+        try:
+            operation = send(value)
+        except StopIteration as stop:
+            return stop.value
+        try:
+            send, value = steps.send, operation.run()
+        except Exception as e:
+            # 操作抛出的异常交回流程中处理
+            send, value = steps.throw, e
+
+
+async def arun(steps):
+    """
+    在事件循环中执行流程生成器，返回流程的返回值
+    """
+    send, value = steps.send, None
+    while True:
+        try:
+            operation = send(value)
+        except StopIteration as stop:
+            return stop.value
+        try:
+            send, value = steps.send, await operation.arun()
+        except Exception as e:
+            send, value = steps.throw, e
+
+
+class step:
+    """
+    方法装饰器，把写成生成器的流程变成普通方法，直接调用时同步执行
+    """
+    def __init__(self, func):
+        functools.update_wrapper(self, func)
+        self.func = func
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        return BoundStep(self.func, obj)
+
+
+class BoundStep:
+    """
+    绑定到对象的流程方法
+    """
+    def __init__(self, func, obj):
+        functools.update_wrapper(self, func)
+        self.func = func
+        self.obj = obj
+
+    def __call__(self, *args, **kwargs):
+        return run(self.func(self.obj, *args, **kwargs))
+
+    def steps(self, *args, **kwargs):
+        """
+        返回流程生成器
+        """
+        return self.func(self.obj, *args, **kwargs)
@@ -0,0 +1,84 @@
+"""
+本地状态存储模块
+为会话缓存等需要跨运行保存的数据提供带文件锁的JSON读写
+"""
+
+import contextlib
+import json
+import logging
+import os
+
+try:
+    import fcntl
+except ImportError:  # Windows下没有fcntl，退化为无锁读写
+    fcntl = None
+
+# 缓存目录，可通过环境变量DISCUZ_CACHE_DIR修改
+CACHE_DIR = os.environ.get('DISCUZ_CACHE_DIR', '.discuz_cache')
+
+
+class JsonStore:
+    """
+    以JSON文件保存的字典存储，修改时持有排他文件锁，多个进程或线程同时运行时不会互相覆盖；
+    只读时持有共享锁，多个读取可以同时进行
+    """
+    def __init__(self, filename, cache_dir=None):
+        """
+        参数:
+            filename: 存储文件名
+            cache_dir: 存储目录，默认为CACHE_DIR
+        """
+        self.path = os.path.join(cache_dir or CACHE_DIR, filename)
+        self.lock_path = self.path + '.lock'
+
+    @contextlib.contextmanager
+    def locked(self, shared=False):
+        """
+        获取存储文件的锁
+
+        参数:
+            shared: 为True时获取共享锁，只用于读取
+        """
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.lock_path, 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logging.error(f'读取缓存文件失败，将重新创建: {self.path}, {str(e)}')
+            return {}
+
+    def _write(self, data):
+        # 先写临时文件再替换，避免中途退出留下损坏的文件
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def load(self):
+        """
+        读取全部数据，不写回
+        """
+        with self.locked(shared=True):
+            return self._read()
+
+    @contextlib.contextmanager
+    def update(self):
+        """
+        在锁内读取数据，退出时写回修改后的结果
+        """
+        with self.locked():
+            data = self._read()
+            yield data
+            self._write(data)
@@ -0,0 +1,167 @@
+"""
+HTTP传输层
+同一论坛的所有账号共用连接池，复用已建立的TLS连接，cookie仍然按账号隔离；
+所有请求默认带超时，避免一个卡住的连接拖住整个运行
+
+配置可通过环境变量修改:
+    HTTP_TIMEOUT: 请求超时（秒），默认30
+    HTTP_CONNECT_TIMEOUT: 建立连接超时（秒），默认10
+    HTTP_POOL_SIZE: 每个论坛保持的连接数，默认10
+    HTTP_RETRIES: 连接失败时的重试次数，默认2
+    DISCUZ_PROXY: 所有请求使用的代理，例如 http://127.0.0.1:7890 或 socks5://127.0.0.1:1080（需要安装requests[socks]），
+                  多节点运行时每个节点使用各自的出口
+"""
+
+import logging
+import os
+import threading
+
+import requests
+from urllib3.util.retry import Retry
+
+
+class TransportConfig:
+    """
+    传输层配置
+    """
+    def __init__(self, timeout=30.0, connect_timeout=10.0, pool_size=10, retries=2, pool_block=False, proxy=''):
+        """
+        参数:
+            timeout: 读取响应超时（秒）
+            connect_timeout: 建立连接超时（秒）
+            pool_size: 每个论坛保持的keep-alive连接数
+            retries: 连接失败时的重试次数，已发出的请求不会重试
+            pool_block: 连接数达到上限时是否等待空闲连接，而不是临时新建连接
+            proxy: 代理地址，为空时直接连接
+        """
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.pool_size = pool_size
+        self.retries = retries
+        self.pool_block = pool_block
+        self.proxy = proxy
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            timeout=float(os.environ.get('HTTP_TIMEOUT', 30)),
+            connect_timeout=float(os.environ.get('HTTP_CONNECT_TIMEOUT', 10)),
+            pool_size=int(os.environ.get('HTTP_POOL_SIZE', 10)),
+            retries=int(os.environ.get('HTTP_RETRIES', 2)),
+            proxy=os.environ.get('DISCUZ_PROXY', ''),
+        )
+
+
+class Transport:
+    """
+    按论坛共享连接池的会话工厂
+    """
+    def __init__(self, config=None):
+        self.config = config or TransportConfig.from_env()
+        self._adapters = {}
+        self._lock = threading.Lock()
+        self._plain_session = None
+
+    def _configure_adapter(self, adapter, pools=1):
+        config = self.config
+        # 带Retry-After的429/503交给调用方处理（例如Cloudflare验证页），不在连接层重试或抛出异常
+        adapter.max_retries = Retry(total=config.retries, read=0, status=0, backoff_factor=0.5,
+                                    respect_retry_after_header=False)
+        adapter._pool_connections = pools
+        adapter._pool_maxsize = config.pool_size
+        adapter._pool_block = config.pool_block
+        adapter.init_poolmanager(pools, config.pool_size, block=config.pool_block)
+
+    def _apply_timeout(self, session):
+        """
+        没有显式指定timeout的请求使用默认超时
+        """
+        timeout = (self.config.connect_timeout, self.config.timeout)
+        request = session.request
+
+        def request_with_timeout(method, url, **kwargs):
+            if kwargs.get('timeout') is None:
+                kwargs['timeout'] = timeout
+            return request(method, url, **kwargs)
+
+        session.request = request_with_timeout
+
+    def _apply_proxy(self, session):
+        if self.config.proxy:
+            session.proxies.update({'http': self.config.proxy, 'https': self.config.proxy})
+
+    def create_session(self, hostname):
+        """
+        为一个账号创建cloudscraper会话，同一论坛的会话共用连接池
+
+        参数:
+            hostname: 论坛主机地址
+        """
+        import cloudscraper
+
+        session = cloudscraper.create_scraper(
+            browser={
+                'browser': 'chrome',
+                'platform': 'windows',
+                'desktop': True
+            }
+        )
+        with self._lock:
+            adapters = self._adapters.get(hostname)
+            if adapters is None:
+                # 第一个会话的适配器带有cloudscraper设置的TLS参数，之后的会话直接复用
+                adapters = {prefix: session.get_adapter(f'{prefix}{hostname}/') for prefix in ('https://', 'http://')}
+                for adapter in adapters.values():
+                    self._configure_adapter(adapter)
+                self._adapters[hostname] = adapters
+                logging.info(f'为 {hostname} 创建连接池，连接数 {self.config.pool_size}')
+        for prefix, adapter in adapters.items():
+            session.mount(f'{prefix}{hostname}/', adapter)
+        self._apply_proxy(session)
+        self._apply_timeout(session)
+        return session
+
+    def plain_session(self):
+        """
+        访问发布页等非论坛地址使用的普通会话
+        """
+        with self._lock:
+            if self._plain_session is None:
+                session = requests.Session()
+                for prefix in ('https://', 'http://'):
+                    adapter = requests.adapters.HTTPAdapter()
+                    self._configure_adapter(adapter, pools=10)
+                    session.mount(prefix, adapter)
+                self._apply_proxy(session)
+                self._apply_timeout(session)
+                self._plain_session = session
+            return self._plain_session
+
+    def close(self):
+        """
+        关闭所有连接
+        """
+        with self._lock:
+            for adapters in self._adapters.values():
+                for adapter in adapters.values():
+                    adapter.close()
+            self._adapters.clear()
+            if self._plain_session is not None:
+                self._plain_session.close()
+                self._plain_session = None
+
+
+_transport = None
+_transport_lock = threading.Lock()
+
+
+def get_transport():
+    """
+    获取进程内共享的传输层
+    """
+    global _transport
+    if _transport is None:
+        with _transport_lock:
+            if _transport is None:
+                _transport = Transport()
+    return _transport
@@ -0,0 +1,321 @@
+"""
+共享任务队列
+多台机器（或多个出口IP）分担大量账号时，每个账号的 登录 -> 签到 -> 访问用户主页 作为一个任务放入共享的SQLite数据库，
+各节点的worker.py从中领取：
+    - 领取时带租约，节点在执行期间定期续约；节点退出或卡住时租约到期，任务由其它节点重新领取
+    - 失败的任务按指数退避重新排队，超过最大尝试次数后记为失败
+    - 每个任务的结果（与batch.py相同的格式）保存在数据库中，由任意一台机器汇总
+
+数据库使用SQLite默认的回滚日志而不是WAL，放在多台机器共同挂载的目录中也能使用（需要文件系统支持文件锁）
+
+用法:
+    python work_queue.py queue.sqlite3 enqueue accounts.yaml
+    python work_queue.py queue.sqlite3 status
+    python work_queue.py queue.sqlite3 results --output results.json
+"""
+
+import argparse
+import contextlib
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+from store import CACHE_DIR
+
+# 任务状态：pending 等待领取，leased 执行中，done 成功，failed 超过最大尝试次数
+STATUSES = ('pending', 'leased', 'done', 'failed')
+LEASE_SECONDS = int(os.environ.get('QUEUE_LEASE_SECONDS', 300))
+MAX_ATTEMPTS = int(os.environ.get('QUEUE_MAX_ATTEMPTS', 3))
+RETRY_DELAY = float(os.environ.get('QUEUE_RETRY_DELAY', 60))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    batch TEXT NOT NULL,
+    host TEXT NOT NULL,
+    username TEXT NOT NULL,
+    account TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    owner TEXT NOT NULL DEFAULT '',
+    lease_expires REAL NOT NULL DEFAULT 0,
+    available_at REAL NOT NULL DEFAULT 0,
+    result TEXT NOT NULL DEFAULT '',
+    error TEXT NOT NULL DEFAULT '',
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    UNIQUE (batch, host, username)
+);
+CREATE INDEX IF NOT EXISTS jobs_batch_status ON jobs (batch, status, available_at);
+"""
+
+
+def today():
+    return time.strftime('%Y-%m-%d')
+
+
+class Job:
+    """
+    领取到的任务
+    """
+    def __init__(self, id, account, attempts, max_attempts):
+        self.id = id
+        self.account = account
+        self.attempts = attempts
+        self.max_attempts = max_attempts
+
+    def __repr__(self):
+        return f'Job({self.id}, {self.account.get("username")}, 第{self.attempts}次)'
+
+
+class WorkQueue:
+    """
+    基于SQLite的任务队列
+    """
+    def __init__(self, path=None, batch=None, lease_seconds=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS,
+                 retry_delay=RETRY_DELAY):
+        """
+        参数:
+            path: 数据库文件路径，默认为缓存目录下的queue.sqlite3
+            batch: 批次名称，同一批次中每个账号只有一个任务，默认为当天日期
+            lease_seconds: 租约时长（秒），节点超过该时间没有续约时任务可被重新领取
+            max_attempts: 每个任务的最大尝试次数
+            retry_delay: 第一次失败后的重试等待时间（秒），之后每次加倍
+        """
+        self.path = path or os.path.join(CACHE_DIR, 'queue.sqlite3')
+        self.batch = batch or today()
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._lock = threading.Lock()
+        self._initialized = False
+
+    @contextlib.contextmanager
+    def connect(self):
+        """
+        打开一个写事务，BEGIN IMMEDIATE保证领取任务时多个节点不会拿到同一个任务
+        """
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            if not self._initialized:
+                with self._lock:
+                    conn.executescript(SCHEMA)
+                    self._initialized = True
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+
+    def enqueue(self, accounts):
+        """
+        把账号加入当前批次，已在批次中的账号不会重复加入
+
+        返回:
+            新加入的任务数
+        """
+        now = time.time()
+        added = 0
+        with self.connect() as conn:
+            for account in accounts:
+                host = account.get('hostname') or account.get('pub_url')
+                cursor = conn.execute(
+                    'INSERT OR IGNORE INTO jobs (batch, host, username, account, max_attempts, created, updated) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (self.batch, host, str(account['username']), json.dumps(account, ensure_ascii=False),
+                     self.max_attempts, now, now))
+                added += cursor.rowcount
+        return added
+
+    def lease(self, owner):
+        """
+        领取一个可执行的任务：等待中且已到重试时间的任务，或租约已过期的任务
+
+        参数:
+            owner: 节点标识
+
+        返回:
+            Job对象，没有可领取的任务时返回None
+        """
+        now = time.time()
+        with self.connect() as conn:
+            # 租约过期且已用完尝试次数的任务不再领取
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', error = '租约超时', owner = '', updated = ? "
+                "WHERE batch = ? AND status = 'leased' AND lease_expires < ? AND attempts >= max_attempts",
+                (now, self.batch, now))
+            row = conn.execute(
+                "SELECT id, account, attempts, max_attempts FROM jobs WHERE batch = ? AND "
+                "((status = 'pending' AND available_at <= ?) OR (status = 'leased' AND lease_expires < ?)) "
+                "ORDER BY available_at, id LIMIT 1",
+                (self.batch, now, now)).fetchone()
+            if row is None:
+                return None
+            job_id, account, attempts, max_attempts = row
+            conn.execute(
+                "UPDATE jobs SET status = 'leased', attempts = ?, owner = ?, lease_expires = ?, updated = ? "
+                "WHERE id = ?",
+                (attempts + 1, owner, now + self.lease_seconds, now, job_id))
+        return Job(job_id, json.loads(account), attempts + 1, max_attempts)
+
+    def renew(self, job_ids, owner):
+        """
+        延长节点正在执行的任务的租约
+
+        返回:
+            仍由该节点持有的任务ID集合，租约已被其它节点接手的任务不在其中
+        """
+        if not job_ids:
+            return set()
+        now = time.time()
+        placeholders = ','.join('?' * len(job_ids))
+        with self.connect() as conn:
+            conn.execute(
+                f"UPDATE jobs SET lease_expires = ?, updated = ? WHERE id IN ({placeholders}) "
+                f"AND status = 'leased' AND owner = ?",
+                (now + self.lease_seconds, now, *job_ids, owner))
+            rows = conn.execute(
+                f"SELECT id FROM jobs WHERE id IN ({placeholders}) AND status = 'leased' AND owner = ?",
+                (*job_ids, owner)).fetchall()
+        return {row[0] for row in rows}
+
+    def complete(self, job, owner, result):
+        """
+        记录任务成功
+
+        返回:
+            布尔值，租约已被其它节点接手时为False，结果不会写入
+        """
+        with self.connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = 'done', result = ?, error = '', updated = ? "
+                "WHERE id = ? AND status = 'leased' AND owner = ?",
+                (json.dumps(result, ensure_ascii=False), time.time(), job.id, owner))
+            return cursor.rowcount == 1
+
+    def fail(self, job, owner, error, result=None):
+        """
+        记录任务失败，未超过最大尝试次数时按指数退避重新排队
+
+        返回:
+            布尔值，表示是否会重试
+        """
+        now = time.time()
+        retry = job.attempts < job.max_attempts
+        status = 'pending' if retry else 'failed'
+        available_at = now + self.retry_delay * 2 ** (job.attempts - 1) if retry else 0
+        with self.connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, owner = '', available_at = ?, error = ?, result = ?, updated = ? "
+                "WHERE id = ? AND status = 'leased' AND owner = ?",
+                (status, available_at, str(error)[:500], json.dumps(result or {}, ensure_ascii=False), now,
+                 job.id, owner))
+        return retry
+
+    def counts(self):
+        """
+        当前批次各状态的任务数
+        """
+        counts = dict.fromkeys(STATUSES, 0)
+        with self.connect() as conn:
+            for status, count in conn.execute(
+                    'SELECT status, COUNT(*) FROM jobs WHERE batch = ? GROUP BY status', (self.batch,)):
+                counts[status] = count
+        return counts
+
+    def unfinished(self):
+        """
+        当前批次是否还有等待中或执行中的任务
+        """
+        counts = self.counts()
+        return counts['pending'] + counts['leased'] > 0
+
+    def nodes(self):
+        """
+        每个节点完成的任务数和账号耗时合计
+        """
+        nodes = {}
+        for result in self.results():
+            node = nodes.setdefault(result.get('node') or '-', {'done': 0, 'failed': 0, 'seconds': 0.0})
+            node['failed' if result.get('error') else 'done'] += 1
+            node['seconds'] = round(node['seconds'] + result.get('seconds', 0.0), 1)
+        return nodes
+
+    def results(self):
+        """
+        汇总当前批次的结果，格式与batch.py相同，按加入队列的顺序排列
+        """
+        results = []
+        with self.connect() as conn:
+            rows = conn.execute(
+                'SELECT host, username, status, attempts, result, error FROM jobs WHERE batch = ? ORDER BY id',
+                (self.batch,)).fetchall()
+        for host, username, status, attempts, result, error in rows:
+            result = json.loads(result) if result else {}
+            if not result:
+                result = {'hostname': host, 'username': username, 'login': False, 'signin': False, 'visit': False,
+                          'skipped': False, 'seconds': 0.0, 'error': ''}
+            result['status'] = status
+            result['attempts'] = attempts
+            if status in ('pending', 'leased'):
+                result['error'] = result.get('error') or '未完成'
+            elif status == 'failed':
+                result['error'] = result.get('error') or error
+            results.append(result)
+        return results
+
+
+def main(argv=None):
+    from batch import format_results, load_accounts
+    from metrics import write_reports
+
+    parser = argparse.ArgumentParser(description='多节点签到的共享任务队列')
+    parser.add_argument('path', help='队列数据库文件路径，所有节点使用同一个文件')
+    parser.add_argument('--batch', help='批次名称，默认为当天日期')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    enqueue_parser = subparsers.add_parser('enqueue', help='把账号文件中的账号加入队列')
+    enqueue_parser.add_argument('accounts', help='账号文件路径（YAML/JSON/CSV）')
+    enqueue_parser.add_argument('--max-attempts', type=int, default=MAX_ATTEMPTS, help='每个账号的最大尝试次数')
+    subparsers.add_parser('status', help='查看各状态的任务数和每个节点完成的任务数')
+    results_parser = subparsers.add_parser('results', help='汇总所有节点的结果')
+    results_parser.add_argument('--output', help='把结果以JSON格式写入该文件')
+    results_parser.add_argument('--metrics-dir', help='运行报告保存目录，默认取环境变量METRICS_DIR')
+    args = parser.parse_args(argv)
+
+    if args.command == 'enqueue':
+        queue = WorkQueue(args.path, args.batch, max_attempts=args.max_attempts)
+        added = queue.enqueue(load_accounts(args.accounts))
+        logging.info(f'批次 {queue.batch} 新加入 {added} 个账号')
+        return 0
+
+    queue = WorkQueue(args.path, args.batch)
+    if args.command == 'status':
+        counts = queue.counts()
+        print(f'批次 {queue.batch}: ' + '，'.join(f'{status} {counts[status]}' for status in STATUSES))
+        for node, stats in sorted(queue.nodes().items()):
+            print(f'  {node:<32} 成功 {stats["done"]:>5}  失败 {stats["failed"]:>5}  耗时 {stats["seconds"]}s')
+        return 0
+
+    results = queue.results()
+    print(format_results(results))
+    write_reports([r['metrics'] for r in results if r.get('metrics')], args.metrics_dir)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    failed = [r for r in results if r['error']]
+    logging.info(f'共 {len(results)} 个账号，失败 {len(failed)} 个')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
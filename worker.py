@@ -0,0 +1,175 @@
+"""
+多节点签到的工作节点
+从共享任务队列（work_queue.py）领取账号任务并执行，多台机器各运行一个节点即可横向扩展：
+    - 每个节点使用自己的出口（--proxy），论坛按IP的限速由各节点分别遵守，
+      请求速度控制、同一论坛的并发数和Cloudflare验证缓存都在节点内按出口生效
+    - 执行期间定期续约，节点退出后未完成的任务在租约到期后由其它节点接手
+    - 失败的任务重新排队，可能由其它节点（其它出口）重试
+
+用法:
+    python work_queue.py /mnt/shared/queue.sqlite3 enqueue accounts.yaml
+    python worker.py /mnt/shared/queue.sqlite3 --workers 8 --per-host 2 --proxy http://10.0.0.2:3128
+    python work_queue.py /mnt/shared/queue.sqlite3 results --output results.json
+"""
+
+import argparse
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from batch import BatchRunner
+from captcha_stats import CaptchaStats
+from journal import RunJournal
+from ocr_service import get_ocr_service
+from session_cache import SessionCache
+from transport import get_transport
+from work_queue import WorkQueue
+
+
+class QueueWorker:
+    """
+    从任务队列领取并执行账号任务的节点
+    """
+    def __init__(self, queue, runner, node=None, workers=4, poll_interval=5.0, wait=False):
+        """
+        参数:
+            queue: WorkQueue对象
+            runner: BatchRunner对象，用于执行单个账号
+            node: 节点标识，默认为主机名和进程号
+            workers: 同时执行的账号数
+            poll_interval: 暂时没有可领取的任务时的等待时间（秒）
+            wait: 为True时队列清空后继续等待新任务，否则退出
+        """
+        self.queue = queue
+        self.runner = runner
+        self.node = node or f'{socket.gethostname()}:{os.getpid()}'
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.wait = wait
+        self.active = set()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.processed = 0
+
+    def renew_leases(self):
+        """
+        定期为正在执行的任务续约，间隔为租约时长的三分之一
+        """
+        interval = max(1.0, self.queue.lease_seconds / 3)
+        while not self.stopped.wait(interval):
+            with self.lock:
+                job_ids = list(self.active)
+            try:
+                held = self.queue.renew(job_ids, self.node)
+            except Exception as e:
+                logging.error(f'任务续约失败: {str(e)}')
+                continue
+            for job_id in set(job_ids) - held:
+                logging.error(f'任务 {job_id} 的租约已被其它节点接手')
+
+    def execute(self, job):
+        """
+        执行一个任务并记录结果
+        """
+        with self.lock:
+            self.active.add(job.id)
+        try:
+            result = self.runner.run_account(job.account)
+        finally:
+            with self.lock:
+                self.active.discard(job.id)
+        result['node'] = self.node
+        if not result['error']:
+            if not self.queue.complete(job, self.node, result):
+                logging.error(f'{job} 的租约已过期，结果未写入')
+        elif self.queue.fail(job, self.node, result['error'], result):
+            logging.info(f'{job} 失败，稍后重试: {result["error"]}')
+        else:
+            logging.error(f'{job} 失败，已达到最大尝试次数: {result["error"]}')
+        with self.lock:
+            self.processed += 1
+
+    def loop(self):
+        """
+        单个线程的领取循环
+        """
+        while not self.stopped.is_set():
+            try:
+                job = self.queue.lease(self.node)
+                if job is None:
+                    if not self.wait and not self.queue.unfinished():
+                        return
+                    self.stopped.wait(self.poll_interval)
+                    continue
+            except Exception as e:
+                logging.error(f'读取任务队列失败: {str(e)}')
+                self.stopped.wait(self.poll_interval)
+                continue
+            logging.info(f'节点 {self.node} 领取 {job}')
+            self.execute(job)
+
+    def run(self):
+        """
+        运行到队列中没有未完成的任务（wait为True时一直运行）
+
+        返回:
+            本节点处理的任务数
+        """
+        renewer = threading.Thread(target=self.renew_leases, name='lease-renew', daemon=True)
+        renewer.start()
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='worker') as pool:
+            futures = [pool.submit(self.loop) for _ in range(self.workers)]
+            try:
+                for future in futures:
+                    future.result()
+            finally:
+                # 中断时不再领取新任务，等执行中的任务完成
+                self.stopped.set()
+        return self.processed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='多节点签到的工作节点')
+    parser.add_argument('queue', help='队列数据库文件路径，所有节点使用同一个文件')
+    parser.add_argument('--batch', help='批次名称，默认为当天日期')
+    parser.add_argument('--node', help='节点标识，默认为主机名和进程号')
+    parser.add_argument('--proxy', help='本节点使用的代理，默认取环境变量DISCUZ_PROXY')
+    parser.add_argument('--workers', type=int, default=4, help='同时执行的账号数，默认4')
+    parser.add_argument('--per-host', type=int, default=2, help='本节点同一论坛的并发账号数，默认2')
+    parser.add_argument('--lease', type=int, help='租约时长（秒），默认取环境变量QUEUE_LEASE_SECONDS或300')
+    parser.add_argument('--poll-interval', type=float, default=5.0, help='没有可领取的任务时的等待时间（秒）')
+    parser.add_argument('--wait', action='store_true', help='队列清空后继续等待新任务')
+    parser.add_argument('--no-session-cache', action='store_true', help='不使用会话缓存')
+    parser.add_argument('--lean', action='store_true', help='只签到，不输出积分和金币数量')
+    parser.add_argument('--no-journal', action='store_true', help='不使用运行记录，重新执行所有步骤')
+    args = parser.parse_args(argv)
+
+    if args.proxy:
+        get_transport().config.proxy = args.proxy
+    queue = WorkQueue(args.queue, args.batch)
+    if args.lease:
+        queue.lease_seconds = args.lease
+    runner = BatchRunner([], per_host=args.per_host,
+                         session_cache=None if args.no_session_cache else SessionCache(),
+                         captcha_stats=CaptchaStats(), lean=args.lean,
+                         journal=None if args.no_journal else RunJournal())
+    worker = QueueWorker(queue, runner, args.node, args.workers, args.poll_interval, args.wait)
+    logging.info(f'节点 {worker.node} 开始领取批次 {queue.batch} 的任务'
+                 + ('，使用代理' if get_transport().config.proxy else ''))
+    start = time.time()
+    try:
+        processed = worker.run()
+    except KeyboardInterrupt:
+        logging.info(f'节点 {worker.node} 已停止，处理了 {worker.processed} 个任务')
+        return 1
+    logging.info(f'节点 {worker.node} 处理了 {processed} 个任务，耗时 {time.time() - start:.1f}s，'
+                 f'验证码识别统计: {get_ocr_service().stats()}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())